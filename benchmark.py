@@ -0,0 +1,691 @@
+#!/usr/bin/env python3
+"""
+企业文档检索 RAG 系统离线基准测试
+使用进程内的 Bedrock / S3 替身（src/fake_aws.py）注入可控延迟，
+测量系统自身开销、吞吐量、尾延迟和内存占用，结果以 JSONL 追加写入便于长期跟踪
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import platform
+import tempfile
+import tracemalloc
+import subprocess
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+# 添加 src 目录以使用共享模块
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src'))
+from fake_aws import FakeBedrockAgentRuntime, FakeS3, LatencyModel
+from batch_runner import percentile
+from throttling import RequestGuard
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# 替身不访问网络，但创建 boto3 客户端仍需要区域
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+QUESTIONS = [
+    "公司的请假制度是什么？",
+    "如何设置VPN连接？",
+    "差旅费报销标准是多少？",
+    "加班工资如何计算？",
+    "网络连接问题怎么解决？",
+    "财务审批流程是什么？",
+]
+
+# 快速路径场景：以查表式问题为主，混入需要生成的问题
+LOOKUP_QUESTIONS = [
+    "差旅费住宿标准是多少？",
+    "办公用品采购审批权限",
+    "周末加班工资",
+    "VPN服务器地址",
+    "如何设置VPN连接？",
+    "网络连接问题怎么解决？",
+]
+
+SCENARIOS = ['demo-query', 'demo-stream', 'demo-local', 'demo-hybrid', 'demo-fast', 'demo-burst', 'demo-throttle',
+             'demo-route', 'demo-retrieval-cache', 'index-rebuild', 'agent-query', 'upload', 'client-setup', 'cli-startup']
+
+# 模型分级场景：查表式问题为主，混入需要综合比较的问题
+ROUTE_QUESTIONS = LOOKUP_QUESTIONS + [
+    "比较年假和病假制度的区别，以及请假审批流程",
+    "如果出差期间加班，加班费和差旅补贴如何计算？是否可以同时报销？",
+]
+# 替身中各档位模型相对 Pro 的延迟系数
+MODEL_LATENCY = {'nova-micro': 0.35, 'nova-lite': 0.5}
+
+# 限流场景未指定 --throttle-qps 时替身的限流阈值（次/秒）
+DEFAULT_THROTTLE_QPS = 20.0
+
+# 突发场景：大量用户同时提出同一个问题（写法略有不同）
+BURST_QUESTIONS = [
+    "公司的请假制度是什么？",
+    "公司的请假制度是什么?",
+    "公司的 请假制度是什么",
+]
+
+# 一个浏览器会话（EnterpriseRAG / enterprise_ui）需要的客户端
+SESSION_SERVICES = ('s3', 'bedrock-agent-runtime', 'bedrock-agent')
+
+
+class ScenarioSkipped(Exception):
+    """当前环境无法运行该场景"""
+
+
+def _peak_rss_kb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS 返回字节，Linux 返回 KB
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def latency_summary(latencies):
+    values = sorted(latencies)
+    return {
+        'mean': sum(values) / len(values) if values else 0.0,
+        'p50': percentile(values, 50),
+        'p95': percentile(values, 95),
+        'p99': percentile(values, 99),
+        'max': values[-1] if values else 0.0,
+    }
+
+
+def run_concurrent(call, requests, concurrency):
+    """以固定并发执行 call(i)，返回 (延迟列表, 首段耗时列表, 失败数, 总耗时)
+
+    call 返回 (是否成功, 首段耗时或 None)。
+    """
+    def timed(i):
+        start = time.perf_counter()
+        ok, ttfc = call(i)
+        return ok, ttfc, time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="bench") as executor:
+        outcomes = list(executor.map(timed, range(requests)))
+    elapsed = time.perf_counter() - start
+
+    latencies = [latency for ok, _, latency in outcomes if ok]
+    ttfcs = [ttfc for ok, ttfc, _ in outcomes if ok and ttfc is not None]
+    failed = sum(1 for ok, _, _ in outcomes if not ok)
+    return latencies, ttfcs, failed, elapsed
+
+
+class Benchmark:
+    """基准测试场景集合，每个场景返回一条报告字典"""
+
+    def __init__(self, args):
+        self.args = args
+
+    def make_runtime(self, throttle_qps=None, model_latency=None):
+        args = self.args
+        latency = LatencyModel.parse(args.latency, seed=args.seed)
+        first_chunk = LatencyModel.parse(args.first_chunk_latency, seed=args.seed) if args.first_chunk_latency else None
+        return FakeBedrockAgentRuntime(latency=latency, first_chunk_latency=first_chunk,
+                                       chunk_interval=args.chunk_interval, chunk_size=args.chunk_size,
+                                       throttle_qps=throttle_qps or args.throttle_qps, model_latency=model_latency)
+
+    @staticmethod
+    def fresh_guards():
+        """每个场景使用独立的 RequestGuard，限速和熔断状态不在场景之间延续"""
+        return {'guard': RequestGuard('retrieve_and_generate'), 'retrieve_guard': RequestGuard('retrieve')}
+
+    def _query_report(self, runtime, latencies, ttfcs, failed, elapsed):
+        completed = len(latencies) + failed
+        report = {
+            'requests': completed,
+            'succeeded': len(latencies),
+            'failed': failed,
+            'throttled': runtime.throttled,
+            'elapsed': elapsed,
+            'throughput': completed / elapsed if elapsed else 0.0,
+            'latency': latency_summary(latencies),
+        }
+        if ttfcs:
+            report['time_to_first_chunk'] = latency_summary(ttfcs)
+        # 客户端观测延迟减去替身注入的服务端耗时，即系统自身开销
+        if latencies and runtime.injected:
+            # 快速路径请求不调用模型，按请求数而非调用次数平均
+            injected_per_request = sum(runtime.injected) / max(1, completed - runtime.throttled)
+            report['overhead_mean'] = report['latency']['mean'] - injected_per_request
+        return report
+
+    def demo_query(self, concurrency):
+        from demo import EnterpriseRAGDemo
+        runtime = self.make_runtime()
+        demo = EnterpriseRAGDemo(client=runtime, cache_factory=None, **self.fresh_guards())
+
+        def call(i):
+            result = demo.query(QUESTIONS[i % len(QUESTIONS)])
+            return 'error' not in result, None
+
+        try:
+            return self._query_report(runtime, *run_concurrent(call, self.args.requests, concurrency))
+        finally:
+            demo.async_engine.shutdown()
+
+    def demo_stream(self, concurrency):
+        from demo import EnterpriseRAGDemo
+        runtime = self.make_runtime()
+        demo = EnterpriseRAGDemo(client=runtime, cache_factory=None, **self.fresh_guards())
+
+        def call(i):
+            stream = demo.stream_query(QUESTIONS[i % len(QUESTIONS)])
+            for _ in stream:
+                pass
+            return 'error' not in stream.result, stream.result.get('time_to_first_chunk')
+
+        try:
+            return self._query_report(runtime, *run_concurrent(call, self.args.requests, concurrency))
+        finally:
+            demo.async_engine.shutdown()
+
+    def demo_local(self, concurrency, hybrid=False, fast_path=None, questions=QUESTIONS):
+        """本地向量索引检索（离线哈希嵌入）+ 替身生成"""
+        from demo import EnterpriseRAGDemo
+        from retrieval import build_local_retriever
+        runtime = self.make_runtime()
+        documents_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'documents')
+        retriever = build_local_retriever(documents_path, hybrid=hybrid)
+        demo = EnterpriseRAGDemo(client=runtime, cache_factory=None, retriever=retriever, fast_path=fast_path,
+                                 **self.fresh_guards())
+        retrieval_times = []
+        paths = []
+
+        def call(i):
+            result = demo.query(questions[i % len(questions)])
+            if 'retrieval_time' in result:
+                retrieval_times.append(result['retrieval_time'])
+            paths.append(result.get('path'))
+            return 'error' not in result, None
+
+        try:
+            report = self._query_report(runtime, *run_concurrent(call, self.args.requests, concurrency))
+            report['retrieval'] = latency_summary(retrieval_times)
+            if fast_path is not None:
+                report['fast_path_ratio'] = paths.count('fast') / len(paths) if paths else 0.0
+                report['model_calls'] = runtime.calls
+            return report
+        finally:
+            demo.async_engine.shutdown()
+
+    def demo_hybrid(self, concurrency):
+        """向量 + BM25 混合检索 + 替身生成"""
+        return self.demo_local(concurrency, hybrid=True)
+
+    def demo_fast(self, concurrency):
+        """混合检索 + 快速路径：查表式问题不调用模型"""
+        from fast_path import FastPathAnswerer
+        return self.demo_local(concurrency, hybrid=True, fast_path=FastPathAnswerer(), questions=LOOKUP_QUESTIONS)
+
+    def demo_burst(self, concurrency):
+        """同一问题的突发请求（一半流式），相同问题通过 single-flight 合并"""
+        from demo import EnterpriseRAGDemo
+        from single_flight import SingleFlight
+        runtime = self.make_runtime()
+        flights = SingleFlight()
+        demo = EnterpriseRAGDemo(client=runtime, cache_factory=None, single_flight=flights, **self.fresh_guards())
+
+        def call(i):
+            question = BURST_QUESTIONS[i % len(BURST_QUESTIONS)]
+            if i % 2:
+                stream = demo.stream_query(question)
+                for _ in stream:
+                    pass
+                return 'error' not in stream.result, stream.result.get('time_to_first_chunk')
+            return 'error' not in demo.query(question), None
+
+        try:
+            report = self._query_report(runtime, *run_concurrent(call, self.args.requests, concurrency))
+            stats = flights.stats()
+            # 跟随者等待的是领头请求的模型耗时，按调用次数扣除注入延迟的自身开销在此没有意义
+            report.pop('overhead_mean', None)
+            report.update(model_calls=runtime.calls, coalescing_ratio=stats['coalescing_ratio'],
+                          saved_calls=stats['saved_calls'])
+            return report
+        finally:
+            demo.async_engine.shutdown()
+
+    def demo_throttle(self, concurrency):
+        """替身按 --throttle-qps（默认 20 次/秒）限流，对比直接调用与经过 RequestGuard（自适应限速 + 熔断）"""
+        from demo import EnterpriseRAGDemo
+        from kb_query import KnowledgeBaseQuery
+        qps = self.args.throttle_qps or DEFAULT_THROTTLE_QPS
+        runtime = self.make_runtime(throttle_qps=qps)
+        guards = self.fresh_guards()
+        demo = EnterpriseRAGDemo(client=runtime, cache_factory=None, **guards)
+        baseline_runtime = self.make_runtime(throttle_qps=qps)
+        baseline = KnowledgeBaseQuery(baseline_runtime, demo.kb_id, demo.model_arn)
+
+        def call(query):
+            def timed(i):
+                result = query(QUESTIONS[i % len(QUESTIONS)])
+                return 'error' not in result, None
+            return timed
+
+        try:
+            unguarded = self._query_report(baseline_runtime,
+                                           *run_concurrent(call(baseline.query), self.args.requests, concurrency))
+            report = self._query_report(runtime, *run_concurrent(call(demo.query), self.args.requests, concurrency))
+            # 被限流后重试的请求包含多次注入延迟，自身开销在此没有意义
+            report.pop('overhead_mean', None)
+            state = guards['guard'].state()
+            report.update(throttle_qps=qps, model_calls=runtime.calls, limiter_rate=state['rate'],
+                          breaker=state['breaker'],
+                          unguarded={key: unguarded[key] for key in ('succeeded', 'failed', 'throttled', 'throughput')})
+            return report
+        finally:
+            demo.async_engine.shutdown()
+
+    def demo_route(self, concurrency):
+        """混合检索 + 按复杂度选择模型档位，对比固定使用 Pro（替身中小模型按 MODEL_LATENCY 更快）"""
+        from demo import EnterpriseRAGDemo
+        from retrieval import build_local_retriever
+        from metrics import MetricsRegistry
+        from model_router import ModelRouter, NOVA_TIERS
+        documents_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'documents')
+        retriever = build_local_retriever(documents_path, hybrid=True)
+        reports = {}
+        routers = {
+            'routed': ModelRouter(registry=MetricsRegistry()),
+            # 只有 Pro 一档：与改动前相同的模型选择，同样估算费用
+            'pro': ModelRouter(tiers=NOVA_TIERS[-1:], thresholds=(), registry=MetricsRegistry()),
+        }
+        for name, router in routers.items():
+            runtime = self.make_runtime(model_latency=MODEL_LATENCY)
+            demo = EnterpriseRAGDemo(client=runtime, cache_factory=None, retriever=retriever, router=router,
+                                     **self.fresh_guards())
+
+            def call(i):
+                result = demo.query(ROUTE_QUESTIONS[i % len(ROUTE_QUESTIONS)])
+                return 'error' not in result, None
+
+            try:
+                reports[name] = self._query_report(runtime, *run_concurrent(call, self.args.requests, concurrency))
+            finally:
+                demo.async_engine.shutdown()
+            stats = router.stats()
+            reports[name]['tiers'] = {tier: row['calls'] for tier, row in stats.items()}
+            reports[name]['cost_usd'] = sum(row['cost_usd'] for row in stats.values())
+        report = reports['routed']
+        report['pro_only'] = {key: reports['pro'][key] for key in ('latency', 'cost_usd')}
+        return report
+
+    def demo_retrieval_cache(self, concurrency):
+        """先检索再生成（EXTERNAL_SOURCES），对比每次调用 retrieve 与检索结果缓存（问题按 QUESTIONS 重复）"""
+        from demo import EnterpriseRAGDemo
+        from retrieval_cache import RetrievalCache
+        reports = {}
+        # 容量为 0 的缓存：同样先检索再生成，但每次都调用 retrieve
+        factories = (('uncached', lambda kb_id: RetrievalCache(max_entries=0)),
+                     ('cached', lambda kb_id: RetrievalCache()))
+        for name, factory in factories:
+            runtime = self.make_runtime()
+            demo = EnterpriseRAGDemo(client=runtime, cache_factory=None, retrieval_cache_factory=factory,
+                                     **self.fresh_guards())
+            retrieval_times = []
+
+            def call(i):
+                result = demo.query(QUESTIONS[i % len(QUESTIONS)])
+                if 'retrieval_time' in result:
+                    retrieval_times.append(result['retrieval_time'])
+                return 'error' not in result, None
+
+            try:
+                report = self._query_report(runtime, *run_concurrent(call, self.args.requests, concurrency))
+            finally:
+                demo.async_engine.shutdown()
+            # 每次查询包含检索和生成两次注入延迟，按请求扣除的自身开销在此没有意义
+            report.pop('overhead_mean', None)
+            report.update(retrieval=latency_summary(retrieval_times), model_calls=runtime.calls,
+                          cache_hit_rate=demo.retrieval_cache.stats()['hit_rate'])
+            reports[name] = report
+        report = reports['cached']
+        report['uncached'] = {key: reports['uncached'][key] for key in ('latency', 'retrieval', 'model_calls')}
+        return report
+
+    def index_rebuild(self, concurrency):
+        """documents/ 的副本：冷启动构建本地索引，修改一个文件中的一行后重建，统计实际向量化的片段数"""
+        import shutil
+        from local_index import HashingEmbedder
+        from index_store import load_or_build
+        from embedding_store import CachingEmbedder, EmbeddingStore
+
+        class CountingEmbedder(HashingEmbedder):
+            def __init__(self):
+                super().__init__()
+                self.embedded = 0
+
+            def embed(self, texts):
+                self.embedded += len(texts)
+                return super().embed(texts)
+
+        source = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'documents')
+        with tempfile.TemporaryDirectory(prefix="rag-bench-") as workdir:
+            documents_path = os.path.join(workdir, 'documents')
+            shutil.copytree(source, documents_path)
+            index_path = os.path.join(workdir, 'local_index.bin')
+            counting = CountingEmbedder()
+            store = EmbeddingStore(os.path.join(workdir, 'embeddings.db'))
+            embedder = CachingEmbedder(counting, store)
+
+            start = time.perf_counter()
+            chunks = len(load_or_build(documents_path, index_path, embedder))
+            cold_elapsed = time.perf_counter() - start
+            cold_embedded = counting.embedded
+
+            name = sorted(n for n in os.listdir(documents_path) if n.endswith('.md'))[0]
+            path = os.path.join(documents_path, name)
+            with open(path, encoding='utf-8') as f:
+                lines = f.read().split('\n')
+            # 修改最后一个非空行，指纹（大小、修改时间）随之变化
+            row = max(i for i, line in enumerate(lines) if line.strip())
+            lines[row] += "（已更新）"
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write('\n'.join(lines))
+
+            start = time.perf_counter()
+            load_or_build(documents_path, index_path, embedder)
+            rebuild_elapsed = time.perf_counter() - start
+            stored = len(store)
+            store.close()
+        return {
+            'chunks': chunks,
+            'cold_embedded': cold_embedded,
+            'cold_elapsed': cold_elapsed,
+            'rebuild_embedded': counting.embedded - cold_embedded,
+            'rebuild_elapsed': rebuild_elapsed,
+            'stored_vectors': stored,
+        }
+
+    def _enterprise_rag(self, **clients):
+        try:
+            from enterprise_rag import EnterpriseRAG
+        except ImportError as e:
+            raise ScenarioSkipped(f"无法导入 enterprise_rag: {e}")
+        return EnterpriseRAG(guard=RequestGuard('invoke_agent'), **clients)
+
+    def agent_query(self, concurrency):
+        runtime = self.make_runtime()
+        rag = self._enterprise_rag(bedrock_client=runtime, s3_client=FakeS3())
+        rag.agent_id, rag.agent_alias_id = "FAKEAGENT", "FAKEALIAS"
+
+        def call(i):
+            try:
+                answer = rag.query_documents(QUESTIONS[i % len(QUESTIONS)])
+            except Exception:
+                return False, None
+            return bool(answer), None
+
+        try:
+            return self._query_report(runtime, *run_concurrent(call, self.args.requests, concurrency))
+        finally:
+            rag.async_engine.shutdown()
+
+    def upload(self, concurrency):
+        """冷启动全量上传 + 无变化时的增量同步"""
+        args = self.args
+        s3 = FakeS3(latency=LatencyModel.parse(args.s3_latency, seed=args.seed), throttle_qps=args.s3_throttle_qps)
+        try:
+            rag = self._enterprise_rag(s3_client=s3, upload_workers=concurrency)
+            upload = lambda path: rag.upload_documents(path, "fake-bucket")
+            target = "EnterpriseRAG.upload_documents"
+        except ScenarioSkipped:
+            # 没有 workshop 依赖时直接测量 upload_documents 所使用的同步引擎
+            from document_sync import DocumentSync
+            from upload_engine import ParallelUploader
+            sync = DocumentSync(s3, uploader=ParallelUploader(s3, max_workers=concurrency, fetch_etags=True))
+            upload = lambda path: sync.sync(path, "fake-bucket", prefix="documents/")
+            target = "document_sync.DocumentSync"
+
+        payload = os.urandom(args.file_size)
+        with tempfile.TemporaryDirectory(prefix="rag-bench-") as documents_path:
+            for i in range(args.files):
+                with open(os.path.join(documents_path, f"doc_{i:05d}.md"), 'wb') as f:
+                    f.write(payload[:-8] + i.to_bytes(8, 'big'))
+
+            start = time.perf_counter()
+            result = upload(documents_path)
+            elapsed = time.perf_counter() - start
+
+            start = time.perf_counter()
+            resync = upload(documents_path)
+            resync_elapsed = time.perf_counter() - start
+
+        total_bytes = args.files * args.file_size
+        return {
+            'target': target,
+            'files': args.files,
+            'bytes': total_bytes,
+            'uploaded': len(result.uploaded),
+            'retries': result.upload_report.retries if result.upload_report else 0,
+            'throttled': s3.throttled,
+            'elapsed': elapsed,
+            'files_per_second': args.files / elapsed if elapsed else 0.0,
+            'bytes_per_second': total_bytes / elapsed if elapsed else 0.0,
+            'resync_elapsed': resync_elapsed,
+            'resync_uploaded': len(resync.uploaded),
+        }
+
+    def client_setup(self, concurrency):
+        """每个会话各自创建客户端（boto3.client）与共享客户端工厂（aws_clients.get_client）的会话初始化耗时
+
+        只测本地开销（服务模型加载、端点解析、凭证查找）；共享连接池省下的 TLS 握手需要访问网络，不在此统计。
+        """
+        import boto3
+        from aws_clients import get_client, clear_clients
+
+        def per_session(i):
+            start = time.perf_counter()
+            for service in SESSION_SERVICES:
+                boto3.client(service)
+            return time.perf_counter() - start
+
+        def shared(i):
+            start = time.perf_counter()
+            for service in SESSION_SERVICES:
+                get_client(service)
+            return time.perf_counter() - start
+
+        clear_clients()
+        cold = shared(0)
+        sessions = self.args.requests
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            start = time.perf_counter()
+            per_session_times = list(pool.map(per_session, range(sessions)))
+            per_session_elapsed = time.perf_counter() - start
+            start = time.perf_counter()
+            shared_times = list(pool.map(shared, range(sessions)))
+            shared_elapsed = time.perf_counter() - start
+        per_session_summary = latency_summary(per_session_times)
+        shared_summary = latency_summary(shared_times)
+        return {
+            'sessions': sessions,
+            'services': list(SESSION_SERVICES),
+            'per_session': per_session_summary,
+            'per_session_elapsed': per_session_elapsed,
+            'shared': shared_summary,
+            'shared_elapsed': shared_elapsed,
+            'shared_cold': cold,
+            'saved_per_session': per_session_summary['mean'] - shared_summary['mean'],
+        }
+
+    def cli_startup(self, concurrency):
+        """enterprise_rag.py 冷启动：新进程执行 --help 的耗时、导入模块的耗时和最慢的导入（-X importtime）"""
+        src_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src')
+
+        def timed(command):
+            times = []
+            for _ in range(self.args.startup_runs):
+                start = time.perf_counter()
+                subprocess.run(command, cwd=src_path, capture_output=True, check=True)
+                times.append(time.perf_counter() - start)
+            return latency_summary(times)
+
+        interpreter = timed([sys.executable, '-c', 'pass'])
+        cli_help = timed([sys.executable, 'enterprise_rag.py', '--help'])
+        module_import = timed([sys.executable, '-c', 'import enterprise_rag'])
+        probe = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c',
+             "import enterprise_rag, sys; print(','.join(m for m in ('boto3', 'botocore', 'numpy', 'src.utils') if m in sys.modules))"],
+            cwd=src_path, capture_output=True, text=True, check=True)
+        # enterprise_rag 直接导入的模块（缩进一级），按累计耗时排序
+        imports = []
+        for line in probe.stderr.splitlines():
+            parts = line.split('|')
+            if len(parts) == 3 and parts[1].strip().isdigit() and parts[2].startswith('   ') \
+                    and not parts[2].startswith('    '):
+                imports.append((parts[2].strip(), int(parts[1]) / 1e6))
+        return {
+            'runs': self.args.startup_runs,
+            'interpreter': interpreter,
+            'cli_help': cli_help,
+            'module_import': module_import,
+            'loaded_heavy_modules': [m for m in probe.stdout.strip().split(',') if m],
+            'slowest_imports': sorted(imports, key=lambda item: item[1], reverse=True)[:5],
+        }
+
+    def run(self, scenario, concurrency):
+        if self.args.tracemalloc:
+            tracemalloc.start()
+        started = time.perf_counter()
+        try:
+            report = getattr(self, scenario.replace('-', '_'))(concurrency)
+            status = 'ok'
+        except ScenarioSkipped as e:
+            report = {'reason': str(e)}
+            status = 'skipped'
+        memory = {'peak_rss_kb': _peak_rss_kb()}
+        if self.args.tracemalloc:
+            memory['tracemalloc_peak_bytes'] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        report.update({
+            'scenario': scenario,
+            'status': status,
+            'concurrency': concurrency,
+            'wall_time': time.perf_counter() - started,
+            'memory': memory,
+        })
+        return report
+
+
+def print_report(report):
+    head = f"[{report['scenario']} x{report['concurrency']}]"
+    if report['status'] == 'skipped':
+        print(f"{head} 跳过: {report['reason']}")
+        return
+    if 'latency' in report:
+        latency = report['latency']
+        line = (f"{head} {report['succeeded']}/{report['requests']} 成功, 限流 {report['throttled']}, "
+                f"吞吐 {report['throughput']:.1f} 次/秒, P50 {latency['p50'] * 1000:.1f}ms, "
+                f"P95 {latency['p95'] * 1000:.1f}ms, P99 {latency['p99'] * 1000:.1f}ms")
+        if 'overhead_mean' in report:
+            line += f", 自身开销 {report['overhead_mean'] * 1000:.2f}ms"
+        if 'time_to_first_chunk' in report:
+            line += f", 首段 P50 {report['time_to_first_chunk']['p50'] * 1000:.1f}ms"
+        if 'retrieval' in report:
+            line += f", 检索 P50 {report['retrieval']['p50'] * 1000:.2f}ms"
+        if 'fast_path_ratio' in report:
+            line += f", 快速路径 {report['fast_path_ratio']:.0%}"
+        if 'coalescing_ratio' in report:
+            line += f", 合并 {report['coalescing_ratio']:.0%}（模型调用 {report['model_calls']} 次）"
+        if 'pro_only' in report:
+            pro = report['pro_only']
+            line += (f", 档位 {report['tiers']}, 估算费用 ${report['cost_usd']:.4f}"
+                     f"（固定 Pro: P50 {pro['latency']['p50'] * 1000:.1f}ms, ${pro['cost_usd']:.4f}）")
+        if 'cache_hit_rate' in report:
+            uncached = report['uncached']
+            line += (f", 检索缓存命中 {report['cache_hit_rate']:.0%}, 服务调用 {report['model_calls']} 次"
+                     f"（不缓存: P50 {uncached['latency']['p50'] * 1000:.1f}ms, "
+                     f"检索 P50 {uncached['retrieval']['p50'] * 1000:.1f}ms, 服务调用 {uncached['model_calls']} 次）")
+        if 'unguarded' in report:
+            rate = report['limiter_rate']
+            line += (f", 限速 {'不限' if rate is None else f'{rate:.1f} 次/秒'}, 熔断 {report['breaker']}"
+                     f"（不限速时 {report['unguarded']['succeeded']}/{report['requests']} 成功, "
+                     f"限流 {report['unguarded']['throttled']}）")
+    elif 'cli_help' in report:
+        line = (f"{head} 解释器 P50 {report['interpreter']['p50'] * 1000:.0f}ms, "
+                f"--help P50 {report['cli_help']['p50'] * 1000:.0f}ms, "
+                f"import enterprise_rag P50 {report['module_import']['p50'] * 1000:.0f}ms, "
+                f"导入时加载: {', '.join(report['loaded_heavy_modules']) or '无 boto3/numpy'}")
+    elif 'rebuild_embedded' in report:
+        line = (f"{head} {report['chunks']} 个片段: 冷启动向量化 {report['cold_embedded']} 个 "
+                f"{report['cold_elapsed'] * 1000:.0f}ms, 修改一行后重建向量化 {report['rebuild_embedded']} 个 "
+                f"{report['rebuild_elapsed'] * 1000:.0f}ms, 向量库 {report['stored_vectors']} 条")
+    elif 'saved_per_session' in report:
+        line = (f"{head} {report['sessions']} 个会话: 各自创建客户端 P50 {report['per_session']['p50'] * 1000:.1f}ms, "
+                f"共享客户端 P50 {report['shared']['p50'] * 1000:.3f}ms（首次 {report['shared_cold'] * 1000:.1f}ms）, "
+                f"每会话节省 {report['saved_per_session'] * 1000:.1f}ms")
+    else:
+        line = (f"{head} {report['target']}: {report['files']} 个文件 {report['elapsed']:.2f}s "
+                f"({report['files_per_second']:.1f} 文件/秒, {report['bytes_per_second'] / 1024 / 1024:.1f} MB/秒), "
+                f"增量同步 {report['resync_elapsed']:.2f}s")
+    print(f"{line}, 峰值 RSS {report['memory']['peak_rss_kb']} KB")
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='离线基准测试（使用本地 Bedrock / S3 替身）')
+    parser.add_argument('--scenario', action='append', choices=SCENARIOS,
+                        help='要运行的场景，可重复指定（默认全部）')
+    parser.add_argument('--concurrency', default='1,8,32', help='并发数列表，逗号分隔')
+    parser.add_argument('--requests', type=int, default=200, help='每轮查询请求数')
+    parser.add_argument('--latency', default='lognormal:0.05:0.5',
+                        help='模型响应延迟分布：常数秒数，或 constant/uniform/normal/lognormal:参数')
+    parser.add_argument('--first-chunk-latency', default=None, help='流式首段延迟分布（默认同 --latency）')
+    parser.add_argument('--chunk-interval', type=float, default=0.002, help='流式分段间隔（秒）')
+    parser.add_argument('--chunk-size', type=int, default=8, help='流式分段大小')
+    parser.add_argument('--throttle-qps', type=float, default=None, help='替身限流阈值（次/秒）')
+    parser.add_argument('--files', type=int, default=200, help='上传场景的文件数')
+    parser.add_argument('--file-size', type=int, default=64 * 1024, help='上传场景的单个文件大小（字节）')
+    parser.add_argument('--s3-latency', default='0.005', help='S3 请求延迟分布')
+    parser.add_argument('--s3-throttle-qps', type=float, default=None, help='S3 限流阈值（次/秒）')
+    parser.add_argument('--startup-runs', type=int, default=5, help='冷启动场景每条命令的运行次数')
+    parser.add_argument('--seed', type=int, default=42, help='延迟分布随机种子')
+    parser.add_argument('--tracemalloc', action='store_true', help='用 tracemalloc 统计 Python 堆峰值（会增加开销）')
+    parser.add_argument('--output', default='benchmark_results.jsonl', help='结果文件（JSONL，追加写入）')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    run_info = {
+        'run_at': datetime.now().isoformat(timespec='seconds'),
+        'git_revision': _git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': {k: v for k, v in vars(args).items() if k != 'output'},
+    }
+    benchmark = Benchmark(args)
+    concurrencies = [int(c) for c in args.concurrency.split(',') if c.strip()]
+
+    with open(args.output, 'a', encoding='utf-8') as out:
+        for scenario in args.scenario or SCENARIOS:
+            for concurrency in concurrencies:
+                report = benchmark.run(scenario, concurrency)
+                report.update(run_info)
+                print_report(report)
+                out.write(json.dumps(report, ensure_ascii=False) + '\n')
+                out.flush()
+
+    print(f"\n📊 结果已追加到 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,52 +3,61 @@
 企业文档检索 RAG 系统演示
 """
 
-import boto3
+import asyncio
+import atexit
 import time
 import sys
+import os
 from datetime import datetime
 
+# 添加 src 目录以使用共享模块
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src'))
+from async_query import AsyncQueryEngine, run_sync
+from answer_cache import build_answer_cache
+from retrieval_cache import build_retrieval_cache
+from kb_query import KnowledgeBaseQuery
+from aws_clients import get_client
+from throttling import RequestGuard, get_guard
+from batch_runner import BatchRunner
+from metrics import REGISTRY
+
 class EnterpriseRAGDemo:
-    def __init__(self):
-        self.client = boto3.client('bedrock-agent-runtime')
+    def __init__(self, max_concurrency=8, query_timeout=60, cache_factory=build_answer_cache, client=None,
+                 retriever=None, fast_path=None, single_flight=None, guard=None, retrieve_guard=None,
+                 router=None, retrieval_cache_factory=None):
+        self.client = client or get_client('bedrock-agent-runtime')
         self.kb_id = "HCDVL6Q0KZ"
         self.model_arn = "arn:aws:bedrock:us-east-1::foundation-model/amazon.nova-pro-v1:0"
+        self.cache = cache_factory(self.kb_id, self.model_arn) if cache_factory else None
+        self.retrieval_cache = retrieval_cache_factory(self.kb_id) if retrieval_cache_factory else None
+        self.kb_query = KnowledgeBaseQuery(self.client, self.kb_id, self.model_arn, cache=self.cache,
+                                           retriever=retriever, fast_path=fast_path,
+                                           single_flight=single_flight,
+                                           guard=guard or get_guard('retrieve_and_generate'),
+                                           retrieve_guard=retrieve_guard or get_guard('retrieve'),
+                                           router=router, retrieval_cache=self.retrieval_cache)
+        self.query_timeout = query_timeout
+        self.async_engine = AsyncQueryEngine(max_concurrency=max_concurrency, timeout=query_timeout)
         
     def query(self, question):
-        """查询知识库"""
+        """查询知识库（命中问答缓存时直接返回）"""
+        return self.kb_query.query(question)
+    
+    def stream_query(self, question):
+        """流式查询知识库，迭代得到回答片段，结束后从 result 获取完整结果"""
+        return self.kb_query.stream_query(question)
+    
+    async def aquery(self, question, timeout=None):
+        """异步查询知识库"""
+        timeout = self.query_timeout if timeout is None else timeout
         try:
-            start_time = time.time()
-            response = self.client.retrieve_and_generate(
-                input={'text': question},
-                retrieveAndGenerateConfiguration={
-                    'type': 'KNOWLEDGE_BASE',
-                    'knowledgeBaseConfiguration': {
-                        'knowledgeBaseId': self.kb_id,
-                        'modelArn': self.model_arn
-                    }
-                }
-            )
-            end_time = time.time()
-            
-            answer = response['output']['text']
-            citations = []
-            
-            # 提取引用来源
-            for citation in response.get('citations', []):
-                for ref in citation.get('retrievedReferences', []):
-                    source = ref.get('location', {}).get('s3Location', {}).get('uri', '')
-                    if source:
-                        filename = source.split('/')[-1]
-                        citations.append(filename)
-            
-            return {
-                'answer': answer,
-                'citations': list(set(citations)),
-                'response_time': end_time - start_time
-            }
-            
-        except Exception as e:
-            return {'error': str(e)}
+            return await self.async_engine.run(self.query, question, timeout=timeout)
+        except asyncio.TimeoutError:
+            return {'error': f"查询超时 ({timeout}s)"}
+    
+    async def aquery_many(self, questions, timeout=None):
+        """并发查询多个问题，按输入顺序返回结果"""
+        return await asyncio.gather(*(self.aquery(question, timeout=timeout) for question in questions))
     
     def interactive_demo(self):
         """交互式演示"""
@@ -78,20 +87,28 @@ class EnterpriseRAGDemo:
             print(f"\n🔍 正在查询: {question}")
             print("⏳ 请稍候...")
             
-            result = self.query(question)
+            print("\n" + "=" * 60)
+            print("🤖 回答:")
+            stream = self.stream_query(question)
+            for text in stream:
+                print(text, end="", flush=True)
+            print()
+            result = stream.result
             
             if 'error' in result:
                 print(f"❌ 查询失败: {result['error']}")
                 continue
-                
-            print("\n" + "=" * 60)
-            print("🤖 回答:")
-            print(result['answer'])
             
             if result['citations']:
                 print(f"\n📚 信息来源: {', '.join(result['citations'])}")
                 
-            print(f"\n⏱️ 响应时间: {result['response_time']:.2f} 秒")
+            if result.get('path') == 'fast':
+                print("\n⚡ 快速路径：直接引用文档条目，未调用模型")
+            if result.get('model_tier'):
+                print(f"⚙️ 模型档位: {result['model_tier']}" + (f"（升级 {result['escalations']} 次）" if result['escalations'] else ""))
+            if result.get('time_to_first_chunk') is not None:
+                print(f"\n⚡ 首字时间: {result['time_to_first_chunk']:.2f} 秒")
+            print(f"⏱️ 响应时间: {result['response_time']:.2f} 秒")
             print("=" * 60)
     
     def batch_demo(self):
@@ -108,12 +125,13 @@ class EnterpriseRAGDemo:
             "财务审批流程是什么？"
         ]
         
-        for i, question in enumerate(demo_questions, 1):
+        print(f"⏳ 正在并发查询 {len(demo_questions)} 个问题...")
+        results = run_sync(self.aquery_many(demo_questions))
+        
+        for i, (question, result) in enumerate(zip(demo_questions, results), 1):
             print(f"\n📋 演示 {i}/{len(demo_questions)}: {question}")
             print("-" * 50)
             
-            result = self.query(question)
-            
             if 'error' in result:
                 print(f"❌ 查询失败: {result['error']}")
                 continue
@@ -131,30 +149,121 @@ class EnterpriseRAGDemo:
         
         print("\n✅ 批量演示完成！")
 
+def run_batch_file(demo, argv):
+    """从 JSONL/CSV 文件批量查询，结果流式写入 JSONL"""
+    import argparse
+    
+    parser = argparse.ArgumentParser(prog=f"{sys.argv[0]} batch", description='批量查询')
+    parser.add_argument('input', help='问题文件（.jsonl 或 .csv）')
+    parser.add_argument('--output', help='结果文件（JSONL，默认 <输入文件名>.results.jsonl）')
+    parser.add_argument('--workers', type=int, default=8, help='并发数')
+    parser.add_argument('--qps', type=float, default=None, help='每秒最大请求数（不限速时省略）')
+    parser.add_argument('--no-resume', action='store_true', help='忽略已有结果，从头开始')
+    args = parser.parse_args(argv)
+    
+    output = args.output or f"{os.path.splitext(args.input)[0]}.results.jsonl"
+    print(f"🚀 批量查询: {args.input} -> {output}")
+    runner = BatchRunner(demo.query, max_workers=args.workers, qps=args.qps)
+    summary = runner.run(args.input, output, resume=not args.no_resume)
+    
+    print("✅ 批量查询完成")
+    print(f"   成功 {summary['succeeded']} 条, 失败 {summary['failed']} 条, 跳过（已完成） {summary['skipped']} 条, 重试 {summary['retries']} 次")
+    print(f"   吞吐量: {summary['throughput']:.2f} 条/秒, 总耗时 {summary['elapsed']:.1f} 秒")
+    print(f"   延迟: P50 {summary['p50']:.2f}s, P95 {summary['p95']:.2f}s, P99 {summary['p99']:.2f}s")
+    for stage, row in REGISTRY.summary().items():
+        print(f"   阶段 {stage}: P50 {row['p50']:.3f}s, P95 {row['p95']:.3f}s")
+    if demo.kb_query.router is not None:
+        for tier, row in demo.kb_query.router.stats().items():
+            print(f"   模型 {tier}: {row['calls']} 次, P50 {row['p50']:.3f}s, 估算费用 ${row['cost_usd']:.4f}")
+
+def print_usage():
+    print("用法:")
+    print("  python demo.py                    - 交互式演示")
+    print("  python demo.py batch              - 批量演示")
+    print("  python demo.py batch 问题.jsonl [--output 结果.jsonl] [--workers 8] [--qps 5]  - 文件批量查询")
+    print("  python demo.py query \"您的问题\"    - 单次查询")
+    print("  任意命令后加 --local-index         - 使用本地向量索引检索 documents/")
+    print("  任意命令后加 --fast-path           - 查表式问题直接引用文档条目作答（不调用模型）")
+    print("  任意命令后加 --route-models        - 按问题复杂度选择模型档位（Micro / Lite / Pro）")
+    print("  任意命令后加 --retrieval-cache     - 缓存检索结果，相同问题省去检索往返")
+    print("  任意命令后加 --metrics-out 文件    - 退出时导出分阶段耗时（.prom 或 .jsonl）")
+
 def main():
-    demo = EnterpriseRAGDemo()
+    # --local-index：在本地检索 documents/，只把生成交给模型
+    retriever = None
+    if '--local-index' in sys.argv:
+        sys.argv.remove('--local-index')
+        from local_index import BedrockEmbedder
+        from embedding_store import CachingEmbedder, EmbeddingStore
+        from retrieval import build_local_retriever
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+        # 片段向量保存在 embeddings.db，文档改动后重建索引只向量化变化的片段
+        embedder = CachingEmbedder(BedrockEmbedder(), EmbeddingStore(os.path.join(base_dir, 'embeddings.db')))
+        retriever = build_local_retriever(os.path.join(base_dir, 'documents'), embedder,
+                                          index_path=os.path.join(base_dir, 'local_index.bin'), hybrid=True)
+    # --metrics-out 文件：退出时导出分阶段耗时直方图（.jsonl 为 JSONL 快照，其他扩展名为 Prometheus 文本）
+    if '--metrics-out' in sys.argv:
+        index = sys.argv.index('--metrics-out')
+        path = sys.argv[index + 1] if index + 1 < len(sys.argv) else None
+        if path is None or path.startswith('-'):
+            print("❌ --metrics-out 需要指定输出文件（.prom 或 .jsonl）")
+            print_usage()
+            sys.exit(2)
+        atexit.register(REGISTRY.export, path)
+        del sys.argv[index:index + 2]
+    # --fast-path：查表式问题直接用检索到的文档条目作答，不调用模型
+    fast_path = None
+    if '--fast-path' in sys.argv:
+        sys.argv.remove('--fast-path')
+        from fast_path import FastPathAnswerer
+        fast_path = FastPathAnswerer()
+    # --route-models：按问题复杂度选择 Nova Micro / Lite / Pro，低置信度回答升级档位重新生成
+    router = None
+    if '--route-models' in sys.argv:
+        sys.argv.remove('--route-models')
+        from model_router import ModelRouter
+        router = ModelRouter()
+    # --retrieval-cache：缓存检索结果（按知识库摄取版本失效），回答仍由模型重新生成
+    retrieval_cache_factory = None
+    if '--retrieval-cache' in sys.argv:
+        sys.argv.remove('--retrieval-cache')
+        retrieval_cache_factory = build_retrieval_cache
+    # 文件批量查询由 BatchRunner 退避重试整个查询，RequestGuard 不再重试，避免重试次数相乘
+    guards = {}
+    if len(sys.argv) > 2 and sys.argv[1] == 'batch':
+        guards = {'guard': RequestGuard('retrieve_and_generate', max_attempts=1),
+                  'retrieve_guard': RequestGuard('retrieve', max_attempts=1)}
+    demo = EnterpriseRAGDemo(retriever=retriever, fast_path=fast_path, router=router,
+                             retrieval_cache_factory=retrieval_cache_factory, **guards)
     
     if len(sys.argv) > 1:
         if sys.argv[1] == 'batch':
-            demo.batch_demo()
+            if len(sys.argv) > 2:
+                run_batch_file(demo, sys.argv[2:])
+            else:
+                demo.batch_demo()
         elif sys.argv[1] == 'query' and len(sys.argv) > 2:
             question = ' '.join(sys.argv[2:])
-            result = demo.query(question)
+            print(f"🔍 问题: {question}")
+            print("=" * 50)
+            stream = demo.stream_query(question)
+            for text in stream:
+                print(text, end="", flush=True)
+            print()
+            result = stream.result
             
             if 'error' in result:
                 print(f"❌ 查询失败: {result['error']}")
             else:
-                print(f"🔍 问题: {question}")
-                print("=" * 50)
-                print(result['answer'])
                 if result['citations']:
                     print(f"\n📚 来源: {', '.join(result['citations'])}")
+                if result.get('path') == 'fast':
+                    print("⚡ 快速路径：直接引用文档条目，未调用模型")
+                if result.get('model_tier'):
+                    print(f"⚙️ 模型档位: {result['model_tier']}" + (f"（升级 {result['escalations']} 次）" if result['escalations'] else ""))
                 print(f"\n⏱️ 耗时: {result['response_time']:.2f}秒")
         else:
-            print("用法:")
-            print("  python demo.py                    - 交互式演示")
-            print("  python demo.py batch              - 批量演示")
-            print("  python demo.py query \"您的问题\"    - 单次查询")
+            print_usage()
     else:
         demo.interactive_demo()
 
@@ -3,52 +3,61 @@
 企業文書検索RAGシステムデモ（日本語版）
 """
 
-import boto3
+import asyncio
+import atexit
 import time
 import sys
+import os
 from datetime import datetime
 
+# 共有モジュールを使用するため src ディレクトリを追加
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src'))
+from async_query import AsyncQueryEngine, run_sync
+from answer_cache import build_answer_cache
+from retrieval_cache import build_retrieval_cache
+from kb_query import KnowledgeBaseQuery
+from aws_clients import get_client
+from throttling import RequestGuard, get_guard
+from batch_runner import BatchRunner
+from metrics import REGISTRY
+
 class EnterpriseRAGDemo:
-    def __init__(self):
-        self.client = boto3.client('bedrock-agent-runtime')
+    def __init__(self, max_concurrency=8, query_timeout=60, cache_factory=build_answer_cache, client=None,
+                 retriever=None, fast_path=None, single_flight=None, guard=None, retrieve_guard=None,
+                 router=None, retrieval_cache_factory=None):
+        self.client = client or get_client('bedrock-agent-runtime')
         self.kb_id = "HCDVL6Q0KZ"
         self.model_arn = "arn:aws:bedrock:us-east-1::foundation-model/amazon.nova-pro-v1:0"
+        self.cache = cache_factory(self.kb_id, self.model_arn) if cache_factory else None
+        self.retrieval_cache = retrieval_cache_factory(self.kb_id) if retrieval_cache_factory else None
+        self.kb_query = KnowledgeBaseQuery(self.client, self.kb_id, self.model_arn, cache=self.cache,
+                                           retriever=retriever, fast_path=fast_path,
+                                           single_flight=single_flight,
+                                           guard=guard or get_guard('retrieve_and_generate'),
+                                           retrieve_guard=retrieve_guard or get_guard('retrieve'),
+                                           router=router, retrieval_cache=self.retrieval_cache)
+        self.query_timeout = query_timeout
+        self.async_engine = AsyncQueryEngine(max_concurrency=max_concurrency, timeout=query_timeout)
         
     def query(self, question):
-        """ナレッジベースにクエリ"""
+        """ナレッジベースにクエリ（回答キャッシュにヒットした場合は即座に返す）"""
+        return self.kb_query.query(question)
+    
+    def stream_query(self, question):
+        """ナレッジベースにストリーミングクエリ（回答の断片を順に返し、終了後 result で完全な結果を取得）"""
+        return self.kb_query.stream_query(question)
+    
+    async def aquery(self, question, timeout=None):
+        """ナレッジベースに非同期クエリ"""
+        timeout = self.query_timeout if timeout is None else timeout
         try:
-            start_time = time.time()
-            response = self.client.retrieve_and_generate(
-                input={'text': question},
-                retrieveAndGenerateConfiguration={
-                    'type': 'KNOWLEDGE_BASE',
-                    'knowledgeBaseConfiguration': {
-                        'knowledgeBaseId': self.kb_id,
-                        'modelArn': self.model_arn
-                    }
-                }
-            )
-            end_time = time.time()
-            
-            answer = response['output']['text']
-            citations = []
-            
-            # 引用ソースの抽出
-            for citation in response.get('citations', []):
-                for ref in citation.get('retrievedReferences', []):
-                    source = ref.get('location', {}).get('s3Location', {}).get('uri', '')
-                    if source:
-                        filename = source.split('/')[-1]
-                        citations.append(filename)
-            
-            return {
-                'answer': answer,
-                'citations': list(set(citations)),
-                'response_time': end_time - start_time
-            }
-            
-        except Exception as e:
-            return {'error': str(e)}
+            return await self.async_engine.run(self.query, question, timeout=timeout)
+        except asyncio.TimeoutError:
+            return {'error': f"クエリタイムアウト ({timeout}s)"}
+    
+    async def aquery_many(self, questions, timeout=None):
+        """複数の質問を並行してクエリし、入力順に結果を返す"""
+        return await asyncio.gather(*(self.aquery(question, timeout=timeout) for question in questions))
     
     def interactive_demo(self):
         """インタラクティブデモ"""
@@ -78,20 +87,28 @@ class EnterpriseRAGDemo:
             print(f"\n🔍 検索中: {question}")
             print("⏳ しばらくお待ちください...")
             
-            result = self.query(question)
+            print("\n" + "=" * 60)
+            print("🤖 回答:")
+            stream = self.stream_query(question)
+            for text in stream:
+                print(text, end="", flush=True)
+            print()
+            result = stream.result
             
             if 'error' in result:
                 print(f"❌ クエリ失敗: {result['error']}")
                 continue
-                
-            print("\n" + "=" * 60)
-            print("🤖 回答:")
-            print(result['answer'])
             
             if result['citations']:
                 print(f"\n📚 情報ソース: {', '.join(result['citations'])}")
                 
-            print(f"\n⏱️ 応答時間: {result['response_time']:.2f} 秒")
+            if result.get('path') == 'fast':
+                print("\n⚡ 高速パス：文書の項目をそのまま引用（モデル呼び出しなし）")
+            if result.get('model_tier'):
+                print(f"⚙️ モデル: {result['model_tier']}" + (f"（{result['escalations']} 回昇格）" if result['escalations'] else ""))
+            if result.get('time_to_first_chunk') is not None:
+                print(f"\n⚡ 最初の応答まで: {result['time_to_first_chunk']:.2f} 秒")
+            print(f"⏱️ 応答時間: {result['response_time']:.2f} 秒")
             print("=" * 60)
     
     def batch_demo(self):
@@ -108,12 +125,13 @@ class EnterpriseRAGDemo:
             "財務承認プロセスは何ですか？"
         ]
         
-        for i, question in enumerate(demo_questions, 1):
+        print(f"⏳ {len(demo_questions)} 件の質問を並行してクエリ中...")
+        results = run_sync(self.aquery_many(demo_questions))
+        
+        for i, (question, result) in enumerate(zip(demo_questions, results), 1):
             print(f"\n📋 デモ {i}/{len(demo_questions)}: {question}")
             print("-" * 50)
             
-            result = self.query(question)
-            
             if 'error' in result:
                 print(f"❌ クエリ失敗: {result['error']}")
                 continue
@@ -131,30 +149,121 @@ class EnterpriseRAGDemo:
         
         print("\n✅ バッチデモ完了！")
 
+def run_batch_file(demo, argv):
+    """JSONL/CSV ファイルから一括クエリし、結果を JSONL にストリーミング出力"""
+    import argparse
+    
+    parser = argparse.ArgumentParser(prog=f"{sys.argv[0]} batch", description='一括クエリ')
+    parser.add_argument('input', help='質問ファイル（.jsonl または .csv）')
+    parser.add_argument('--output', help='結果ファイル（JSONL、既定は <入力ファイル名>.results.jsonl）')
+    parser.add_argument('--workers', type=int, default=8, help='並行数')
+    parser.add_argument('--qps', type=float, default=None, help='1秒あたりの最大リクエスト数（制限なしの場合は省略）')
+    parser.add_argument('--no-resume', action='store_true', help='既存の結果を無視して最初から実行')
+    args = parser.parse_args(argv)
+    
+    output = args.output or f"{os.path.splitext(args.input)[0]}.results.jsonl"
+    print(f"🚀 一括クエリ: {args.input} -> {output}")
+    runner = BatchRunner(demo.query, max_workers=args.workers, qps=args.qps)
+    summary = runner.run(args.input, output, resume=not args.no_resume)
+    
+    print("✅ 一括クエリ完了")
+    print(f"   成功 {summary['succeeded']} 件, 失敗 {summary['failed']} 件, スキップ（完了済み） {summary['skipped']} 件, リトライ {summary['retries']} 回")
+    print(f"   スループット: {summary['throughput']:.2f} 件/秒, 合計 {summary['elapsed']:.1f} 秒")
+    print(f"   レイテンシ: P50 {summary['p50']:.2f}s, P95 {summary['p95']:.2f}s, P99 {summary['p99']:.2f}s")
+    for stage, row in REGISTRY.summary().items():
+        print(f"   ステージ {stage}: P50 {row['p50']:.3f}s, P95 {row['p95']:.3f}s")
+    if demo.kb_query.router is not None:
+        for tier, row in demo.kb_query.router.stats().items():
+            print(f"   モデル {tier}: {row['calls']} 回, P50 {row['p50']:.3f}s, 推定コスト ${row['cost_usd']:.4f}")
+
+def print_usage():
+    print("使用方法:")
+    print("  python demo_ja.py                    - インタラクティブデモ")
+    print("  python demo_ja.py batch              - バッチデモ")
+    print("  python demo_ja.py batch 質問.jsonl [--output 結果.jsonl] [--workers 8] [--qps 5]  - ファイル一括クエリ")
+    print("  python demo_ja.py query \"あなたの質問\"  - 単発クエリ")
+    print("  任意のコマンドに --local-index を付加  - ローカルベクトルインデックスで documents/ を検索")
+    print("  任意のコマンドに --fast-path を付加    - 表引き型の質問は文書の項目から直接回答（モデル呼び出しなし）")
+    print("  任意のコマンドに --route-models を付加 - 質問の複雑さに応じてモデル（Micro / Lite / Pro）を選択")
+    print("  任意のコマンドに --retrieval-cache を付加 - 検索結果をキャッシュし、同じ質問の検索往復を省略")
+    print("  任意のコマンドに --metrics-out ファイル を付加 - 終了時にステージ別所要時間を出力（.prom または .jsonl）")
+
 def main():
-    demo = EnterpriseRAGDemo()
+    # --local-index：documents/ をローカルで検索し、回答生成のみモデルに任せる
+    retriever = None
+    if '--local-index' in sys.argv:
+        sys.argv.remove('--local-index')
+        from local_index import BedrockEmbedder
+        from embedding_store import CachingEmbedder, EmbeddingStore
+        from retrieval import build_local_retriever
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+        # チャンクのベクトルは embeddings.db に保存し、文書変更後の再構築では変更されたチャンクのみベクトル化
+        embedder = CachingEmbedder(BedrockEmbedder(), EmbeddingStore(os.path.join(base_dir, 'embeddings.db')))
+        retriever = build_local_retriever(os.path.join(base_dir, 'documents'), embedder,
+                                          index_path=os.path.join(base_dir, 'local_index.bin'), hybrid=True)
+    # --metrics-out ファイル：終了時にステージ別所要時間のヒストグラムを出力（.jsonl は JSONL スナップショット、それ以外は Prometheus テキスト）
+    if '--metrics-out' in sys.argv:
+        index = sys.argv.index('--metrics-out')
+        path = sys.argv[index + 1] if index + 1 < len(sys.argv) else None
+        if path is None or path.startswith('-'):
+            print("❌ --metrics-out には出力ファイル（.prom または .jsonl）を指定してください")
+            print_usage()
+            sys.exit(2)
+        atexit.register(REGISTRY.export, path)
+        del sys.argv[index:index + 2]
+    # --fast-path：表引き型の質問は検索した文書の項目から直接回答し、モデルを呼び出さない
+    fast_path = None
+    if '--fast-path' in sys.argv:
+        sys.argv.remove('--fast-path')
+        from fast_path import FastPathAnswerer
+        fast_path = FastPathAnswerer()
+    # --route-models：質問の複雑さに応じて Nova Micro / Lite / Pro を選択し、確信度の低い回答は上位モデルで再生成
+    router = None
+    if '--route-models' in sys.argv:
+        sys.argv.remove('--route-models')
+        from model_router import ModelRouter
+        router = ModelRouter()
+    # --retrieval-cache：検索結果をキャッシュ（ナレッジベースの取り込みバージョンが変わると無効化）、回答はモデルで再生成
+    retrieval_cache_factory = None
+    if '--retrieval-cache' in sys.argv:
+        sys.argv.remove('--retrieval-cache')
+        retrieval_cache_factory = build_retrieval_cache
+    # ファイル一括クエリは BatchRunner がクエリ全体をバックオフ再試行するため、RequestGuard では再試行しない（再試行回数の掛け算を防ぐ）
+    guards = {}
+    if len(sys.argv) > 2 and sys.argv[1] == 'batch':
+        guards = {'guard': RequestGuard('retrieve_and_generate', max_attempts=1),
+                  'retrieve_guard': RequestGuard('retrieve', max_attempts=1)}
+    demo = EnterpriseRAGDemo(retriever=retriever, fast_path=fast_path, router=router,
+                             retrieval_cache_factory=retrieval_cache_factory, **guards)
     
     if len(sys.argv) > 1:
         if sys.argv[1] == 'batch':
-            demo.batch_demo()
+            if len(sys.argv) > 2:
+                run_batch_file(demo, sys.argv[2:])
+            else:
+                demo.batch_demo()
         elif sys.argv[1] == 'query' and len(sys.argv) > 2:
             question = ' '.join(sys.argv[2:])
-            result = demo.query(question)
+            print(f"🔍 質問: {question}")
+            print("=" * 50)
+            stream = demo.stream_query(question)
+            for text in stream:
+                print(text, end="", flush=True)
+            print()
+            result = stream.result
             
             if 'error' in result:
                 print(f"❌ クエリ失敗: {result['error']}")
             else:
-                print(f"🔍 質問: {question}")
-                print("=" * 50)
-                print(result['answer'])
                 if result['citations']:
                     print(f"\n📚 ソース: {', '.join(result['citations'])}")
+                if result.get('path') == 'fast':
+                    print("⚡ 高速パス：文書の項目をそのまま引用（モデル呼び出しなし）")
+                if result.get('model_tier'):
+                    print(f"⚙️ モデル: {result['model_tier']}" + (f"（{result['escalations']} 回昇格）" if result['escalations'] else ""))
                 print(f"\n⏱️ 所要時間: {result['response_time']:.2f}秒")
         else:
-            print("使用方法:")
-            print("  python demo_ja.py                    - インタラクティブデモ")
-            print("  python demo_ja.py batch              - バッチデモ")
-            print("  python demo_ja.py query \"あなたの質問\"  - 単発クエリ")
+            print_usage()
     else:
         demo.interactive_demo()
 
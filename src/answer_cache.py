@@ -0,0 +1,319 @@
+"""
+问答结果缓存
+按规范化问题缓存 retrieve_and_generate 的回答，支持可选的向量相似度匹配、
+TTL + LRU 淘汰、知识库摄取版本变化时失效，以及内存 / SQLite 两种存储后端
+"""
+
+import copy
+import json
+import time
+import sqlite3
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_question(question):
+    """规范化问题：全半角统一、小写、去掉空白和标点
+
+    "公司的请假制度是什么？" 与 "公司的请假制度是什么?" 得到相同的结果。
+    """
+    text = unicodedata.normalize('NFKC', question).lower()
+    return ''.join(ch for ch in text if not unicodedata.category(ch).startswith(('P', 'Z', 'C')))
+
+
+class MemoryCacheBackend:
+    """进程内 LRU 存储"""
+
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def vectors(self, prefix):
+        """返回 [(key, vector)]，供相似度匹配使用"""
+        with self._lock:
+            return [(key, entry['vector']) for key, entry in self._entries.items()
+                    if entry.get('vector') is not None and key.startswith(prefix)]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteCacheBackend:
+    """SQLite 持久化存储，多个进程可以共享同一个缓存文件"""
+
+    def __init__(self, path="answer_cache.db", max_entries=10000):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5.0)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS answers ("
+                " key TEXT PRIMARY KEY,"
+                " payload TEXT NOT NULL,"
+                " vector BLOB,"
+                " last_access REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS answers_lru ON answers(last_access)")
+
+    def get(self, key):
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT payload, vector FROM answers WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE answers SET last_access = ? WHERE key = ?", (time.time(), key))
+        entry = json.loads(row[0])
+        entry['vector'] = np.frombuffer(row[1], dtype=np.float32) if row[1] is not None else None
+        return entry
+
+    def set(self, key, entry):
+        payload = {k: v for k, v in entry.items() if k != 'vector'}
+        vector = entry.get('vector')
+        blob = np.asarray(vector, dtype=np.float32).tobytes() if vector is not None else None
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO answers (key, payload, vector, last_access) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(payload, ensure_ascii=False), blob, time.time())
+            )
+            self._conn.execute(
+                "DELETE FROM answers WHERE key IN ("
+                " SELECT key FROM answers ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+
+    def delete(self, key):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM answers WHERE key = ?", (key,))
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM answers")
+
+    def vectors(self, prefix):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, vector FROM answers WHERE vector IS NOT NULL AND substr(key, 1, ?) = ?",
+                (len(prefix), prefix)
+            ).fetchall()
+        return [(key, np.frombuffer(blob, dtype=np.float32)) for key, blob in rows]
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+
+
+class IngestionVersion:
+    """知识库数据版本：各数据源最近一次完成的摄取任务ID
+
+    作为 AnswerCache 的 version_provider，重新同步知识库后缓存自动失效。
+    """
+
+    def __init__(self, agent_client, kb_id):
+        self.agent_client = agent_client
+        self.kb_id = kb_id
+
+    def __call__(self):
+        versions = []
+        data_sources = self.agent_client.list_data_sources(knowledgeBaseId=self.kb_id)
+        for ds in data_sources.get('dataSourceSummaries', []):
+            response = self.agent_client.list_ingestion_jobs(
+                knowledgeBaseId=self.kb_id,
+                dataSourceId=ds['dataSourceId'],
+                filters=[{'attribute': 'STATUS', 'operator': 'EQ', 'values': ['COMPLETE']}],
+                sortBy={'attribute': 'STARTED_AT', 'order': 'DESCENDING'},
+                maxResults=1
+            )
+            for job in response.get('ingestionJobSummaries', []):
+                versions.append(f"{ds['dataSourceId']}:{job['ingestionJobId']}")
+        return ','.join(sorted(versions))
+
+
+class VersionWatcher:
+    """按间隔调用 provider 检查知识库版本，获取失败时沿用上次的版本"""
+
+    def __init__(self, provider, interval=60.0):
+        self.provider = provider
+        self.interval = interval
+        self._version = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def check(self):
+        """返回 (当前版本, 检查前的版本)；两者不同且检查前的版本不为 None 时说明知识库已重新同步"""
+        now = time.monotonic()
+        with self._lock:
+            if self._checked_at is not None and now - self._checked_at < self.interval:
+                return self._version, self._version
+            self._checked_at = now
+        try:
+            version = self.provider()
+        except Exception as e:
+            logger.warning("获取知识库版本失败，沿用当前缓存: %s", e)
+            return self._version, self._version
+        with self._lock:
+            previous, self._version = self._version, version
+        return version, previous
+
+
+class AnswerCache:
+    """问答缓存
+
+    namespace 用于区分不同的知识库 / 模型配置；embedder 为可选的
+    文本 → 向量函数，设置后精确匹配未命中时按余弦相似度查找近似问题。
+    """
+
+    def __init__(self, backend=None, namespace="", ttl=3600.0, embedder=None,
+                 similarity_threshold=0.92, version_provider=None, version_check_interval=60.0):
+        self.backend = backend if backend is not None else MemoryCacheBackend()
+        self.namespace = namespace
+        self.ttl = ttl
+        self.embedder = embedder
+        self.similarity_threshold = similarity_threshold
+        self.version_provider = version_provider
+        self._versions = VersionWatcher(version_provider, version_check_interval) if version_provider else None
+
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    def _key(self, normalized):
+        return f"{self.namespace}:{normalized}"
+
+    def _current_version(self):
+        """按间隔检查知识库版本"""
+        if self._versions is None:
+            return None
+        version, previous = self._versions.check()
+        if previous is not None and previous != version:
+            # 旧版本条目在下次访问时按 version 字段淘汰，不影响共享后端中的其他命名空间
+            logger.info("知识库版本变化 (%s -> %s)，旧的问答缓存失效", previous, version)
+        return version
+
+    def _embed(self, normalized):
+        vector = np.asarray(self.embedder(normalized), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _valid(self, key, entry, version):
+        if entry is None:
+            return False
+        if time.time() - entry['created_at'] > self.ttl or entry.get('version') != version:
+            self.backend.delete(key)
+            return False
+        return True
+
+    def get(self, question):
+        """查找缓存，命中时返回带 cached=True 的结果副本，否则返回 None"""
+        version = self._current_version()
+        normalized = normalize_question(question)
+        key = self._key(normalized)
+
+        entry = self.backend.get(key)
+        if self._valid(key, entry, version):
+            return self._hit(entry, semantic=False)
+
+        if self.embedder is not None:
+            candidates = self.backend.vectors(self._key(""))
+            if candidates:
+                vector = self._embed(normalized)
+                matrix = np.vstack([v for _, v in candidates])
+                scores = matrix @ vector
+                # 得分最高的可能已过期或属于旧版本，依次检查达到阈值的候选
+                for index in np.argsort(-scores):
+                    if scores[index] < self.similarity_threshold:
+                        break
+                    match_key = candidates[index][0]
+                    entry = self.backend.get(match_key)
+                    if self._valid(match_key, entry, version):
+                        return self._hit(entry, semantic=True)
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def _hit(self, entry, semantic):
+        with self._lock:
+            self.hits += 1
+            if semantic:
+                self.semantic_hits += 1
+        # 深拷贝：内存后端直接返回存储的条目，调用方修改 citations 等字段不能影响缓存
+        result = copy.deepcopy(entry['result'])
+        result['cached'] = True
+        return result
+
+    def put(self, question, result):
+        """缓存成功的查询结果（错误结果不缓存）"""
+        if 'error' in result:
+            return
+        normalized = normalize_question(question)
+        entry = {
+            'question': question,
+            'result': copy.deepcopy({k: v for k, v in result.items() if k != 'cached'}),
+            'created_at': time.time(),
+            'version': self._current_version(),
+            'vector': self._embed(normalized) if self.embedder is not None else None,
+        }
+        self.backend.set(self._key(normalized), entry)
+
+    def invalidate(self):
+        self.backend.clear()
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'semantic_hits': self.semantic_hits,
+            'misses': self.misses,
+            'hit_rate': self.hit_rate,
+            'entries': len(self.backend),
+        }
+
+
+def build_answer_cache(kb_id, model_arn, backend=None, agent_client=None, **options):
+    """按知识库和模型创建问答缓存，摄取版本变化时自动失效"""
+    if agent_client is None:
+        from aws_clients import get_client
+        agent_client = get_client('bedrock-agent')
+    return AnswerCache(
+        backend=backend,
+        namespace=f"{kb_id}|{model_arn}",
+        version_provider=IngestionVersion(agent_client, kb_id),
+        **options
+    )
@@ -0,0 +1,95 @@
+"""
+异步查询引擎
+把同步的 boto3 调用放到有界线程池中执行，为 CLI 的批量演示等提供 asyncio 接口
+"""
+
+import asyncio
+import logging
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncQueryEngine:
+    """并发执行同步查询函数
+
+    max_concurrency 同时限制在途请求数和工作线程数；timeout 为默认超时（秒）。
+    超时或取消只会放弃等待结果，已经发出的 boto3 请求仍会在工作线程中跑完，
+    但线程池大小保证了真正并发的请求数不会超过上限。
+    """
+
+    def __init__(self, max_concurrency=8, timeout=None):
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency,
+                                            thread_name_prefix="rag-query")
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+    def _semaphore(self):
+        # asyncio.Semaphore 在 Python 3.9 中绑定创建时的事件循环，按循环分别创建
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            semaphore = self._semaphores.get(loop)
+            if semaphore is None:
+                semaphore = asyncio.Semaphore(self.max_concurrency)
+                self._semaphores = {l: s for l, s in self._semaphores.items() if not l.is_closed()}
+                self._semaphores[loop] = semaphore
+            return semaphore
+
+    async def run(self, func, *args, timeout=None, **kwargs):
+        """在线程池中执行 func(*args, **kwargs)，超时抛出 asyncio.TimeoutError"""
+        timeout = self.timeout if timeout is None else timeout
+        async with self._semaphore():
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+            return await asyncio.wait_for(future, timeout)
+
+    async def stream(self, func, *args, timeout=None, **kwargs):
+        """在线程池中消费 func(*args, **kwargs) 返回的同步迭代器，异步逐项产出
+
+        timeout 作用于等待每一项的时间（空闲超时）。
+        """
+        timeout = self.timeout if timeout is None else timeout
+        done = object()
+        async with self._semaphore():
+            loop = asyncio.get_running_loop()
+            iterator = await asyncio.wait_for(
+                loop.run_in_executor(self._executor, lambda: iter(func(*args, **kwargs))), timeout
+            )
+            while True:
+                item = await asyncio.wait_for(
+                    loop.run_in_executor(self._executor, next, iterator, done), timeout
+                )
+                if item is done:
+                    break
+                yield item
+
+    def shutdown(self, wait=False):
+        self._executor.shutdown(wait=wait)
+
+
+def run_sync(coro):
+    """在同步代码（CLI、Streamlit 脚本线程）中运行协程并返回结果"""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+
+    # 当前线程已有运行中的事件循环（例如 Jupyter），改在新线程中运行
+    result = {}
+
+    def runner():
+        try:
+            result['value'] = asyncio.run(coro)
+        except BaseException as e:
+            result['error'] = e
+
+    thread = threading.Thread(target=runner, name="run-sync")
+    thread.start()
+    thread.join()
+    if 'error' in result:
+        raise result['error']
+    return result['value']
@@ -0,0 +1,76 @@
+"""
+AWS 客户端工厂
+进程内按 (服务, 区域, 配置) 缓存 boto3 客户端：凭证解析、端点解析和 TLS 连接只在第一次创建时发生，
+之后所有调用方（CLI、各个 Streamlit 浏览器会话、上传线程池）共用同一个客户端及其连接池；
+boto3 在第一次创建客户端时才导入，不需要访问 AWS 的命令不承担其加载时间
+"""
+
+import time
+import threading
+import logging
+
+from metrics import observe_stage
+
+logger = logging.getLogger(__name__)
+
+# 连接池需大于上传线程数和 Streamlit 并发会话数；流式回答可能持续较久，读超时放宽
+DEFAULT_CONFIG = {
+    'max_pool_connections': 50,
+    'tcp_keepalive': True,
+    'connect_timeout': 5,
+    'read_timeout': 120,
+    'retries': {'mode': 'adaptive', 'max_attempts': 5},
+}
+
+# 按服务覆盖的配置：bedrock-agent-runtime 的限流和重试由 throttling.RequestGuard 统一处理，
+# botocore 不再各自重试（否则每个会话各自重试会加剧限流，限速器也收不到限流信号）
+SERVICE_CONFIG = {
+    'bedrock-agent-runtime': {'retries': {'mode': 'standard', 'max_attempts': 1}},
+}
+
+_lock = threading.Lock()
+_session = None
+_clients = {}
+
+
+def client_config(**overrides):
+    """默认 botocore 配置，overrides 中的项覆盖默认值"""
+    from botocore.config import Config
+    return Config(**{**DEFAULT_CONFIG, **overrides})
+
+
+def get_session():
+    """进程共享的 boto3 Session（默认 Session 创建客户端不是线程安全的）"""
+    global _session
+    with _lock:
+        if _session is None:
+            import boto3
+            _session = boto3.session.Session()
+        return _session
+
+
+def get_client(service, region_name=None, **config_overrides):
+    """返回缓存的客户端；boto3 客户端本身可被多个线程同时使用"""
+    config_overrides = {**SERVICE_CONFIG.get(service, {}), **config_overrides}
+    key = (service, region_name, tuple(sorted((k, repr(v)) for k, v in config_overrides.items())))
+    client = _clients.get(key)
+    if client is not None:
+        return client
+    start = time.perf_counter()
+    session = get_session()
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            client = session.client(service, region_name=region_name, config=client_config(**config_overrides))
+            _clients[key] = client
+            observe_stage('client_setup', time.perf_counter() - start)
+            logger.debug("创建 AWS 客户端: %s (%s)", service, client.meta.region_name)
+        return client
+
+
+def clear_clients():
+    """丢弃缓存的客户端和 Session（凭证轮换或切换区域后调用）"""
+    global _session
+    with _lock:
+        _clients.clear()
+        _session = None
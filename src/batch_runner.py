@@ -0,0 +1,238 @@
+"""
+批量查询
+从 JSONL / CSV 读取问题，有界线程池 + 自适应令牌桶限速并发执行，结果以 JSONL 流式写出，
+支持中断后从检查点（已写出的结果）续跑，结束时输出延迟分位数和吞吐量
+"""
+
+import os
+import csv
+import json
+import math
+import time
+import random
+import logging
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from throttling import AdaptiveRateLimiter, is_throttling_error
+
+logger = logging.getLogger(__name__)
+
+
+def load_questions(path):
+    """逐条读取问题，产出 (id, question)
+
+    JSONL 每行为 {"id": ..., "question": ...} 或直接是字符串；
+    CSV 需包含 question 列（id 列可选），否则取第一列。缺少 id 时使用行号。
+    """
+    if path.endswith('.csv'):
+        with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+            reader = csv.reader(f)
+            header = next(reader, None)
+            if header is None:
+                return
+            columns = [name.strip().lower() for name in header]
+            if 'question' in columns:
+                q_col = columns.index('question')
+                id_col = columns.index('id') if 'id' in columns else None
+                rows = reader
+            else:
+                q_col, id_col = 0, None
+                rows = itertools.chain([header], reader)
+            for line_no, row in enumerate(rows, 1):
+                if len(row) > q_col and row[q_col].strip():
+                    qid = row[id_col] if id_col is not None and len(row) > id_col else str(line_no)
+                    yield qid, row[q_col].strip()
+        return
+
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            if isinstance(item, str):
+                yield str(line_no), item
+            else:
+                yield str(item.get('id', line_no)), item['question']
+
+
+def load_checkpoint(output_path):
+    """读取已完成的问题ID（成功写出结果的记录，降级回答不算完成），忽略崩溃时写了一半的最后一行"""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if is_success(record):
+                done.add(str(record['id']))
+    return done
+
+
+def is_success(result):
+    """有错误或只是降级回答（模型不可用时的原文片段）都不算成功，续跑时重新查询"""
+    return 'error' not in result and not result.get('degraded')
+
+
+def _ends_with_newline(path):
+    with open(path, 'rb') as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b'\n'
+
+
+def percentile(sorted_values, p):
+    """最近秩法计算分位数"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(p / 100.0 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class BatchStats:
+    """批量执行统计"""
+
+    def __init__(self):
+        self.latencies = []
+        self.succeeded = 0
+        self.failed = 0
+        self.skipped = 0
+        self.retries = 0
+        self.started_at = time.monotonic()
+        self.finished_at = None
+
+    @property
+    def elapsed(self):
+        end = self.finished_at if self.finished_at is not None else time.monotonic()
+        return max(end - self.started_at, 1e-9)
+
+    def summary(self):
+        latencies = sorted(self.latencies)
+        completed = self.succeeded + self.failed
+        return {
+            'completed': completed,
+            'succeeded': self.succeeded,
+            'failed': self.failed,
+            'skipped': self.skipped,
+            'retries': self.retries,
+            'elapsed': self.elapsed,
+            'throughput': completed / self.elapsed,
+            'p50': percentile(latencies, 50),
+            'p95': percentile(latencies, 95),
+            'p99': percentile(latencies, 99),
+        }
+
+
+class BatchRunner:
+    """非交互批量查询
+
+    query_func(question) 返回 EnterpriseRAGDemo.query 格式的结果字典；
+    被限流的请求按指数退避重试并降低发送速率（qps 为上限），熔断时等待 retry_after 后重试，
+    降级回答同样退避重试，其他错误直接记录到结果中。查询经过 RequestGuard 时应关闭其重试（max_attempts=1），
+    否则每次批量重试内部还会再重试多次。
+    """
+
+    def __init__(self, query_func, max_workers=8, qps=None, max_attempts=5,
+                 backoff_base=1.0, backoff_max=30.0):
+        self.query_func = query_func
+        self.max_workers = max_workers
+        self.limiter = AdaptiveRateLimiter(rate=qps, min_rate=min(0.5, qps), max_rate=qps) if qps else None
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._lock = threading.Lock()
+
+    def run(self, input_path, output_path, resume=True, progress_interval=10.0):
+        """执行批量查询，返回统计摘要"""
+        done = load_checkpoint(output_path) if resume else set()
+        if done:
+            logger.info(f"从检查点续跑，已完成 {len(done)} 条")
+        stats = BatchStats()
+        last_progress = time.monotonic()
+
+        mode = 'a' if resume else 'w'
+        with open(output_path, mode, encoding='utf-8') as out, \
+                ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="batch") as executor:
+            # 上次崩溃时可能留下没有换行的半行记录，先补上换行
+            if resume and out.tell() > 0 and not _ends_with_newline(output_path):
+                out.write('\n')
+            in_flight = set()
+            for qid, question in load_questions(input_path):
+                if qid in done:
+                    stats.skipped += 1
+                    continue
+                # 限制在途任务数，避免一次性为上万个问题创建 Future
+                if len(in_flight) >= self.max_workers * 2:
+                    finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        self._write(out, future.result(), stats)
+                in_flight.add(executor.submit(self._run_one, qid, question, stats))
+
+                now = time.monotonic()
+                if now - last_progress >= progress_interval:
+                    last_progress = now
+                    self._log_progress(stats)
+
+            for future in in_flight:
+                self._write(out, future.result(), stats)
+
+        stats.finished_at = time.monotonic()
+        summary = stats.summary()
+        logger.info(f"批量查询完成: 成功 {summary['succeeded']}, 失败 {summary['failed']}, "
+                    f"跳过 {summary['skipped']}, 吞吐 {summary['throughput']:.2f} 条/秒, "
+                    f"P50 {summary['p50']:.2f}s, P95 {summary['p95']:.2f}s, P99 {summary['p99']:.2f}s")
+        return summary
+
+    def _run_one(self, qid, question, stats):
+        record = {'id': qid, 'question': question}
+        for attempt in range(1, self.max_attempts + 1):
+            if self.limiter:
+                self.limiter.acquire()
+            start = time.perf_counter()
+            result = self.query_func(question)
+            latency = time.perf_counter() - start
+
+            error = result.get('error')
+            throttled = bool(error) and is_throttling_error(error)
+            degraded = not error and bool(result.get('degraded'))
+            if self.limiter:
+                if throttled:
+                    self.limiter.on_throttle()
+                elif not error and not degraded:
+                    self.limiter.on_success()
+            retry_after = result.get('retry_after') if error else None
+            if (throttled or degraded or retry_after is not None) and attempt < self.max_attempts:
+                with self._lock:
+                    stats.retries += 1
+                # 熔断半开、探测请求未结束时 retry_after 可能为 0，此时按退避等待
+                if retry_after:
+                    time.sleep(min(self.backoff_max, retry_after))
+                else:
+                    delay = min(self.backoff_max, self.backoff_base * (2 ** (attempt - 1)))
+                    time.sleep(random.uniform(delay / 2, delay))
+                continue
+
+            record.update(result)
+            record['latency'] = latency
+            record['attempts'] = attempt
+            return record
+
+    def _write(self, out, record, stats):
+        # 每条结果立即落盘，崩溃后可以从输出文件续跑
+        out.write(json.dumps(record, ensure_ascii=False) + '\n')
+        out.flush()
+        if is_success(record):
+            stats.succeeded += 1
+            stats.latencies.append(record['latency'])
+        else:
+            stats.failed += 1
+
+    @staticmethod
+    def _log_progress(stats):
+        completed = stats.succeeded + stats.failed
+        logger.info(f"批量进度: 完成 {completed}, 失败 {stats.failed}, "
+                    f"{completed / stats.elapsed:.2f} 条/秒")
@@ -0,0 +1,102 @@
+"""
+BM25 关键词检索
+中日文按字符 n-gram 切分，倒排表以 CSR 形式保存在 NumPy 数组中；
+倒数排名融合（RRF）把关键词结果与向量检索结果合并，补足语义检索对 "500元/天"、"VPN" 等精确词的遗漏
+"""
+
+import logging
+from collections import Counter
+
+import numpy as np
+
+from local_index import tokenize
+
+logger = logging.getLogger(__name__)
+
+
+class BM25Index:
+    """倒排索引 + BM25 打分
+
+    term_offsets[t]:term_offsets[t+1] 为词项 t 在 doc_ids / term_freqs 中的区间，
+    doc_ids 为 uint32、term_freqs 为 uint16，比 dict-of-lists 小一个数量级。
+    """
+
+    def __init__(self, vocabulary, term_offsets, doc_ids, term_freqs, doc_lengths, k1=1.5, b=0.75):
+        self.vocabulary = vocabulary
+        self.term_offsets = term_offsets
+        self.doc_ids = doc_ids
+        self.term_freqs = term_freqs
+        self.doc_lengths = doc_lengths
+        self.k1 = k1
+        self.b = b
+        self.avg_length = float(doc_lengths.mean()) if len(doc_lengths) else 0.0
+        df = np.diff(term_offsets).astype(np.float64)
+        n = len(doc_lengths)
+        self.idf = np.log(1.0 + (n - df + 0.5) / (df + 0.5)).astype(np.float32)
+        # 文档长度归一化项只依赖文档，预先计算
+        self._length_norm = (k1 * (1 - b + b * doc_lengths / max(self.avg_length, 1e-9))).astype(np.float32)
+
+    @classmethod
+    def from_texts(cls, texts, **params):
+        vocabulary = {}
+        postings = []  # 按词项ID排列的 [(doc_id, tf)]
+        doc_lengths = np.zeros(len(texts), dtype=np.float32)
+        for doc_id, text in enumerate(texts):
+            tokens = tokenize(text)
+            doc_lengths[doc_id] = len(tokens)
+            for term, tf in Counter(tokens).items():
+                term_id = vocabulary.setdefault(term, len(vocabulary))
+                if term_id == len(postings):
+                    postings.append([])
+                postings[term_id].append((doc_id, min(tf, 65535)))
+
+        term_offsets = np.zeros(len(postings) + 1, dtype=np.int64)
+        np.cumsum([len(p) for p in postings], out=term_offsets[1:])
+        doc_ids = np.fromiter((d for p in postings for d, _ in p), dtype=np.uint32, count=int(term_offsets[-1]))
+        term_freqs = np.fromiter((tf for p in postings for _, tf in p), dtype=np.uint16, count=int(term_offsets[-1]))
+        return cls(vocabulary, term_offsets, doc_ids, term_freqs, doc_lengths, **params)
+
+    @classmethod
+    def from_chunks(cls, chunks, **params):
+        """从片段构建，片段下标与 VectorIndex 中的一致；标题路径也参与匹配"""
+        return cls.from_texts([f"{c.get('heading', '')}\n{c['text']}" for c in chunks], **params)
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    @property
+    def nbytes(self):
+        return (self.term_offsets.nbytes + self.doc_ids.nbytes + self.term_freqs.nbytes
+                + self.doc_lengths.nbytes + self.idf.nbytes)
+
+    def scores(self, query):
+        """所有文档的 BM25 分数"""
+        scores = np.zeros(len(self.doc_lengths), dtype=np.float32)
+        for term in set(tokenize(query)):
+            term_id = self.vocabulary.get(term)
+            if term_id is None:
+                continue
+            start, end = self.term_offsets[term_id], self.term_offsets[term_id + 1]
+            ids = self.doc_ids[start:end]
+            tf = self.term_freqs[start:end].astype(np.float32)
+            scores[ids] += self.idf[term_id] * tf * (self.k1 + 1) / (tf + self._length_norm[ids])
+        return scores
+
+    def search(self, query, top_k=10):
+        """返回 [(文档下标, 分数)]，只包含分数大于 0 的文档"""
+        scores = self.scores(query)
+        matched = np.flatnonzero(scores)
+        if len(matched) > top_k:
+            matched = matched[np.argpartition(-scores[matched], top_k - 1)[:top_k]]
+        order = matched[np.argsort(-scores[matched])]
+        return [(int(i), float(scores[i])) for i in order]
+
+
+def reciprocal_rank_fusion(rankings, k=60, weights=None):
+    """倒数排名融合：score(d) = Σ w_i / (k + rank_i(d))，rankings 为若干按相关度排序的文档下标列表"""
+    fused = {}
+    for ranking, weight in zip(rankings, weights or [1.0] * len(rankings)):
+        for rank, doc_id in enumerate(ranking, 1):
+            fused[doc_id] = fused.get(doc_id, 0.0) + weight / (k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
+
@@ -0,0 +1,185 @@
+"""
+资源发现缓存
+把按名称查到的 Agent ID / 别名 ID 等保存在本地 JSON 文件中，重复执行 CLI 查询时跳过控制面查找；
+条目超过 TTL 或调用方发现 ID 已失效（资源被删除重建）时重新查找；
+RefreshingValue 是进程内的版本，供 Streamlit 界面在多个会话间共享并在后台刷新
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL = 24 * 3600
+
+
+def default_cache_path():
+    """RAG_DISCOVERY_CACHE 环境变量，默认 ~/.cache/enterprise-rag/discovery.json"""
+    return os.environ.get('RAG_DISCOVERY_CACHE') or os.path.join(
+        os.path.expanduser('~'), '.cache', 'enterprise-rag', 'discovery.json')
+
+
+class DiscoveryCache:
+    """带 TTL 的键值文件缓存，写入时整体替换文件，多个进程同时写入以最后一次为准"""
+
+    def __init__(self, path=None, ttl=DEFAULT_TTL, clock=time.time):
+        self.path = path or default_cache_path()
+        self.ttl = ttl
+        self.clock = clock
+        self._lock = threading.Lock()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"发现缓存无法读取，忽略: {e}")
+            return {}
+
+    def _save(self, entries):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = f"{self.path}.tmp.{os.getpid()}"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entries, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def get(self, key):
+        """未过期的值，没有或已过期时返回 None"""
+        entry = self._load().get(key)
+        if entry is None or self.clock() - entry.get('saved_at', 0) > self.ttl:
+            return None
+        return entry['value']
+
+    def put(self, key, value):
+        with self._lock:
+            entries = self._load()
+            entries[key] = {'value': value, 'saved_at': self.clock()}
+            try:
+                self._save(entries)
+            except OSError as e:
+                logger.warning(f"发现缓存写入失败: {e}")
+
+    def invalidate(self, key=None):
+        """删除一个键，key 为 None 时清空"""
+        with self._lock:
+            entries = self._load()
+            if key is None:
+                entries = {}
+            elif entries.pop(key, None) is None:
+                return
+            try:
+                self._save(entries)
+            except OSError as e:
+                logger.warning(f"发现缓存写入失败: {e}")
+
+
+class RefreshingValue:
+    """进程内共享的发现结果（如 Agent ID），供多个 Streamlit 会话共用
+
+    加载后 refresh_after 秒内直接返回；之后仍返回旧值，同时在后台线程刷新；
+    超过 ttl 或调用 invalidate() 后同步重新加载。加载失败（如 Agent 未部署）的结果缓存
+    negative_ttl 秒，避免每次页面重跑都调用控制面。
+    """
+
+    def __init__(self, loader, ttl=600, refresh_after=300, negative_ttl=30, clock=time.monotonic):
+        self.loader = loader
+        self.ttl = ttl
+        self.refresh_after = refresh_after
+        self.negative_ttl = negative_ttl
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._value = None
+        self._error = None
+        self._loaded_at = None
+        self._refreshing = False
+        self._refresh_failed_at = None
+        # invalidate() 后递增，丢弃失效前发起的刷新结果
+        self._generation = 0
+
+    def _cached(self, now):
+        """未过期时返回 (值, 异常)，否则返回 None；调用方持有 _lock"""
+        if self._loaded_at is None:
+            return None
+        age = now - self._loaded_at
+        if self._error is not None:
+            return (None, self._error) if age < self.negative_ttl else None
+        return (self._value, None) if age < self.ttl else None
+
+    def get(self):
+        """返回当前值，加载失败时抛出加载函数的异常"""
+        now = self.clock()
+        with self._lock:
+            cached = self._cached(now)
+            if cached is not None and cached[1] is None and now - self._loaded_at >= self.refresh_after:
+                self._start_refresh(now)
+        if cached is None:
+            return self._load()
+        value, error = cached
+        if error is not None:
+            raise error
+        return value
+
+    def _start_refresh(self, now):
+        if self._refreshing:
+            return
+        if self._refresh_failed_at is not None and now - self._refresh_failed_at < self.negative_ttl:
+            return
+        self._refreshing = True
+        threading.Thread(target=self._refresh, args=(self._generation,), daemon=True,
+                         name="discovery-refresh").start()
+
+    def _refresh(self, generation):
+        try:
+            value = self.loader()
+        except Exception as e:
+            logger.warning(f"后台刷新失败，继续使用旧值: {e}")
+            with self._lock:
+                self._refreshing = False
+                self._refresh_failed_at = self.clock()
+            return
+        with self._lock:
+            self._refreshing = False
+            if generation == self._generation:
+                self._value, self._error, self._loaded_at = value, None, self.clock()
+                self._refresh_failed_at = None
+
+    def _load(self):
+        # 同一时刻只有一个线程调用加载函数，其余线程等待并复用结果
+        with self._load_lock:
+            with self._lock:
+                cached = self._cached(self.clock())
+                generation = self._generation
+            if cached is not None:
+                value, error = cached
+                if error is not None:
+                    raise error
+                return value
+            try:
+                value, error = self.loader(), None
+            except Exception as e:
+                value, error = None, e
+            with self._lock:
+                if generation == self._generation:
+                    self._value, self._error, self._loaded_at = value, error, self.clock()
+            if error is not None:
+                raise error
+            return value
+
+    def invalidate(self):
+        """丢弃当前值，下次 get() 同步重新加载"""
+        with self._lock:
+            self._generation += 1
+            self._value = self._error = self._loaded_at = None
+            self._refresh_failed_at = None
+
+    @property
+    def age(self):
+        """距上次加载的秒数，未加载时为 None"""
+        with self._lock:
+            return None if self._loaded_at is None else self.clock() - self._loaded_at
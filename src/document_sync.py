@@ -0,0 +1,214 @@
+"""
+企业文档增量同步
+基于本地清单（路径 → 大小、修改时间、SHA-256、S3 ETag）只上传变化的文档
+"""
+
+import os
+import json
+import hashlib
+import logging
+import threading
+
+from upload_engine import ParallelUploader, collect_documents
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILENAME = ".upload_manifest.json"
+MANIFEST_VERSION = 1
+
+# delete_objects 单次最多删除1000个对象
+DELETE_BATCH_SIZE = 1000
+
+
+def file_sha256(file_path, block_size=1024 * 1024):
+    """计算文件的 SHA-256"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class SyncManifest:
+    """本地上传清单
+
+    同一个清单文件可以记录多个上传目标（bucket + prefix），
+    各版本 EnterpriseRAG 使用不同前缀时互不干扰。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._targets = {}
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning(f"上传清单无法读取，将执行全量同步: {self.path}: {e}")
+            return
+        if data.get('version') == MANIFEST_VERSION:
+            self._targets = data.get('targets', {})
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with self._lock:
+            data = {'version': MANIFEST_VERSION, 'targets': self._targets}
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    @staticmethod
+    def target_key(bucket_name, prefix):
+        return f"{bucket_name}/{prefix}"
+
+    def entries(self, bucket_name, prefix):
+        """返回某个上传目标的 {相对路径: 记录}"""
+        with self._lock:
+            return dict(self._targets.get(self.target_key(bucket_name, prefix), {}))
+
+    def update(self, bucket_name, prefix, rel_path, entry):
+        with self._lock:
+            self._targets.setdefault(self.target_key(bucket_name, prefix), {})[rel_path] = entry
+
+    def remove(self, bucket_name, prefix, rel_path):
+        with self._lock:
+            self._targets.get(self.target_key(bucket_name, prefix), {}).pop(rel_path, None)
+
+
+class SyncResult:
+    """增量同步结果"""
+
+    def __init__(self):
+        self.uploaded = []
+        self.skipped = []
+        self.deleted = []
+        self.upload_report = None
+
+    @property
+    def changed(self):
+        return bool(self.uploaded or self.deleted)
+
+    def summary(self):
+        return (f"新增/更新 {len(self.uploaded)} 个, 未变化 {len(self.skipped)} 个, "
+                f"删除 {len(self.deleted)} 个")
+
+
+class DocumentSync:
+    """把本地文档目录增量同步到S3前缀"""
+
+    def __init__(self, s3_client, uploader=None, manifest_path=None):
+        self.s3_client = s3_client
+        self.uploader = uploader or ParallelUploader(s3_client, fetch_etags=True)
+        self.manifest_path = manifest_path
+
+    def sync(self, documents_path, bucket_name, prefix="", full_sync=False):
+        """同步文档：只上传变化的文件，删除源文件已移除的S3对象"""
+        manifest = SyncManifest(self.manifest_path or os.path.join(documents_path, MANIFEST_FILENAME))
+        recorded = manifest.entries(bucket_name, prefix)
+        # 全量同步时重新上传所有文件，但仍按清单删除源文件已移除的对象
+        known = {} if full_sync else recorded
+        remote = self._list_remote_etags(bucket_name, prefix)
+        result = SyncResult()
+
+        pending = {}  # s3_key -> (rel_path, file_path, 记录)
+        local_paths = set()
+        local_keys = set()
+        for file_path, s3_key in collect_documents(documents_path, prefix):
+            rel_path = os.path.relpath(file_path, documents_path)
+            local_paths.add(rel_path)
+            local_keys.add(s3_key)
+            stat = os.stat(file_path)
+            entry = {
+                's3_key': s3_key,
+                'size': stat.st_size,
+                'mtime_ns': stat.st_mtime_ns,
+            }
+            previous = known.get(rel_path)
+            # 远端对象缺失或被改动时必须重新上传
+            in_sync = (previous is not None
+                       and previous.get('s3_key') == s3_key
+                       and remote.get(s3_key) == previous.get('etag'))
+
+            if in_sync and previous['size'] == entry['size'] and previous['mtime_ns'] == entry['mtime_ns']:
+                result.skipped.append(rel_path)
+                continue
+
+            entry['sha256'] = file_sha256(file_path)
+            if in_sync and previous.get('sha256') == entry['sha256']:
+                # 仅修改时间变化（例如重新checkout），内容未变
+                entry['etag'] = previous['etag']
+                manifest.update(bucket_name, prefix, rel_path, entry)
+                result.skipped.append(rel_path)
+                continue
+
+            pending[s3_key] = (rel_path, file_path, entry)
+
+        if pending:
+            report = self.uploader.upload_files(
+                [(file_path, s3_key) for s3_key, (_, file_path, _) in pending.items()],
+                bucket_name
+            )
+            result.upload_report = report
+            for s3_key, (rel_path, _, entry) in pending.items():
+                if s3_key in report.failed:
+                    continue
+                entry['etag'] = report.etags.get(s3_key)
+                manifest.update(bucket_name, prefix, rel_path, entry)
+                result.uploaded.append(rel_path)
+
+        stale = {rel_path: entry for rel_path, entry in recorded.items() if rel_path not in local_paths}
+        if stale:
+            # 文件移动到其他子目录时 S3 Key 不变，当前文件对应的 Key 不能删除
+            failed = self._delete_objects(bucket_name, [entry['s3_key'] for entry in stale.values()
+                                                        if entry.get('s3_key') in remote
+                                                        and entry.get('s3_key') not in local_keys])
+            for rel_path, entry in stale.items():
+                # 删除失败的保留清单记录，下次同步重试
+                if entry.get('s3_key') in failed:
+                    continue
+                manifest.remove(bucket_name, prefix, rel_path)
+                result.deleted.append(rel_path)
+
+        manifest.save()
+        logger.info(f"文档同步完成: {result.summary()}")
+        return result
+
+    def _list_remote_etags(self, bucket_name, prefix):
+        """列出前缀下已有对象的 ETag（每1000个对象一次LIST请求）"""
+        etags = {}
+        paginator = self.s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+            for obj in page.get('Contents', []):
+                etags[obj['Key']] = obj['ETag']
+        return etags
+
+    def _delete_objects(self, bucket_name, keys):
+        """批量删除对象，返回删除失败的 Key 集合"""
+        failed = set()
+        for i in range(0, len(keys), DELETE_BATCH_SIZE):
+            batch = keys[i:i + DELETE_BATCH_SIZE]
+            logger.info(f"删除S3对象: {len(batch)} 个 (s3://{bucket_name})")
+            response = self.s3_client.delete_objects(
+                Bucket=bucket_name,
+                Delete={'Objects': [{'Key': key} for key in batch], 'Quiet': True}
+            )
+            for error in response.get('Errors', []):
+                logger.error(f"删除失败: {error.get('Key')}: {error.get('Message')}")
+                failed.add(error.get('Key'))
+        return failed
+
+
+def has_completed_ingestion(agent_client, kb_id, ds_id):
+    """数据源是否已有成功完成的摄取任务（新建的知识库即使文档未变也需要同步）"""
+    response = agent_client.list_ingestion_jobs(
+        knowledgeBaseId=kb_id,
+        dataSourceId=ds_id,
+        filters=[{'attribute': 'STATUS', 'operator': 'EQ', 'values': ['COMPLETE']}],
+        maxResults=1
+    )
+    return bool(response.get('ingestionJobSummaries'))
@@ -0,0 +1,135 @@
+"""
+嵌入向量持久化缓存
+以 SHA-256(模型 ID + 文本) 为键把向量存入 SQLite，相同文本在任何进程中只向量化一次：
+文档改动一行后重建本地索引时只有变化的片段需要重新向量化，问答缓存和本地检索的问题向量同样复用
+"""
+
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+
+import numpy as np
+
+from metrics import REGISTRY
+from logging_setup import debug_enabled
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STORE_PATH = "embeddings.db"
+CACHE_COUNTER = 'rag_embedding_cache_total'
+# SQLite 单条语句的参数个数上限（旧版本为 999）
+LOOKUP_BATCH = 500
+
+
+def content_key(model_id, text):
+    """内容寻址的键：模型不同或文本有任何变化都得到不同的键"""
+    return hashlib.sha256(f"{model_id}\n{text}".encode('utf-8')).digest()
+
+
+class EmbeddingStore:
+    """SQLite 向量存储，多个进程可以共享同一个文件；向量以 float32 字节保存"""
+
+    def __init__(self, path=DEFAULT_STORE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5.0)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                " key BLOB PRIMARY KEY,"
+                " model_id TEXT NOT NULL,"
+                " dims INTEGER NOT NULL,"
+                " vector BLOB NOT NULL,"
+                " created_at REAL NOT NULL)"
+            )
+
+    def get_many(self, keys):
+        """批量查找，返回 {键: 向量}，没有的键不在结果中"""
+        found = {}
+        keys = list(keys)
+        with self._lock:
+            for start in range(0, len(keys), LOOKUP_BATCH):
+                batch = keys[start:start + LOOKUP_BATCH]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    found[bytes(key)] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    def put_many(self, model_id, items):
+        """批量写入 [(键, 向量)]，一个事务提交"""
+        now = time.time()
+        rows = [(key, model_id, len(vector), np.asarray(vector, dtype=np.float32).tobytes(), now)
+                for key, vector in items]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, model_id, dims, vector, created_at) VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+
+    def delete_model(self, model_id):
+        """删除某个模型的全部向量（更换模型后释放空间）"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM embeddings WHERE model_id = ?", (model_id,))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+
+class CachingEmbedder:
+    """为嵌入模型（HashingEmbedder、BedrockEmbedder 等）加上 EmbeddingStore，接口和 model_id 不变
+
+    embed() 先批量查找，只把缺少的文本（去重后）交给底层模型，再批量写回。
+    """
+
+    def __init__(self, embedder, store=None, registry=None):
+        self.embedder = embedder
+        self.store = store if store is not None else EmbeddingStore()
+        self.registry = registry if registry is not None else REGISTRY
+        self.model_id = embedder.model_id
+        self.dimensions = getattr(embedder, 'dimensions', None)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def embed(self, texts):
+        texts = list(texts)
+        keys = [content_key(self.model_id, text) for text in texts]
+        vectors = self.store.get_many(set(keys))
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors:
+                missing.setdefault(key, text)
+        if missing:
+            computed = np.asarray(self.embedder.embed(list(missing.values())), dtype=np.float32)
+            new_items = list(zip(missing.keys(), computed))
+            self.store.put_many(self.model_id, new_items)
+            vectors.update(new_items)
+        hits = len(texts) - len(missing)
+        if debug_enabled():
+            logger.debug("嵌入缓存", extra={'fields': {'hits': hits, 'embedded': len(missing)}})
+        with self._lock:
+            self.hits += hits
+            self.misses += len(missing)
+        self.registry.inc(CACHE_COUNTER, hits, result='hit')
+        self.registry.inc(CACHE_COUNTER, len(missing), result='miss')
+        if not texts:
+            return np.zeros((0, self.dimensions or 0), dtype=np.float32)
+        return np.vstack([vectors[key] for key in keys])
+
+    def __call__(self, text):
+        return self.embed([text])[0]
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / total if total else 0.0}
@@ -6,31 +6,42 @@
 import sys
 import os
 import time
-import boto3
 import logging
 from pathlib import Path
 
-# 添加原项目路径
+# 添加原项目路径（workshop 工具只在创建、删除资源时按需导入，查询不加载）
 sys.path.append('/home/ec2-user/amazon-bedrock-agent-workshop-for-gcr')
-from src.utils.knowledge_base_helper import KnowledgeBasesForAmazonBedrock
-from src.utils.bedrock_agent import Agent
+from aws_clients import get_client, get_session
+from readiness import KnowledgeBaseWaiter, PhaseTimer
+from session_manager import SessionManager, new_session_id
+from streaming import StreamMetrics, iter_completion_text
+from discovery_cache import DiscoveryCache
+from logging_setup import DEFAULT_LOG_FILE, setup_logging, new_query_id
+from metrics import Trace
+from throttling import get_guard, guarded_call, is_throttling_error
 
-# 配置日志
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("enterprise_rag.log"),
-        logging.StreamHandler()
-    ]
-)
 logger = logging.getLogger(__name__)
 
+LOG_FILE = DEFAULT_LOG_FILE
+
+def configure_logging(log_file=LOG_FILE):
+    """配置日志（后台线程写 JSON 行轮转文件 + 控制台），由 main() 和界面调用，导入模块时不创建日志文件"""
+    setup_logging(log_file)
+
 class EnterpriseRAGFinal:
-    def __init__(self):
-        self.kb_helper = KnowledgeBasesForAmazonBedrock()
-        self.s3_client = boto3.client('s3')
-        self.bedrock_client = boto3.client('bedrock-agent-runtime')
+    def __init__(self, s3_client=None, bedrock_client=None, agent_client=None, upload_workers=8,
+                 session_manager=None, discovery_cache=None, guard=None):
+        # 客户端和 workshop 工具在第一次使用时创建，--query 只需要 bedrock-agent-runtime
+        self._kb_helper = None
+        self._s3_client = s3_client
+        self._bedrock_client = bedrock_client
+        self._agent_client = agent_client
+        self.discovery = discovery_cache or DiscoveryCache()
+        self.upload_workers = upload_workers
+        self._async_engine = None
+        self.sessions = session_manager or SessionManager()
+        # invoke_agent 的限速和熔断，进程内共享
+        self.guard = guard or get_guard('invoke_agent')
         
         # 使用现有的S3存储桶和短名称
         self.bucket_name = "general-mortgage-kb-1033-7989-1751782957"
@@ -41,19 +52,59 @@ class EnterpriseRAGFinal:
         self.ds_id = None
         self.agent_id = None
         self.agent_alias_id = None
+        self.setup_timings = None
+        
+    @property
+    def kb_helper(self):
+        if self._kb_helper is None:
+            from src.utils.knowledge_base_helper import KnowledgeBasesForAmazonBedrock
+            self._kb_helper = KnowledgeBasesForAmazonBedrock()
+        return self._kb_helper
+        
+    @property
+    def async_engine(self):
+        # asyncio 导入较慢，只在使用异步接口时创建
+        if self._async_engine is None:
+            from async_query import AsyncQueryEngine
+            self._async_engine = AsyncQueryEngine(max_concurrency=8)
+        return self._async_engine
+        
+    @property
+    def s3_client(self):
+        if self._s3_client is None:
+            self._s3_client = get_client('s3')
+        return self._s3_client
+        
+    @property
+    def bedrock_client(self):
+        if self._bedrock_client is None:
+            self._bedrock_client = get_client('bedrock-agent-runtime')
+        return self._bedrock_client
+        
+    @property
+    def agent_client(self):
+        if self._agent_client is None:
+            self._agent_client = get_client('bedrock-agent')
+        return self._agent_client
         
-    def upload_documents(self, documents_path):
-        """上传企业文档到现有S3存储桶"""
+    def upload_documents(self, documents_path, full_sync=False, prechunk=False):
+        """上传企业文档到现有S3存储桶（增量同步，只上传变化的文件）"""
+        from document_sync import DocumentSync
+        from upload_engine import ParallelUploader
+        
+        if prechunk:
+            # 按标题层级预切分后上传，知识库数据源应使用 NONE 分块策略
+            from md_chunker import prechunk_documents
+            documents_path = prechunk_documents(documents_path)
         logger.info(f"开始上传文档从 {documents_path} 到 {self.bucket_name}")
         
-        for root, dirs, files in os.walk(documents_path):
-            for file in files:
-                if file.endswith(('.md', '.txt', '.pdf', '.docx')):
-                    file_path = os.path.join(root, file)
-                    s3_key = f"enterprise_docs/{file}"
-                    
-                    logger.info(f"上传文件: {file_path} -> s3://{self.bucket_name}/{s3_key}")
-                    self.s3_client.upload_file(file_path, self.bucket_name, s3_key)
+        uploader = ParallelUploader(self.s3_client, max_workers=self.upload_workers, fetch_etags=True)
+        sync = DocumentSync(self.s3_client, uploader=uploader)
+        result = sync.sync(documents_path, self.bucket_name, prefix="enterprise_docs/", full_sync=full_sync)
+        report = result.upload_report
+        if report and report.failed:
+            raise RuntimeError(f"{len(report.failed)} 个文件上传失败: {', '.join(sorted(report.failed))}")
+        return result
                     
     def create_knowledge_base(self):
         """创建企业知识库"""
@@ -77,6 +128,8 @@ class EnterpriseRAGFinal:
         
     def create_rag_agent(self):
         """创建RAG Agent"""
+        from src.utils.bedrock_agent import Agent
+        
         logger.info("创建企业文档检索Agent...")
         
         agent = Agent.create(
@@ -107,64 +160,134 @@ class EnterpriseRAGFinal:
         
         self.agent_id = agent.agent_id
         self.agent_alias_id = agent.agent_alias_id
+        self.discovery.put(self._agent_cache_key(), {'agent_id': self.agent_id, 'agent_alias_id': self.agent_alias_id})
         
         logger.info(f"Agent创建成功: ID={self.agent_id}, Alias ID={self.agent_alias_id}")
         return agent
         
-    def query_documents(self, question):
+    def _agent_cache_key(self):
+        return f"{get_session().region_name}/agent/{self.agent_name}"
+        
+    def discover_agent(self, refresh=False):
+        """按名称查找已部署的 Agent 及最新别名，结果缓存在本地，返回是否来自缓存
+
+        refresh=True 时忽略缓存重新查找（缓存的 Agent 已被删除重建时使用）。
+        """
+        key = self._agent_cache_key()
+        cached = None if refresh else self.discovery.get(key)
+        if cached is not None:
+            self.agent_id, self.agent_alias_id = cached['agent_id'], cached['agent_alias_id']
+            return True
+        
+        from src.utils.bedrock_agent import agents_helper
+        self.agent_id = agents_helper.get_agent_id_by_name(self.agent_name)
+        self.agent_alias_id = agents_helper.get_agent_latest_alias_id(self.agent_id)
+        self.discovery.put(key, {'agent_id': self.agent_id, 'agent_alias_id': self.agent_alias_id})
+        return False
+        
+    def query_documents(self, question, conversation_id=None):
         """查询文档"""
+        return ''.join(self.stream_query_documents(question, conversation_id=conversation_id))
+        
+    def stream_query_documents(self, question, metrics=None, conversation_id=None):
+        """流式查询文档，回答文本到达后逐段产出
+
+        metrics 可传入 StreamMetrics 以获取首段耗时等指标；
+        传入 conversation_id 时同一对话复用 Agent 会话，追问可以利用之前的上下文。
+        """
         if not self.agent_id or not self.agent_alias_id:
             raise ValueError("Agent未初始化，请先创建Agent")
             
-        logger.info(f"处理查询: {question}")
+        if conversation_id is not None:
+            session_id = self.sessions.session_id(conversation_id)
+        else:
+            session_id = new_session_id()
+        # 生成器跨 yield 挂起，上下文变量不可靠，查询 ID 等字段随每条日志显式传入
+        fields = {'query_id': new_query_id(), 'session_id': session_id}
+        logger.info("处理查询", extra={'fields': {**fields, 'question': question}})
+        return self._stream_completion(question, metrics if metrics is not None else StreamMetrics(), session_id,
+                                       fields)
         
+    def _stream_completion(self, question, metrics, session_id, fields=None):
+        trace = Trace()
         try:
-            response = self.bedrock_client.invoke_agent(
-                agentId=self.agent_id,
-                agentAliasId=self.agent_alias_id,
-                sessionId=f"session-{int(time.time())}",
-                inputText=question
-            )
+            with trace.span('invoke'):
+                response = guarded_call(
+                    self.guard, self.bedrock_client.invoke_agent,
+                    agentId=self.agent_id,
+                    agentAliasId=self.agent_alias_id,
+                    sessionId=session_id,
+                    inputText=question
+                )
             
-            # 解析响应
-            result = ""
-            for event in response['completion']:
-                if 'chunk' in event:
-                    chunk = event['chunk']
-                    if 'bytes' in chunk:
-                        result += chunk['bytes'].decode('utf-8')
-                        
-            logger.info(f"查询完成，响应长度: {len(result)}")
-            return result
+            # 增量解码响应，保证跨 chunk 的多字节字符完整
+            for text in metrics.track(iter_completion_text(response['completion'])):
+                yield text
+                
+            ttfc = metrics.time_to_first_chunk
+            trace.record('time_to_first_chunk', ttfc)
+            trace.record('generation', metrics.total_time)
+            logger.info("查询完成", extra={'fields': {
+                **(fields or {}), 'chars': metrics.chars,
+                'ttfc': round(ttfc, 3) if ttfc is not None else None, 'total_time': round(metrics.total_time, 3),
+                'timings': trace.finish(path='agent')}})
             
         except Exception as e:
-            logger.error(f"查询失败: {str(e)}")
+            # 读取响应流时的限流不经过 guard.call()，单独反馈给限速器
+            if is_throttling_error(e):
+                self.guard.record_throttle()
+            trace.finish(path='agent', status='error')
+            logger.error("查询失败: %s", e, extra={'fields': fields or {}})
             raise
             
-    def setup_complete_system(self, documents_path):
+    async def aquery_documents(self, question, timeout=None, conversation_id=None):
+        """异步查询文档（在线程池中执行，超时抛出 asyncio.TimeoutError）"""
+        return await self.async_engine.run(self.query_documents, question, timeout=timeout,
+                                           conversation_id=conversation_id)
+        
+    async def astream_query_documents(self, question, timeout=None, conversation_id=None):
+        """异步流式查询文档，timeout 为等待每一段文本的超时"""
+        async for text in self.async_engine.stream(self.stream_query_documents, question, timeout=timeout,
+                                                   conversation_id=conversation_id):
+            yield text
+            
+    def setup_complete_system(self, documents_path, full_sync=False, prechunk=False):
         """完整设置RAG系统"""
+        from document_sync import has_completed_ingestion
+        
         logger.info("开始设置企业RAG系统...")
+        timer = PhaseTimer()
         
-        # 1. 上传文档到现有存储桶
-        self.upload_documents(documents_path)
+        # 1. 上传文档到现有存储桶（增量）
+        with timer.phase("上传文档"):
+            sync_result = self.upload_documents(documents_path, full_sync=full_sync, prechunk=prechunk)
         
         # 2. 创建知识库
-        self.create_knowledge_base()
+        with timer.phase("创建知识库"):
+            self.create_knowledge_base()
         
-        # 3. 等待文档上传完成
-        logger.info("等待文档处理完成...")
-        time.sleep(10)
-        
-        # 4. 同步知识库
-        self.sync_knowledge_base()
-        
-        # 5. 等待同步完成
-        logger.info("等待知识库同步完成...")
-        time.sleep(30)
+        waiter = KnowledgeBaseWaiter(self.agent_client, self.kb_id, self.ds_id)
+        if sync_result.changed or not has_completed_ingestion(self.agent_client, self.kb_id, self.ds_id):
+            # 3. 等待知识库和数据源就绪
+            with timer.phase("等待知识库就绪"):
+                waiter.wait_for_knowledge_base()
+            
+            # 4. 同步知识库
+            with timer.phase("同步知识库"):
+                self.sync_knowledge_base()
+            
+            # 5. 等待摄取任务完成
+            with timer.phase("等待摄取完成"):
+                waiter.wait_for_ingestion()
+        else:
+            logger.info("文档无变化，跳过知识库同步")
         
         # 6. 创建Agent
-        agent = self.create_rag_agent()
+        with timer.phase("创建Agent"):
+            agent = self.create_rag_agent()
         
+        self.setup_timings = timer.timings
+        logger.info(timer.summary())
         logger.info("企业RAG系统设置完成！")
         return agent
         
@@ -174,7 +297,9 @@ class EnterpriseRAGFinal:
         
         if self.agent_id:
             try:
+                from src.utils.bedrock_agent import Agent
                 Agent.delete_by_name(self.agent_name, verbose=True)
+                self.discovery.invalidate(self._agent_cache_key())
                 logger.info("Agent删除成功")
             except Exception as e:
                 logger.error(f"删除Agent失败: {e}")
@@ -197,8 +322,11 @@ def main():
     parser.add_argument('--query', type=str, help='查询问题')
     parser.add_argument('--cleanup', action='store_true', help='清理资源')
     parser.add_argument('--documents', type=str, default='../documents', help='文档目录路径')
+    parser.add_argument('--full-sync', action='store_true', help='忽略上传清单，重新上传全部文档')
+    parser.add_argument('--prechunk', action='store_true', help='按标题层级预切分 Markdown 文档后再上传')
     
     args = parser.parse_args()
+    configure_logging()
     
     rag = EnterpriseRAGFinal()
     
@@ -210,7 +338,8 @@ def main():
                 logger.error(f"文档目录不存在: {documents_path}")
                 return
                 
-            agent = rag.setup_complete_system(documents_path)
+            agent = rag.setup_complete_system(documents_path, full_sync=args.full_sync,
+                                              prechunk=args.prechunk)
             print(f"\n✅ 企业RAG系统设置完成！")
             print(f"Agent ID: {agent.agent_id}")
             print(f"Agent Alias ID: {agent.agent_alias_id}")
@@ -219,20 +348,31 @@ def main():
             
         elif args.query:
             # 查询文档
+            from_cache = False
             if not rag.agent_id:
-                # 尝试获取现有Agent信息
+                # 获取现有Agent信息（优先使用本地缓存）
                 try:
-                    from src.utils.bedrock_agent import agents_helper
-                    rag.agent_id = agents_helper.get_agent_id_by_name(rag.agent_name)
-                    rag.agent_alias_id = agents_helper.get_agent_latest_alias_id(rag.agent_id)
-                except:
+                    from_cache = rag.discover_agent()
+                except Exception:
                     logger.error("未找到现有Agent，请先运行 --setup")
                     return
                     
-            result = rag.query_documents(args.query)
             print(f"\n📋 查询结果：")
             print("=" * 50)
-            print(result)
+            printed = False
+            try:
+                for text in rag.stream_query_documents(args.query):
+                    printed = True
+                    print(text, end="", flush=True)
+            except Exception as e:
+                if printed or not from_cache:
+                    raise
+                # 缓存的 Agent 可能已被删除重建，重新查找后重试一次
+                logger.warning(f"缓存的Agent不可用，重新查找: {e}")
+                rag.discover_agent(refresh=True)
+                for text in rag.stream_query_documents(args.query):
+                    print(text, end="", flush=True)
+            print()
             print("=" * 50)
             
         elif args.cleanup:
@@ -8,12 +8,21 @@ import sys
 import os
 import time
 import logging
-from datetime import datetime
+from datetime import datetime, timedelta
 
 # 添加路径
 sys.path.append('/home/ec2-user/amazon-bedrock-agent-workshop-for-gcr')
 from src.utils.bedrock_agent import agents_helper
-from enterprise_rag import EnterpriseRAG
+from enterprise_rag import EnterpriseRAG, configure_logging, LOG_FILE
+from streaming import StreamMetrics
+from session_manager import SessionManager
+from discovery_cache import RefreshingValue
+from aws_clients import get_client
+from metrics import observe_stage
+from log_reader import LogReader, LEVELS, log_files
+
+# 日志写入 enterprise_rag.log，供日志面板查看（重复调用不会重复添加处理器）
+configure_logging(LOG_FILE)
 
 # 配置页面
 st.set_page_config(
@@ -62,14 +71,40 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+@st.cache_resource
+def get_aws_client(service):
+    """进程内共享的 AWS 客户端及连接池，新浏览器会话不再重新建立连接"""
+    return get_client(service)
+
+@st.cache_resource
+def get_agent_discovery():
+    """进程内共享的 Agent 发现结果：5 分钟后后台刷新，10 分钟后同步重新查找"""
+    def load():
+        agent_id = agents_helper.get_agent_id_by_name("enterprise_document_assistant")
+        return {'agent_id': agent_id, 'agent_alias_id': agents_helper.get_agent_latest_alias_id(agent_id)}
+    return RefreshingValue(load, ttl=600, refresh_after=300, negative_ttl=30)
+
+@st.cache_resource
+def get_session_manager():
+    """进程内所有用户共享的会话管理器（统一限制会话总数）"""
+    return SessionManager()
+
 # 初始化会话状态
 def initialize_session():
     if 'rag_system' not in st.session_state:
-        st.session_state.rag_system = EnterpriseRAG()
+        st.session_state.rag_system = EnterpriseRAG(
+            s3_client=get_aws_client('s3'),
+            bedrock_client=get_aws_client('bedrock-agent-runtime'),
+            agent_client=get_aws_client('bedrock-agent'),
+            session_manager=get_session_manager()
+        )
     
     if 'chat_history' not in st.session_state:
         st.session_state.chat_history = []
     
+    if 'conversation_id' not in st.session_state:
+        st.session_state.conversation_id = SessionManager.new_conversation()
+    
     if 'agent_ready' not in st.session_state:
         st.session_state.agent_ready = False
         
@@ -77,10 +112,10 @@ def initialize_session():
         st.session_state.system_info = {}
 
 def check_agent_status():
-    """检查Agent状态"""
+    """检查Agent状态（使用共享的发现缓存，页面重跑不会每次调用控制面）"""
     try:
-        agent_id = agents_helper.get_agent_id_by_name("enterprise_document_assistant")
-        agent_alias_id = agents_helper.get_agent_latest_alias_id(agent_id)
+        agent = get_agent_discovery().get()
+        agent_id, agent_alias_id = agent['agent_id'], agent['agent_alias_id']
         
         st.session_state.rag_system.agent_id = agent_id
         st.session_state.rag_system.agent_alias_id = agent_alias_id
@@ -96,6 +131,75 @@ def check_agent_status():
         st.session_state.system_info = {'status': '未部署'}
         return False
 
+LOG_PAGE_SIZE = 200
+LOG_TIME_RANGES = {'全部': None, '最近 15 分钟': 15, '最近 1 小时': 60, '最近 24 小时': 24 * 60}
+
+@st.cache_resource
+def get_log_reader():
+    return LogReader(LOG_FILE)
+
+@st.fragment(run_every=2)
+def follow_logs(levels, keyword):
+    """每 2 秒读取新写入的日志，只保留最近 1000 条"""
+    reader = get_log_reader()
+    entries, st.session_state.log_position = reader.read_new(st.session_state.log_position,
+                                                             levels=levels, contains=keyword)
+    buffer = st.session_state.log_buffer
+    buffer.extend(entry.text for entry in entries)
+    del buffer[:-1000]
+    st.text_area("日志内容", '\n'.join(buffer), height=400)
+    st.caption(f"跟踪中 · {len(buffer)} 条 · {datetime.now().strftime('%H:%M:%S')}")
+
+def show_logs():
+    """分页查看日志：从文件末尾向前读取，不加载整个文件"""
+    st.subheader("📋 系统日志")
+    reader = get_log_reader()
+    if not log_files(reader.path):
+        st.info("暂无日志文件")
+        return
+    
+    col_level, col_time, col_keyword = st.columns([2, 1, 2])
+    levels = set(col_level.multiselect("级别", LEVELS, default=LEVELS[1:]))
+    minutes = LOG_TIME_RANGES[col_time.selectbox("时间范围", list(LOG_TIME_RANGES))]
+    keyword = col_keyword.text_input("关键字") or None
+    since = datetime.now() - timedelta(minutes=minutes) if minutes else None
+    
+    # 过滤条件变化时回到最新一页
+    filter_key = (tuple(sorted(levels)), minutes, keyword)
+    if st.session_state.get('log_filter_key') != filter_key:
+        st.session_state.log_filter_key = filter_key
+        st.session_state.log_cursors = [None]
+    
+    if st.toggle("📡 跟踪新日志", key="log_follow"):
+        if 'log_position' not in st.session_state:
+            st.session_state.log_buffer = [entry.text for entry in
+                                           reader.tail(LOG_PAGE_SIZE, levels=levels, contains=keyword)]
+            st.session_state.log_position = reader.end_position()
+        follow_logs(levels, keyword)
+        return
+    st.session_state.pop('log_position', None)
+    
+    cursors = st.session_state.log_cursors
+    entries, next_cursor = reader.page(cursors[-1], LOG_PAGE_SIZE, levels=levels, since=since,
+                                       contains=keyword)
+    st.text_area("日志内容", '\n'.join(entry.text for entry in entries), height=400)
+    if entries:
+        st.caption(f"第 {len(cursors)} 页 · {len(entries)} 条 · "
+                   f"{entries[0].timestamp or ''} ~ {entries[-1].timestamp or ''}")
+    else:
+        st.caption("没有符合条件的日志")
+    
+    col_older, col_newer, col_latest = st.columns(3)
+    if col_older.button("⬅️ 更早", disabled=next_cursor is None, use_container_width=True):
+        cursors.append(next_cursor)
+        st.rerun()
+    if col_newer.button("➡️ 较新", disabled=len(cursors) == 1, use_container_width=True):
+        cursors.pop()
+        st.rerun()
+    if col_latest.button("⏭️ 最新", disabled=len(cursors) == 1, use_container_width=True):
+        st.session_state.log_cursors = [None]
+        st.rerun()
+
 def main():
     # 初始化
     initialize_session()
@@ -112,6 +216,9 @@ def main():
         if check_agent_status():
             st.markdown('<div class="success-box">✅ 系统运行正常</div>', unsafe_allow_html=True)
             st.write(f"**Agent ID**: {st.session_state.system_info.get('agent_id', 'N/A')[:10]}...")
+            age = get_agent_discovery().age
+            if age is not None:
+                st.caption(f"状态更新于 {age:.0f} 秒前")
         else:
             st.markdown('<div class="info-box">⚠️ 系统未部署</div>', unsafe_allow_html=True)
             
@@ -138,6 +245,7 @@ def main():
         st.subheader("⚙️ 系统管理")
         
         if st.button("🔄 刷新状态", use_container_width=True):
+            get_agent_discovery().invalidate()
             st.rerun()
             
         if st.button("📊 查看日志", use_container_width=True):
@@ -145,6 +253,9 @@ def main():
             
         if st.button("🗑️ 清空对话", use_container_width=True):
             st.session_state.chat_history = []
+            # 结束 Agent 会话，新对话不再携带之前的上下文
+            get_session_manager().reset(st.session_state.conversation_id)
+            st.session_state.conversation_id = SessionManager.new_conversation()
             st.rerun()
     
     # 主界面
@@ -183,27 +294,40 @@ def main():
             query = st.chat_input("请输入您的问题...", key="main_input") or default_query
             
             if query:
-                with st.spinner("🔍 正在检索文档..."):
-                    try:
-                        # 显示用户问题
-                        st.markdown(f'<div class="chat-message user-message"><strong>🙋 您：</strong> {query}</div>', unsafe_allow_html=True)
-                        
-                        # 查询文档
-                        start_time = time.time()
-                        result = st.session_state.rag_system.query_documents(query)
-                        end_time = time.time()
-                        
-                        # 显示结果
-                        st.markdown(f'<div class="chat-message assistant-message"><strong>🤖 助手：</strong> {result}</div>', unsafe_allow_html=True)
-                        
-                        # 添加到历史记录
-                        st.session_state.chat_history.append((query, result))
-                        
-                        # 显示查询时间
-                        st.caption(f"⏱️ 查询耗时: {end_time - start_time:.2f} 秒")
-                        
-                    except Exception as e:
-                        st.error(f"❌ 查询失败: {str(e)}")
+                try:
+                    # 显示用户问题
+                    st.markdown(f'<div class="chat-message user-message"><strong>🙋 您：</strong> {query}</div>', unsafe_allow_html=True)
+                    
+                    # 流式查询文档，回答逐段显示
+                    placeholder = st.empty()
+                    placeholder.markdown('<div class="chat-message assistant-message"><strong>🤖 助手：</strong> 🔍 正在检索文档...</div>', unsafe_allow_html=True)
+                    metrics = StreamMetrics()
+                    parts = []
+                    # 同一对话复用 Agent 会话，追问时无需重新发送历史上下文
+                    stream = st.session_state.rag_system.stream_query_documents(
+                        query, metrics=metrics, conversation_id=st.session_state.conversation_id)
+                    # 逐段渲染的耗时单独累计（生成耗时中也包含这部分）
+                    render_time = 0.0
+                    for text in stream:
+                        parts.append(text)
+                        render_start = time.perf_counter()
+                        placeholder.markdown(f'<div class="chat-message assistant-message"><strong>🤖 助手：</strong> {"".join(parts)}</div>', unsafe_allow_html=True)
+                        render_time += time.perf_counter() - render_start
+                    observe_stage('render', render_time)
+                    result = "".join(parts)
+                    
+                    # 添加到历史记录
+                    st.session_state.chat_history.append((query, result))
+                    
+                    # 显示查询时间
+                    ttfc = metrics.time_to_first_chunk
+                    if ttfc is not None:
+                        st.caption(f"⏱️ 查询耗时: {metrics.total_time:.2f} 秒（首字 {ttfc:.2f} 秒）")
+                    else:
+                        st.caption(f"⏱️ 查询耗时: {metrics.total_time:.2f} 秒")
+                    
+                except Exception as e:
+                    st.error(f"❌ 查询失败: {str(e)}")
         else:
             st.warning("⚠️ 系统未部署，请先部署RAG系统")
             
@@ -224,6 +348,7 @@ def main():
         
         # 对话统计
         st.write(f"**对话轮次**: {len(st.session_state.chat_history)}")
+        st.write(f"**活跃会话**: {len(get_session_manager())}")
         
         # 系统状态
         if st.session_state.agent_ready:
@@ -262,13 +387,7 @@ def main():
     
     # 日志查看（如果需要）
     if st.session_state.get('show_logs', False):
-        st.subheader("📋 系统日志")
-        try:
-            with open("enterprise_rag.log", "r", encoding="utf-8") as f:
-                logs = f.read()
-                st.text_area("日志内容", logs, height=300)
-        except FileNotFoundError:
-            st.info("暂无日志文件")
+        show_logs()
         
         if st.button("关闭日志"):
             st.session_state.show_logs = False
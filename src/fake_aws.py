@@ -0,0 +1,311 @@
+"""
+本地 AWS 替身
+进程内模拟 bedrock-agent-runtime、bedrock-agent 控制面和 s3，支持可配置的延迟分布、按 QPS 限流和分块流式输出，
+用于基准测试和离线验证，不访问网络
+"""
+
+import time
+import random
+import hashlib
+import threading
+from collections import deque
+
+from botocore.exceptions import ClientError
+
+DEFAULT_ANSWER = (
+    "根据公司财务管理制度，差旅费报销标准如下：住宿费一线城市500元/天，"
+    "二线城市300元/天，其他城市200元/天；餐费100元/天；市内交通50元/天。"
+)
+
+
+class LatencyModel:
+    """延迟分布（秒）
+
+    kind: constant / uniform / normal / lognormal；
+    lognormal 以 mean 为中位数、sigma 为对数标准差，适合模拟长尾的模型调用延迟。
+    """
+
+    def __init__(self, kind="constant", mean=0.0, sigma=0.0, low=None, high=None, seed=None):
+        self.kind = kind
+        self.mean = mean
+        self.sigma = sigma
+        self.low = low if low is not None else 0.0
+        self.high = high if high is not None else mean * 2
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def parse(cls, spec, seed=None):
+        """从字符串创建，例如 "0.5"、"lognormal:2.0:0.3"、"uniform:0.1:0.4"、"normal:1.0:0.2" """
+        parts = str(spec).split(':')
+        if len(parts) == 1:
+            return cls("constant", float(parts[0]), seed=seed)
+        kind = parts[0]
+        values = [float(v) for v in parts[1:]]
+        if kind == "uniform":
+            return cls(kind, (values[0] + values[1]) / 2, low=values[0], high=values[1], seed=seed)
+        return cls(kind, values[0], values[1] if len(values) > 1 else 0.0, seed=seed)
+
+    def sample(self):
+        with self._lock:
+            if self.kind == "constant":
+                value = self.mean
+            elif self.kind == "uniform":
+                value = self._random.uniform(self.low, self.high)
+            elif self.kind == "normal":
+                value = self._random.gauss(self.mean, self.sigma)
+            elif self.kind == "lognormal":
+                value = self.mean * self._random.lognormvariate(0.0, self.sigma)
+            else:
+                raise ValueError(f"未知的延迟分布: {self.kind}")
+        return max(0.0, value)
+
+
+class RateGate:
+    """滑动窗口限流：最近1秒内请求数超过 qps 时拒绝"""
+
+    def __init__(self, qps):
+        self.qps = qps
+        self._calls = deque()
+        self._lock = threading.Lock()
+
+    def allow(self):
+        if not self.qps:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            while self._calls and now - self._calls[0] >= 1.0:
+                self._calls.popleft()
+            if len(self._calls) >= self.qps:
+                return False
+            self._calls.append(now)
+            return True
+
+
+def _client_error(code, operation, message=""):
+    return ClientError({'Error': {'Code': code, 'Message': message or code}}, operation)
+
+
+class FakeBedrockAgentRuntime:
+    """bedrock-agent-runtime 替身
+
+    latency 为整体响应延迟（非流式接口），流式接口先等待 first_chunk_latency，
+    然后每隔 chunk_interval 输出 chunk_size 个字符；超过 throttle_qps 时抛出 ThrottlingException。
+    injected 记录每次调用注入的服务端耗时，用于从客户端观测值中扣除，得到系统自身开销。
+    model_latency 为 {模型 ARN 中的片段: 延迟系数}，模拟较小的模型响应更快；model_calls 按模型 ARN 计数。
+    """
+
+    def __init__(self, latency=None, first_chunk_latency=None, chunk_interval=0.0, chunk_size=8,
+                 throttle_qps=None, answer=DEFAULT_ANSWER,
+                 sources=("finance_policy.md", "company_policy.md"), model_latency=None, sleep=time.sleep):
+        self.latency = latency or LatencyModel()
+        self.first_chunk_latency = first_chunk_latency or self.latency
+        self.chunk_interval = chunk_interval
+        self.chunk_size = chunk_size
+        self.gate = RateGate(throttle_qps)
+        self.answer = answer
+        self.sources = list(sources)
+        self.model_latency = model_latency or {}
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.throttled = 0
+        self.injected = []
+        self.model_calls = {}
+
+    def _admit(self, operation):
+        with self._lock:
+            self.calls += 1
+        if not self.gate.allow():
+            with self._lock:
+                self.throttled += 1
+            raise _client_error('ThrottlingException', operation, 'Rate exceeded')
+
+    def _wait(self, seconds):
+        with self._lock:
+            self.injected.append(seconds)
+        if seconds:
+            self._sleep(seconds)
+
+    def _model_factor(self, configuration):
+        settings = (configuration.get('knowledgeBaseConfiguration')
+                    or configuration.get('externalSourcesConfiguration') or {})
+        model_arn = settings.get('modelArn', '')
+        with self._lock:
+            self.model_calls[model_arn] = self.model_calls.get(model_arn, 0) + 1
+        for name, factor in self.model_latency.items():
+            if name in model_arn:
+                return factor
+        return 1.0
+
+    def _references(self):
+        return [{
+            'content': {'text': f"{source} 片段"},
+            'location': {'type': 'S3', 's3Location': {'uri': f"s3://fake-bucket/documents/{source}"}},
+        } for source in self.sources]
+
+    def _pieces(self, text):
+        return [text[i:i + self.chunk_size] for i in range(0, len(text), self.chunk_size)]
+
+    def retrieve_and_generate(self, input, retrieveAndGenerateConfiguration, **kwargs):
+        self._admit('RetrieveAndGenerate')
+        self._wait(self.latency.sample() * self._model_factor(retrieveAndGenerateConfiguration))
+        return {
+            'sessionId': kwargs.get('sessionId') or f"fake-session-{self.calls}",
+            'output': {'text': self.answer},
+            'citations': [{
+                'generatedResponsePart': {'textResponsePart': {'text': self.answer}},
+                'retrievedReferences': self._references(),
+            }],
+        }
+
+    def retrieve_and_generate_stream(self, input, retrieveAndGenerateConfiguration, **kwargs):
+        self._admit('RetrieveAndGenerateStream')
+        first = self.first_chunk_latency.sample() * self._model_factor(retrieveAndGenerateConfiguration)
+
+        def events():
+            self._wait(first)
+            for i, piece in enumerate(self._pieces(self.answer)):
+                if i:
+                    self._wait(self.chunk_interval)
+                yield {'output': {'text': piece}}
+            yield {'citation': {'retrievedReferences': self._references()}}
+
+        return {'sessionId': kwargs.get('sessionId') or f"fake-session-{self.calls}", 'stream': events()}
+
+    def invoke_agent(self, agentId, agentAliasId, sessionId, inputText, **kwargs):
+        self._admit('InvokeAgent')
+        first = self.first_chunk_latency.sample()
+        data = self.answer.encode('utf-8')
+
+        def completion():
+            self._wait(first)
+            # 按字节切分，故意把多字节字符拆到两个 chunk 中
+            for i in range(0, len(data), self.chunk_size):
+                if i:
+                    self._wait(self.chunk_interval)
+                yield {'chunk': {'bytes': data[i:i + self.chunk_size]}}
+
+        return {'sessionId': sessionId, 'completion': completion()}
+
+    def retrieve(self, knowledgeBaseId, retrievalQuery, retrievalConfiguration=None, **kwargs):
+        self._admit('Retrieve')
+        self._wait(self.latency.sample())
+        results = []
+        for rank, ref in enumerate(self._references()):
+            result = dict(ref)
+            result['score'] = 1.0 / (rank + 1)
+            results.append(result)
+        return {'retrievalResults': results}
+
+
+class FakeBedrockAgent:
+    """bedrock-agent 控制面替身：知识库、数据源和摄取任务的状态查询
+
+    kb_statuses / ds_statuses / job_statuses 为每次查询依次返回的状态，用完后停留在最后一个，
+    模拟资源创建和摄取任务的推进；job_statuses 为空时数据源没有摄取任务。
+    """
+
+    def __init__(self, kb_statuses=('ACTIVE',), ds_statuses=('AVAILABLE',), job_statuses=('COMPLETE',),
+                 job_id="FAKEJOB", statistics=None):
+        self._statuses = {'kb': list(kb_statuses), 'ds': list(ds_statuses), 'job': list(job_statuses)}
+        self.job_id = job_id
+        self.statistics = statistics or {}
+        self._lock = threading.Lock()
+        self.calls = {}
+
+    def _next(self, kind, operation):
+        with self._lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+            statuses = self._statuses[kind]
+            return statuses.pop(0) if len(statuses) > 1 else statuses[0]
+
+    def get_knowledge_base(self, knowledgeBaseId):
+        status = self._next('kb', 'GetKnowledgeBase')
+        return {'knowledgeBase': {'knowledgeBaseId': knowledgeBaseId, 'status': status}}
+
+    def get_data_source(self, knowledgeBaseId, dataSourceId):
+        status = self._next('ds', 'GetDataSource')
+        return {'dataSource': {'knowledgeBaseId': knowledgeBaseId, 'dataSourceId': dataSourceId, 'status': status}}
+
+    def list_ingestion_jobs(self, knowledgeBaseId, dataSourceId, filters=None, sortBy=None, maxResults=None):
+        with self._lock:
+            self.calls['ListIngestionJobs'] = self.calls.get('ListIngestionJobs', 0) + 1
+            statuses = self._statuses['job']
+            status = statuses[0] if statuses else None
+        if status is None:
+            return {'ingestionJobSummaries': []}
+        for condition in filters or []:
+            if condition['attribute'] == 'STATUS' and status not in condition['values']:
+                return {'ingestionJobSummaries': []}
+        return {'ingestionJobSummaries': [{'ingestionJobId': self.job_id, 'status': status}]}
+
+    def get_ingestion_job(self, knowledgeBaseId, dataSourceId, ingestionJobId):
+        if ingestionJobId != self.job_id or not self._statuses['job']:
+            raise _client_error('ResourceNotFoundException', 'GetIngestionJob', ingestionJobId)
+        status = self._next('job', 'GetIngestionJob')
+        return {'ingestionJob': {'ingestionJobId': ingestionJobId, 'status': status,
+                                 'statistics': self.statistics}}
+
+
+class _FakePaginator:
+    def __init__(self, s3):
+        self.s3 = s3
+
+    def paginate(self, Bucket, Prefix="", PaginationConfig=None):
+        keys = sorted(key for (bucket, key) in self.s3.objects if bucket == Bucket and key.startswith(Prefix))
+        for i in range(0, len(keys), 1000):
+            yield {'Contents': [{'Key': key, 'ETag': self.s3.objects[(Bucket, key)][1]}
+                                for key in keys[i:i + 1000]]}
+
+
+class FakeS3:
+    """s3 替身：upload_file / head_object / list_objects_v2 分页 / delete_objects"""
+
+    def __init__(self, latency=None, throttle_qps=None, sleep=time.sleep):
+        self.latency = latency or LatencyModel()
+        self.gate = RateGate(throttle_qps)
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self.objects = {}  # (bucket, key) -> (data, etag)
+        self.calls = 0
+        self.throttled = 0
+
+    def _admit(self, operation):
+        with self._lock:
+            self.calls += 1
+        if not self.gate.allow():
+            with self._lock:
+                self.throttled += 1
+            raise _client_error('SlowDown', operation, 'Please reduce your request rate.')
+        delay = self.latency.sample()
+        if delay:
+            self._sleep(delay)
+
+    def upload_file(self, Filename, Bucket, Key, ExtraArgs=None, Callback=None, Config=None):
+        self._admit('PutObject')
+        with open(Filename, 'rb') as f:
+            data = f.read()
+        etag = f'"{hashlib.md5(data).hexdigest()}"'
+        with self._lock:
+            self.objects[(Bucket, Key)] = (data, etag)
+
+    def head_object(self, Bucket, Key, **kwargs):
+        self._admit('HeadObject')
+        with self._lock:
+            if (Bucket, Key) not in self.objects:
+                raise _client_error('404', 'HeadObject', 'Not Found')
+            data, etag = self.objects[(Bucket, Key)]
+        return {'ETag': etag, 'ContentLength': len(data)}
+
+    def get_paginator(self, operation_name):
+        if operation_name != 'list_objects_v2':
+            raise NotImplementedError(operation_name)
+        return _FakePaginator(self)
+
+    def delete_objects(self, Bucket, Delete):
+        self._admit('DeleteObjects')
+        with self._lock:
+            for obj in Delete['Objects']:
+                self.objects.pop((Bucket, obj['Key']), None)
+        return {'Deleted': [{'Key': obj['Key']} for obj in Delete['Objects']]}
@@ -0,0 +1,197 @@
+"""
+检索直答（快速路径）
+对 "差旅费住宿标准"、"办公用品采购审批权限" 这类查表式问题，直接从高置信度的结构化片段
+（"- 键：值" 列表、"**标签**：" 分组、Markdown 表格）中取出相关条目，用模板组织回答，不调用模型；
+置信度不够时交回生成流程
+"""
+
+import re
+import logging
+
+from logging_setup import debug_enabled
+
+logger = logging.getLogger(__name__)
+
+CJK_RE = re.compile(r'[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+')
+WORD_RE = re.compile(r'[0-9a-z]+')
+KANA_RE = re.compile(r'[\u3040-\u30ff]')
+HIRAGANA_RE = re.compile(r'[\u3040-\u309f]')
+LABEL_RE = re.compile(r'^\*\*(.+?)\*\*\s*[：:]\s*(.*)$')
+ITEM_RE = re.compile(r'^\s*(?:[-*+]|\d+[.)])\s+(.*)$')
+TABLE_SEPARATOR_RE = re.compile(r'^\s*\|?\s*:?-{2,}')
+
+# 需要解释或步骤的问题交给模型
+GENERATIVE_MARKERS = ('如何', '怎么', '怎样', '为什么', '为何', '步骤', '解决', 'どうやって', 'どうすれば',
+                      'なぜ', '手順', '方法', '解決')
+# 疑问词等不影响查找对象的双字
+STOP_BIGRAMS = {'什么', '多少', '哪些', '请问', '如何', '怎么', '是否', '一下', '公司'}
+STOP_CHARS = set('的是吗呢了么吧几何')
+
+
+def question_terms(text):
+    """检索词：中日文相邻双字（去掉疑问词）、英文单词和数字"""
+    text = text.lower()
+    terms = set(WORD_RE.findall(text))
+    for run in CJK_RE.findall(text):
+        for i in range(len(run) - 1):
+            bigram = run[i:i + 2]
+            if bigram not in STOP_BIGRAMS and not STOP_CHARS.intersection(bigram):
+                terms.add(bigram)
+    return terms
+
+
+def content_chars(text):
+    """覆盖率计算用的实词字符：汉字、片假名、英文单词和数字（平假名多为助词，不计入）"""
+    text = text.lower()
+    chars = set(WORD_RE.findall(text))
+    for run in CJK_RE.findall(text):
+        chars.update(c for c in run if c not in STOP_CHARS and not HIRAGANA_RE.match(c))
+    return chars
+
+
+def _plain(text):
+    return text.replace('**', '').replace('`', '').strip()
+
+
+class FactGroup:
+    """片段中的一组结构化条目：可选的标签 + 若干条目"""
+
+    def __init__(self, label=''):
+        self.label = label
+        self.items = []
+
+    @property
+    def text(self):
+        return '\n'.join([self.label] + self.items)
+
+
+def extract_groups(text):
+    """解析片段中的结构化内容
+
+    "**标准**：" 开启一个分组（同一行带值时作为单独条目），随后的列表项归入该分组；
+    Markdown 表格的每一行按表头转换为 "列名：值" 条目。
+    """
+    groups = []
+    current = None
+    header = None
+    for line in text.splitlines():
+        stripped = line.strip()
+        if not stripped or stripped.startswith('#'):
+            continue
+        if stripped.startswith('|'):
+            cells = [_plain(cell) for cell in stripped.strip('|').split('|')]
+            if TABLE_SEPARATOR_RE.match(stripped.replace('|', ' ')):
+                continue
+            if header is None:
+                header = cells
+                current = FactGroup(' / '.join(cells))
+                groups.append(current)
+            else:
+                current.items.append('，'.join(f"{h}：{c}" for h, c in zip(header, cells) if c))
+            continue
+        header = None
+        label = LABEL_RE.match(stripped)
+        if label:
+            current = FactGroup(_plain(label.group(1)))
+            groups.append(current)
+            if label.group(2):
+                current.items.append(_plain(label.group(2)))
+            continue
+        item = ITEM_RE.match(stripped)
+        if item:
+            if current is None:
+                current = FactGroup()
+                groups.append(current)
+            current.items.append(_plain(item.group(1)))
+            continue
+        # 普通段落说明不是结构化内容，结束当前分组
+        current = None
+    return [group for group in groups if group.items]
+
+
+class FastPathAnswerer:
+    """从检索结果中直接组织回答
+
+    在前 candidates 个结果中取覆盖率最高的片段：问题中的实词字符被 "标题路径 + 选中条目" 覆盖的比例，
+    不低于 min_coverage 且至少命中一个双字时返回回答；其他候选的覆盖率与之相差不到 margin
+    （问题有歧义）或没有合格候选时返回 None。
+    """
+
+    def __init__(self, min_coverage=0.75, margin=0.1, candidates=3, max_items=8):
+        self.min_coverage = min_coverage
+        self.margin = margin
+        self.candidates = candidates
+        self.max_items = max_items
+
+    def answer(self, question, references):
+        """返回 {'answer', 'citations', 'confidence', 'heading'} 或 None"""
+        if any(marker in question for marker in GENERATIVE_MARKERS):
+            return None
+        terms = question_terms(question)
+        chars = content_chars(question)
+        if not terms or not chars:
+            return None
+
+        matches = [self._match(terms, chars, ref) for ref in references[:self.candidates]]
+        matches = sorted((m for m in matches if m and m['confidence'] >= self.min_coverage),
+                         key=lambda m: m['confidence'], reverse=True)
+        if not matches:
+            return None
+        best = matches[0]
+        # 多个章节同样匹配时无法判断问的是哪一条，交给模型
+        if len(matches) > 1 and matches[1]['confidence'] > best['confidence'] - self.margin:
+            if debug_enabled():
+                logger.debug("快速路径候选不唯一", extra={'fields': {'candidates': [best['heading'], matches[1]['heading']]}})
+            return None
+        best['answer'] = self._render(question, best)
+        return best
+
+    def _match(self, terms, chars, ref):
+        groups = extract_groups(ref['content']['text'])
+        if not groups:
+            return None
+        heading = ref.get('metadata', {}).get('heading', '')
+
+        # 先按双字命中数选分组，再在分组内选条目；都没有命中时整段作为答案（由标题命中）
+        scored = [(len(terms & question_terms(group.text)), group) for group in groups]
+        top = max(score for score, _ in scored)
+        selected = []
+        for score, group in scored:
+            if score != top:
+                continue
+            items = [(len(terms & question_terms(item)), item) for item in group.items]
+            best_item = max(hits for hits, _ in items)
+            if best_item:
+                items = [item for hits, item in items if hits == best_item]
+            else:
+                items = group.items
+            selected.append((group.label, items))
+
+        covered_text = '\n'.join([heading] + [label + '\n' + '\n'.join(items) for label, items in selected])
+        if not terms & question_terms(covered_text):
+            return None
+        return {
+            'confidence': len(chars & content_chars(covered_text)) / len(chars),
+            'groups': selected,
+            'heading': heading,
+            'reference': ref,
+        }
+
+    def _render(self, question, match):
+        from retrieval import reference_name
+
+        source = reference_name(match['reference'])
+        title = match['heading'].split(' > ')[-1] if match['heading'] else source
+        if KANA_RE.search(question):
+            lines = [f"「{title}」によると："]
+        else:
+            lines = [f"根据《{title}》："]
+        count = 0
+        for label, items in match['groups']:
+            if label and len(match['groups']) > 1:
+                lines.append(f"{label}：")
+            for item in items[:self.max_items - count]:
+                lines.append(f"- {item}")
+            count = min(self.max_items, count + len(items))
+        match['citations'] = [source] if source else []
+        return '\n'.join(lines)
@@ -0,0 +1,179 @@
+"""
+本地索引文件格式
+把 VectorIndex 持久化为单个二进制文件，用 numpy.memmap 打开：多个 Streamlit / CLI 进程
+通过操作系统页缓存共享向量数据，启动时不需要重新向量化 documents/
+
+文件布局（小端序）：
+    头部（128 字节）
+    向量矩阵   rows x dims，float16 或 float32，64 字节对齐
+    偏移表     (rows + 1) 个 uint64，第 i 个片段文本为 text[offset[i]:offset[i+1]]
+    片段文本   UTF-8
+    元数据     JSON：嵌入模型、文档指纹、每个片段的 source / heading / section_id
+"""
+
+import os
+import json
+import struct
+import hashlib
+import logging
+
+import numpy as np
+
+from local_index import VectorIndex, build_index
+from md_chunker import CHUNKER_VERSION, DEFAULT_MAX_TOKENS, DEFAULT_OVERLAP_TOKENS, list_markdown_files
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'RAGIDX\x00\x01'
+FORMAT_VERSION = 1
+# magic, version, dtype, dims, rows, vectors_offset, offsets_offset, text_offset, metadata_offset, metadata_length
+HEADER = struct.Struct('<8sIIIxxxxQQQQQQ')
+HEADER_SIZE = 128
+DTYPES = {1: np.float16, 2: np.float32}
+ALIGNMENT = 64
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def documents_fingerprint(documents_path, max_tokens=DEFAULT_MAX_TOKENS, overlap_tokens=DEFAULT_OVERLAP_TOKENS):
+    """文档目录指纹（文件名、大小、修改时间，以及切分参数和切分规则版本），用于判断索引是否过期"""
+    digest = hashlib.sha256()
+    digest.update(f"chunker\0{CHUNKER_VERSION}\0{max_tokens}\0{overlap_tokens}\n".encode('utf-8'))
+    for name in list_markdown_files(documents_path):
+        stat = os.stat(os.path.join(documents_path, name))
+        digest.update(f"{name}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode('utf-8'))
+    return digest.hexdigest()
+
+
+class ChunkTable:
+    """按需从映射文件中解码片段，不把全部文本加载到内存"""
+
+    def __init__(self, raw, offsets, text_offset, sources, headings, section_ids):
+        self._raw = raw
+        self._offsets = offsets
+        self._text_offset = text_offset
+        self._sources = sources
+        self._headings = headings
+        self._section_ids = section_ids
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        start = self._text_offset + int(self._offsets[i])
+        end = self._text_offset + int(self._offsets[i + 1])
+        return {
+            'text': self._raw[start:end].tobytes().decode('utf-8'),
+            'source': self._sources[i],
+            'heading': self._headings[i],
+            'section_id': self._section_ids[i],
+        }
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+
+def save_index(index, path, dtype=np.float16, fingerprint=None):
+    """写入索引文件（先写临时文件再原子替换，读取中的进程不受影响）"""
+    code = {np.dtype(v): k for k, v in DTYPES.items()}[np.dtype(dtype)]
+    vectors = np.ascontiguousarray(np.asarray(index.vectors), dtype=dtype)
+    rows = len(index.chunks)
+    dims = vectors.shape[1] if rows else 0
+
+    texts = [chunk['text'].encode('utf-8') for chunk in index.chunks]
+    offsets = np.zeros(rows + 1, dtype='<u8')
+    np.cumsum([len(t) for t in texts], out=offsets[1:])
+    metadata = json.dumps({
+        'model_id': getattr(index.embedder, 'model_id', None),
+        'fingerprint': fingerprint,
+        'sources': [chunk['source'] for chunk in index.chunks],
+        'headings': [chunk.get('heading', '') for chunk in index.chunks],
+        'section_ids': [chunk.get('section_id', '') for chunk in index.chunks],
+    }, ensure_ascii=False).encode('utf-8')
+
+    vectors_offset = _align(HEADER_SIZE)
+    offsets_offset = _align(vectors_offset + vectors.nbytes)
+    text_offset = offsets_offset + offsets.nbytes
+    metadata_offset = text_offset + int(offsets[-1])
+
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, code, dims, rows, vectors_offset, offsets_offset,
+                            text_offset, metadata_offset, len(metadata)).ljust(HEADER_SIZE, b'\0'))
+        f.seek(vectors_offset)
+        f.write(vectors.tobytes())
+        f.seek(offsets_offset)
+        f.write(offsets.tobytes())
+        for text in texts:
+            f.write(text)
+        f.write(metadata)
+    os.replace(tmp_path, path)
+    logger.info(f"本地索引已保存: {path} ({rows} 个片段, {os.path.getsize(path) / 1024:.1f} KB)")
+
+
+def read_metadata(path):
+    """只读取头部和元数据块"""
+    with open(path, 'rb') as f:
+        header = _parse_header(f.read(HEADER_SIZE), path)
+        f.seek(header['metadata_offset'])
+        return json.loads(f.read(header['metadata_length']).decode('utf-8'))
+
+
+def _parse_header(data, path):
+    if len(data) < HEADER_SIZE:
+        raise ValueError(f"索引文件不完整: {path}")
+    (magic, version, code, dims, rows, vectors_offset, offsets_offset,
+     text_offset, metadata_offset, metadata_length) = HEADER.unpack_from(data)
+    if magic != MAGIC or version != FORMAT_VERSION or code not in DTYPES:
+        raise ValueError(f"不支持的索引文件格式: {path}")
+    return {
+        'dtype': DTYPES[code], 'dims': dims, 'rows': rows,
+        'vectors_offset': vectors_offset, 'offsets_offset': offsets_offset,
+        'text_offset': text_offset, 'metadata_offset': metadata_offset, 'metadata_length': metadata_length,
+    }
+
+
+def open_index(path, embedder):
+    """以只读内存映射方式打开索引文件，返回 VectorIndex"""
+    # 整个文件映射为只读字节数组，向量和偏移表都是它的视图，不复制数据
+    raw = np.memmap(path, dtype=np.uint8, mode='r')
+    header = _parse_header(raw[:HEADER_SIZE].tobytes(), path)
+    start = header['metadata_offset']
+    metadata = json.loads(raw[start:start + header['metadata_length']].tobytes().decode('utf-8'))
+    model_id = getattr(embedder, 'model_id', None)
+    if metadata.get('model_id') != model_id:
+        raise ValueError(f"索引使用的嵌入模型 {metadata.get('model_id')} 与当前模型 {model_id} 不一致")
+
+    rows, dims = header['rows'], header['dims']
+    itemsize = np.dtype(header['dtype']).itemsize
+    vectors_offset, offsets_offset = header['vectors_offset'], header['offsets_offset']
+    vectors = raw[vectors_offset:vectors_offset + rows * dims * itemsize].view(header['dtype']).reshape(rows, dims)
+    offsets = raw[offsets_offset:offsets_offset + (rows + 1) * 8].view('<u8')
+    chunks = ChunkTable(raw, offsets, header['text_offset'], metadata['sources'], metadata['headings'],
+                        metadata.get('section_ids') or [''] * rows)
+    return VectorIndex(embedder, vectors=vectors, chunks=chunks)
+
+
+def load_or_build(documents_path, index_path, embedder, dtype=np.float16, max_tokens=DEFAULT_MAX_TOKENS,
+                  overlap_tokens=DEFAULT_OVERLAP_TOKENS):
+    """索引文件存在且与文档、切分参数、嵌入模型一致时直接映射打开，否则重新构建并保存"""
+    fingerprint = documents_fingerprint(documents_path, max_tokens, overlap_tokens)
+    if os.path.exists(index_path):
+        try:
+            metadata = read_metadata(index_path)
+            if (metadata.get('fingerprint') == fingerprint
+                    and metadata.get('model_id') == getattr(embedder, 'model_id', None)):
+                return open_index(index_path, embedder)
+            logger.info("文档、切分参数或嵌入模型已变化，重建本地索引")
+        except (OSError, ValueError) as e:
+            logger.warning(f"索引文件无法使用，重新构建: {e}")
+
+    index = build_index(documents_path, embedder, max_tokens=max_tokens, overlap_tokens=overlap_tokens)
+    save_index(index, index_path, dtype=dtype, fingerprint=fingerprint)
+    return open_index(index_path, embedder)
@@ -0,0 +1,447 @@
+"""
+Knowledge Base 问答
+封装 retrieve_and_generate 调用和引用解析，供 demo / web_demo 各语言版本共用；
+可选的检索后端（retrieval.py）替代知识库检索，只把生成交给模型；
+可选的快速路径（fast_path.py）对查表式问题直接用检索结果作答，不调用模型；
+可选的 RequestGuard（throttling.py）对模型调用限速和熔断，生成不可用时用检索片段降级作答；
+可选的 ModelRouter（model_router.py）按问题复杂度选择模型档位，低置信度回答升级档位重新生成；
+可选的 RetrievalCache（retrieval_cache.py）缓存检索结果，回答仍按需重新生成
+"""
+
+import copy
+import time
+import logging
+
+from streaming import StreamMetrics
+from retrieval import KnowledgeBaseRetriever, reference_name, external_sources_configuration
+from logging_setup import query_context, new_query_id
+from metrics import Trace
+from answer_cache import normalize_question
+from throttling import CircuitOpenError, guarded_call, is_throttling_error
+from fast_path import KANA_RE
+from model_router import context_text, low_confidence
+from retrieval_cache import CachingRetriever
+
+logger = logging.getLogger(__name__)
+
+# 降级回答最多列出的片段数和每段字数
+DEGRADED_SNIPPETS = 3
+DEGRADED_SNIPPET_CHARS = 200
+
+
+def extract_citations(response):
+    """从 retrieve_and_generate 响应中提取引用文件名（去重）"""
+    citations = []
+    for citation in response.get('citations', []):
+        _add_citation_files(citations, citation.get('retrievedReferences', []))
+    return citations
+
+
+def _add_citation_files(citations, references):
+    for ref in references:
+        filename = reference_name(ref)
+        if filename and filename not in citations:
+            citations.append(filename)
+
+
+def is_unavailable(error):
+    """熔断断开或重试后仍被限流：模型暂时不可用，可以降级"""
+    return isinstance(error, CircuitOpenError) or is_throttling_error(error)
+
+
+def error_result(error):
+    """{'error'}，熔断时附带 retry_after（秒）"""
+    result = {'error': str(error)}
+    if isinstance(error, CircuitOpenError):
+        result['retry_after'] = error.retry_after
+    return result
+
+
+def degraded_answer(question, references):
+    """不调用模型，直接列出检索到的原文片段"""
+    if KANA_RE.search(question):
+        lines = ["現在回答を生成できないため、関連する文書の抜粋を表示します："]
+    else:
+        lines = ["暂时无法生成回答，以下是检索到的相关文档片段："]
+    for ref in references[:DEGRADED_SNIPPETS]:
+        text = ' '.join(ref['content']['text'].split())
+        if len(text) > DEGRADED_SNIPPET_CHARS:
+            text = text[:DEGRADED_SNIPPET_CHARS] + '…'
+        lines.append(f"- [{reference_name(ref)}] {text}")
+    return '\n'.join(lines)
+
+
+def has_references(response):
+    """模型是否引用了任何检索内容（外部来源模式下引用没有文件名）"""
+    return any(citation.get('retrievedReferences') for citation in response.get('citations', []))
+
+
+class QueryStream:
+    """流式查询结果：迭代得到回答文本片段，迭代结束后 result 为完整结果"""
+
+    def __init__(self, produce):
+        self.metrics = StreamMetrics()
+        self.result = None
+        self._chunks = produce(self)
+
+    def __iter__(self):
+        return self._chunks
+
+
+class KnowledgeBaseQuery:
+    """基于 retrieve_and_generate 的知识库问答，可选问答缓存
+
+    retriever 为可选的检索后端（如 LocalRetriever），设置后先在本地检索，
+    再以 EXTERNAL_SOURCES 模式生成回答；检索不到内容时回退到知识库检索。
+    fast_path 为可选的 FastPathAnswerer，检索结果足以直接作答时跳过生成；
+    未指定检索后端时用知识库 retrieve API 检索。结果中的 path 记录走了哪条路径（fast / generate），
+    timings 记录各阶段耗时（同时汇入 metrics.REGISTRY 的直方图）。
+    single_flight 为可选的 SingleFlight（通常在进程内共享），相同问题正在查询时等待其结果，
+    不重复调用模型；这样得到的结果带有 coalesced=True。
+    guard / retrieve_guard 为可选的 RequestGuard，分别用于生成和知识库检索；生成熔断或持续被限流时，
+    有检索结果则返回由原文片段组成的降级回答（path 为 degraded，不写入缓存），否则返回带 retry_after 的错误。
+    router 为可选的 ModelRouter，按问题和检索上下文选择模型档位（此时总是先检索），结果带有 model_tier；
+    非流式查询的回答置信度低时升级档位重新生成（escalations 为升级次数），流式回答已输出，不再升级。
+    retrieval_cache 为可选的 RetrievalCache（通常在进程内共享），设置后同样先检索，相同问题的检索结果直接取自缓存。
+    """
+
+    def __init__(self, client, kb_id, model_arn, cache=None, retriever=None, fast_path=None, single_flight=None,
+                 guard=None, retrieve_guard=None, router=None, retrieval_cache=None):
+        self.client = client
+        self.kb_id = kb_id
+        self.model_arn = model_arn
+        self.cache = cache
+        self.fast_path = fast_path
+        self.single_flight = single_flight
+        self.guard = guard
+        self.router = router
+        if retriever is None and (fast_path is not None or router is not None or retrieval_cache is not None):
+            retriever = KnowledgeBaseRetriever(client, kb_id, guard=retrieve_guard)
+        if retrieval_cache is not None:
+            retriever = CachingRetriever(retriever, retrieval_cache)
+        self.retriever = retriever
+
+    def _configuration(self, references=None, tier=None):
+        """生成配置：有检索结果时为 EXTERNAL_SOURCES，否则由知识库检索；tier 指定模型档位"""
+        model_arn = tier.model_arn if tier is not None else self.model_arn
+        if references:
+            return external_sources_configuration(model_arn, references)
+        return {
+            'type': 'KNOWLEDGE_BASE',
+            'knowledgeBaseConfiguration': {
+                'knowledgeBaseId': self.kb_id,
+                'modelArn': model_arn
+            }
+        }
+
+    def _prepare(self, question, result, trace):
+        """返回检索结果；未使用检索后端或没有检索到内容时为 None"""
+        if self.retriever is None:
+            return None
+        with trace.span('retrieval'):
+            references = self.retriever.retrieve(question)
+        result['retrieval_time'] = trace.spans['retrieval']
+        return references or None
+
+    def _generate(self, question, references, result, trace):
+        """调用模型生成，返回响应；低置信度时升级档位，升级后的调用失败则保留之前的回答"""
+        tier = self.router.choose(question, references) if self.router is not None else None
+        response = None
+        escalations = 0
+        while True:
+            call_start = trace.clock()
+            try:
+                response = guarded_call(
+                    self.guard, self.client.retrieve_and_generate,
+                    input={'text': question},
+                    retrieveAndGenerateConfiguration=self._configuration(references, tier)
+                )
+            except Exception as e:
+                if response is None:
+                    raise
+                logger.warning("升级到 %s 失败，保留较低档位的回答: %s", tier.name, e)
+                tier = self.router.tiers[self.router.tiers.index(tier) - 1]
+                escalations -= 1
+                break
+            finally:
+                trace.record('generation', trace.clock() - call_start)
+            if tier is None:
+                break
+            answer = response['output']['text']
+            self.router.record(tier, trace.clock() - call_start, question + context_text(references), answer,
+                               escalated=escalations > 0)
+            higher = self.router.escalate(tier)
+            if higher is None or not low_confidence(answer, has_references(response)):
+                break
+            logger.info("回答置信度低，升级模型档位: %s -> %s", tier.name, higher.name)
+            tier = higher
+            escalations += 1
+        if tier is not None:
+            result.update({'model_tier': tier.name, 'escalations': escalations})
+        return response
+
+    def _fast_answer(self, question, references, result, start_time, trace):
+        """快速路径命中时返回完整结果，否则返回 None"""
+        if self.fast_path is None or not references:
+            return None
+        with trace.span('fast_path'):
+            answer = self.fast_path.answer(question, references)
+        if answer is None:
+            return None
+        result.update({
+            'answer': answer['answer'],
+            'citations': answer['citations'],
+            'response_time': time.time() - start_time,
+            'path': 'fast',
+            'confidence': answer['confidence'],
+            'heading': answer['heading']
+        })
+        return result
+
+    def _degraded(self, question, references, result, start_time, error):
+        """生成不可用时的降级结果；不能降级时返回 None"""
+        if not references or not is_unavailable(error):
+            return None
+        logger.warning("生成不可用，返回检索片段: %s", error)
+        result.update({
+            'answer': degraded_answer(question, references),
+            'citations': [],
+            'response_time': time.time() - start_time,
+            'path': 'degraded',
+            'degraded': True
+        })
+        _add_citation_files(result['citations'], references[:DEGRADED_SNIPPETS])
+        if isinstance(error, CircuitOpenError):
+            result['retry_after'] = error.retry_after
+        return result
+
+    @staticmethod
+    def _finish(result, trace, fields, cached=False):
+        """结束计时并输出一条汇总日志，路径和各阶段耗时作为结构化字段"""
+        if 'error' in result:
+            trace.finish(path=result.get('path'), status='error')
+            logger.warning("查询失败: %s", result['error'], extra={'fields': fields})
+            return
+        path = 'cache' if cached else result.get('path')
+        result['timings'] = trace.finish(path=path, status='degraded' if result.get('degraded') else 'ok')
+        summary = {**fields, 'path': path, 'response_time': round(result['response_time'], 4),
+                   'citations': len(result['citations']), 'timings': result['timings']}
+        if result.get('confidence') is not None:
+            summary['confidence'] = round(result['confidence'], 4)
+        if result.get('heading'):
+            summary['heading'] = result['heading']
+        if result.get('model_tier'):
+            summary['model_tier'] = result['model_tier']
+        logger.info("查询完成", extra={'fields': summary})
+
+    def _flight_config(self):
+        """影响回答的配置（检索后端、检索缓存、快速路径、模型路由），配置不同的实例不合并"""
+        retriever = self.retriever
+        cached = isinstance(retriever, CachingRetriever)
+        if cached:
+            retriever = retriever.retriever
+        if retriever is None:
+            source = None
+        elif isinstance(retriever, KnowledgeBaseRetriever):
+            source = ('kb', retriever.top_k)
+        else:
+            # 本地检索器、快速路径和路由器通常在进程内共享，按对象区分
+            source = id(retriever)
+        return (source, cached, id(self.fast_path) if self.fast_path is not None else None,
+                id(self.router) if self.router is not None else None)
+
+    def _flight_key(self, question):
+        # 不同实例（各浏览器会话）查询同一知识库和模型、且配置相同时可以合并
+        return self.kb_id, self.model_arn, self._flight_config(), normalize_question(question)
+
+    @staticmethod
+    def _coalesced(result, start_time, time_to_first_chunk=None):
+        """跟随者的结果：响应时间按自己的等待时间计算"""
+        if 'error' not in result:
+            result['coalesced'] = True
+            result['response_time'] = time.time() - start_time
+            if time_to_first_chunk is not None:
+                result['time_to_first_chunk'] = time_to_first_chunk
+        return result
+
+    def query(self, question):
+        """查询知识库，返回 {'answer', 'citations', 'response_time', 'timings'} 或 {'error'}"""
+        if self.single_flight is None:
+            return self._traced_query(question)
+        start_time = time.time()
+        result, shared = self.single_flight.do(self._flight_key(question), lambda: self._traced_query(question))
+        return self._coalesced(result, start_time) if shared else result
+
+    def _traced_query(self, question):
+        with query_context() as fields:
+            trace = Trace()
+            result, cached = self._query(question, trace)
+            self._finish(result, trace, fields, cached)
+            return result
+
+    def _query(self, question, trace):
+        """返回 (结果, 是否命中问答缓存)"""
+        try:
+            start_time = time.time()
+            if self.cache is not None:
+                with trace.span('cache_lookup'):
+                    cached = self.cache.get(question)
+                if cached is not None:
+                    cached['response_time'] = time.time() - start_time
+                    return cached, True
+
+            result = {}
+            references = self._prepare(question, result, trace)
+            fast = self._fast_answer(question, references, result, start_time, trace)
+            if fast is not None:
+                if self.cache is not None:
+                    self.cache.put(question, fast)
+                return fast, False
+            try:
+                response = self._generate(question, references, result, trace)
+            except Exception as e:
+                degraded = self._degraded(question, references, result, start_time, e)
+                if degraded is None:
+                    raise
+                return degraded, False
+            end_time = time.time()
+
+            with trace.span('citations'):
+                if references is not None:
+                    citations = []
+                    _add_citation_files(citations, references)
+                else:
+                    citations = extract_citations(response)
+            result.update({
+                'answer': response['output']['text'],
+                'citations': citations,
+                'response_time': end_time - start_time,
+                'path': 'generate'
+            })
+            if self.cache is not None:
+                self.cache.put(question, result)
+            return result, False
+
+        except Exception as e:
+            return error_result(e), False
+
+    def stream_query(self, question):
+        """流式查询知识库（retrieve_and_generate_stream），返回 QueryStream"""
+        if self.single_flight is None:
+            return QueryStream(lambda stream: self._stream_chunks(question, stream))
+
+        def start():
+            source = QueryStream(lambda stream: self._stream_chunks(question, stream))
+            return iter(source), lambda: source.result
+
+        broadcast, leader = self.single_flight.stream(self._flight_key(question), start)
+        return QueryStream(lambda stream: self._subscribe(broadcast, leader, stream))
+
+    def _subscribe(self, broadcast, leader, stream):
+        """从共享的流中读取回答片段；领头请求和跟随者各自得到结果副本"""
+        start_time = time.time()
+        try:
+            yield from stream.metrics.track(broadcast.subscribe())
+        except Exception as e:
+            stream.result = error_result(e)
+            return
+        result = copy.deepcopy(broadcast.result)
+        stream.result = result if leader else self._coalesced(result, start_time,
+                                                              stream.metrics.time_to_first_chunk)
+
+    def _stream_chunks(self, question, stream):
+        metrics = stream.metrics
+        trace = Trace()
+        start_time = time.time()
+        parts = []
+        citations = []
+        # 生成器跨 yield 挂起，只在不含 yield 的同步步骤中设置查询上下文
+        fields = {'query_id': new_query_id(), 'stream': True}
+        try:
+            cached = None
+            if self.cache is not None:
+                with trace.span('cache_lookup'):
+                    cached = self.cache.get(question)
+            if cached is not None:
+                yield from metrics.track([cached['answer']])
+                cached['response_time'] = time.time() - start_time
+                cached['time_to_first_chunk'] = metrics.time_to_first_chunk
+                stream.result = cached
+                self._finish(cached, trace, fields, cached=True)
+                return
+
+            result = {}
+            with query_context(**fields):
+                references = self._prepare(question, result, trace)
+                fast = self._fast_answer(question, references, result, start_time, trace)
+            if fast is not None:
+                yield from metrics.track([fast['answer']])
+                fast['time_to_first_chunk'] = metrics.time_to_first_chunk
+                if self.cache is not None:
+                    self.cache.put(question, fast)
+                stream.result = fast
+                self._finish(fast, trace, fields)
+                return
+            if references is not None:
+                with trace.span('citations'):
+                    _add_citation_files(citations, references)
+            tier = self.router.choose(question, references) if self.router is not None else None
+            generation_start = trace.clock()
+            try:
+                response = guarded_call(
+                    self.guard, self.client.retrieve_and_generate_stream,
+                    input={'text': question},
+                    retrieveAndGenerateConfiguration=self._configuration(references, tier)
+                )
+            except Exception as e:
+                degraded = self._degraded(question, references, result, start_time, e)
+                if degraded is None:
+                    raise
+                yield from metrics.track([degraded['answer']])
+                degraded['time_to_first_chunk'] = metrics.time_to_first_chunk
+                stream.result = degraded
+                self._finish(degraded, trace, fields)
+                return
+
+            def texts():
+                for event in response['stream']:
+                    if 'output' in event:
+                        text = event['output'].get('text', '')
+                        if text:
+                            parts.append(text)
+                            yield text
+                    elif 'citation' in event and references is None:
+                        citation = event['citation']
+                        with trace.span('citations'):
+                            cited = citation.get('retrievedReferences') or \
+                                citation.get('citation', {}).get('retrievedReferences', [])
+                            _add_citation_files(citations, cited)
+
+            yield from metrics.track(texts())
+            # 生成耗时从发起请求到最后一段，包含调用方处理每一段（如界面渲染）的时间
+            trace.record('generation', trace.clock() - generation_start)
+            if metrics.first_chunk_at is not None:
+                trace.record('time_to_first_chunk', metrics.first_chunk_at - generation_start)
+            if tier is not None:
+                self.router.record(tier, trace.spans['generation'], question + context_text(references),
+                                   ''.join(parts), fields=fields)
+                result.update({'model_tier': tier.name, 'escalations': 0})
+
+            result.update({
+                'answer': ''.join(parts),
+                'citations': citations,
+                'response_time': time.time() - start_time,
+                'time_to_first_chunk': metrics.time_to_first_chunk,
+                'path': 'generate'
+            })
+            if self.cache is not None:
+                self.cache.put(question, result)
+            stream.result = result
+            self._finish(result, trace, fields)
+
+        except Exception as e:
+            # 流式响应中途的限流不经过 guard.call()，单独反馈给限速器
+            if self.guard is not None and is_throttling_error(e):
+                self.guard.record_throttle()
+            stream.result = error_result(e)
+            self._finish(stream.result, trace, fields)
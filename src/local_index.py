@@ -0,0 +1,172 @@
+"""
+本地向量索引
+把 documents/ 下的 Markdown 文档按标题层级切分成片段，向量化后保存在归一化的 NumPy 矩阵中，
+用矩阵乘法做批量 top-k 检索；嵌入模型可替换（离线哈希嵌入 / Bedrock Titan）
+"""
+
+import os
+import re
+import json
+import zlib
+import logging
+
+import numpy as np
+
+from md_chunker import DEFAULT_MAX_TOKENS, DEFAULT_OVERLAP_TOKENS, SectionIndex, chunk_file, list_markdown_files
+
+logger = logging.getLogger(__name__)
+
+WORD_RE = re.compile(r'[0-9a-z]+(?:[._-][0-9a-z]+)*')
+CJK_RE = re.compile(r'[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff66-\uff9f]+')
+
+
+def load_chunks(documents_path, max_tokens=DEFAULT_MAX_TOKENS, overlap_tokens=DEFAULT_OVERLAP_TOKENS,
+                section_index_path=None):
+    """按标题层级切分目录（含子目录）下所有 .md 文档（见 md_chunker.py）
+
+    指定 section_index_path 时使用小节索引，只重新切分变化的小节。
+    """
+    if section_index_path:
+        return SectionIndex(section_index_path, max_tokens, overlap_tokens).update(documents_path)
+    chunks = []
+    for name in list_markdown_files(documents_path):
+        chunks.extend(chunk_file(os.path.join(documents_path, name), max_tokens, overlap_tokens, source=name))
+    return chunks
+
+
+def tokenize(text):
+    """英文 / 数字按词切分，中日文按单字和相邻双字切分"""
+    text = text.lower()
+    tokens = WORD_RE.findall(text)
+    for run in CJK_RE.findall(text):
+        tokens.extend(run)
+        tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class HashingEmbedder:
+    """确定性的离线嵌入：特征哈希词袋
+
+    不需要模型和网络，相同文本在任何进程中得到相同向量，适合测试和无 AWS 环境。
+    """
+
+    def __init__(self, dimensions=512):
+        self.dimensions = dimensions
+        self.model_id = f"hashing-{dimensions}"
+
+    def embed(self, texts):
+        matrix = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for token in tokenize(text):
+                # zlib.crc32 在进程间稳定（内置 hash() 会随机化）
+                h = zlib.crc32(token.encode('utf-8'))
+                matrix[row, h % self.dimensions] += 1.0 if h & 0x80000000 else -1.0
+        return normalize_rows(matrix)
+
+    def __call__(self, text):
+        return self.embed([text])[0]
+
+
+class BedrockEmbedder:
+    """Amazon Titan Text Embeddings v2（bedrock-runtime invoke_model）"""
+
+    def __init__(self, client=None, model_id="amazon.titan-embed-text-v2:0", dimensions=1024):
+        if client is None:
+            from aws_clients import get_client
+            client = get_client('bedrock-runtime')
+        self.client = client
+        self.model_id = model_id
+        self.dimensions = dimensions
+
+    def embed(self, texts):
+        # Titan v2 每次调用只接受一段文本
+        matrix = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            response = self.client.invoke_model(
+                modelId=self.model_id,
+                body=json.dumps({'inputText': text, 'dimensions': self.dimensions, 'normalize': True})
+            )
+            matrix[row] = json.loads(response['body'].read())['embedding']
+        return normalize_rows(matrix)
+
+    def __call__(self, text):
+        return self.embed([text])[0]
+
+
+class VectorIndex:
+    """归一化向量矩阵 + 片段列表，余弦相似度检索
+
+    vectors 可以是 float16 / float32 的内存映射数组（见 index_store.py），chunks 可以是按需解码的序列。
+    """
+
+    # 分块计算相似度，float16 矩阵转换为 float32 时只占用一个块的临时内存
+    score_block_rows = 16384
+
+    def __init__(self, embedder, vectors=None, chunks=None):
+        self.embedder = embedder
+        self.chunks = chunks if chunks is not None else []
+        self.vectors = vectors if vectors is not None else np.zeros((0, 0), dtype=np.float32)
+
+    def add(self, chunks, batch_size=64):
+        """向量化并追加片段"""
+        chunks = list(chunks)
+        batches = [self.embedder.embed([c['text'] for c in chunks[i:i + batch_size]])
+                   for i in range(0, len(chunks), batch_size)]
+        if not batches:
+            return
+        new_vectors = np.vstack(batches).astype(np.float32)
+        if len(self.chunks) == 0:
+            self.vectors = new_vectors
+        else:
+            self.vectors = np.vstack([np.asarray(self.vectors, dtype=np.float32), new_vectors])
+        self.chunks = list(self.chunks) + chunks
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def search_vectors(self, query_vectors, top_k=5):
+        """批量检索，返回每个查询的 [(片段下标, 分数)]，按分数降序"""
+        if len(self.chunks) == 0:
+            return [[] for _ in range(len(query_vectors))]
+        queries = np.asarray(query_vectors, dtype=np.float32)
+        if self.vectors.dtype == np.float32:
+            scores = queries @ self.vectors.T
+        else:
+            scores = np.empty((len(queries), len(self.chunks)), dtype=np.float32)
+            for start in range(0, len(self.chunks), self.score_block_rows):
+                block = np.asarray(self.vectors[start:start + self.score_block_rows], dtype=np.float32)
+                scores[:, start:start + len(block)] = queries @ block.T
+        k = min(top_k, scores.shape[1])
+        if k < scores.shape[1]:
+            candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            candidates = np.tile(np.arange(scores.shape[1]), (scores.shape[0], 1))
+        results = []
+        for row, columns in enumerate(candidates):
+            row_scores = scores[row, columns]
+            order = np.argsort(-row_scores)[:k]
+            results.append([(int(columns[i]), float(row_scores[i])) for i in order])
+        return results
+
+    def search_batch(self, queries, top_k=5):
+        """批量检索文本查询，返回每个查询的 [(片段, 分数)]"""
+        hits = self.search_vectors(self.embedder.embed(list(queries)), top_k)
+        return [[(self.chunks[i], score) for i, score in row] for row in hits]
+
+    def search(self, query, top_k=5):
+        return self.search_batch([query], top_k)[0]
+
+
+def build_index(documents_path, embedder=None, max_tokens=DEFAULT_MAX_TOKENS,
+                overlap_tokens=DEFAULT_OVERLAP_TOKENS, section_index_path=None):
+    """从文档目录构建索引（默认使用离线哈希嵌入）"""
+    index = VectorIndex(embedder or HashingEmbedder())
+    index.add(load_chunks(documents_path, max_tokens, overlap_tokens, section_index_path))
+    logger.info(f"本地索引构建完成: {len(index)} 个片段")
+    return index
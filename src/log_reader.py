@@ -0,0 +1,230 @@
+"""
+日志读取
+从文件末尾按块向前读取，分页查看、按级别 / 时间 / 关键字过滤、增量跟踪新日志，
+不把整个日志文件读入内存；支持 RotatingFileHandler（.1 .2 ...）和
+TimedRotatingFileHandler（.2024-01-01 等后缀）轮转出的文件；
+同时识别 logging_setup 写出的 JSON 行和旧的文本格式
+"""
+
+import os
+import re
+import glob
+import json
+import logging
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+LEVELS = ['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL']
+# 文本格式（控制台及旧日志）：时间 - 模块 - 级别 - 消息
+HEADER_RE = re.compile(r'^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})(?:,\d+)? - (.*?) - ([A-Z]+) - ')
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+DEFAULT_BLOCK_SIZE = 64 * 1024
+
+
+# JSON 行中 ts / level / logger / msg / exc 以外的键是结构化字段
+JSON_KEYS = ('ts', 'level', 'logger', 'msg', 'exc')
+
+
+def parse_json_record(line):
+    """解析 JSON 行记录，返回 (显示行, 时间, 模块, 级别)；不是 JSON 记录时返回 None"""
+    if not line.startswith('{'):
+        return None
+    try:
+        record = json.loads(line)
+        timestamp = datetime.fromisoformat(record['ts'])
+    except (ValueError, KeyError, TypeError):
+        return None
+    name, level = record.get('logger', ''), record.get('level', '')
+    text = f"{timestamp.isoformat(sep=' ', timespec='milliseconds')} - {name} - {level} - {record.get('msg', '')}"
+    fields = ' '.join(f"{k}={v}" for k, v in record.items() if k not in JSON_KEYS)
+    lines = [f"{text} {fields}" if fields else text]
+    if record.get('exc'):
+        lines.extend(record['exc'].split('\n'))
+    return lines, timestamp, name, level
+
+
+def parse_header(line):
+    """返回 (时间, 模块, 级别)；不是记录首行（如异常堆栈的续行）时返回 None"""
+    match = HEADER_RE.match(line)
+    if not match:
+        return None
+    try:
+        timestamp = datetime.strptime(match.group(1), TIME_FORMAT)
+    except ValueError:
+        return None
+    return timestamp, match.group(2), match.group(3)
+
+
+def log_files(path):
+    """当前日志及其轮转文件，从新到旧"""
+    rotated = [p for p in glob.glob(glob.escape(path) + '.*')
+               if os.path.isfile(p) and not p.endswith(('.gz', '.zip', '.bz2'))]
+    rotated.sort(key=os.path.getmtime, reverse=True)
+    return ([path] if os.path.exists(path) else []) + rotated
+
+
+def iter_lines_reverse(path, end=None, block_size=DEFAULT_BLOCK_SIZE):
+    """从 end（默认文件末尾）向前逐行产出 (行首偏移, 行文本)，每次只读取一个块"""
+    with open(path, 'rb') as f:
+        position = f.seek(0, os.SEEK_END) if end is None else end
+        remainder = b''
+        while position > 0:
+            size = min(block_size, position)
+            position -= size
+            f.seek(position)
+            block = f.read(size) + remainder
+            lines = block.split(b'\n')
+            # 第一段可能是被块边界截断的行，留到下一轮拼接
+            remainder = lines.pop(0)
+            offset = position + len(remainder) + 1
+            entries = []
+            for line in lines:
+                entries.append((offset, line))
+                offset += len(line) + 1
+            for offset, line in reversed(entries):
+                if line:
+                    yield offset, line.decode('utf-8', errors='replace').rstrip('\r')
+        if remainder:
+            yield 0, remainder.decode('utf-8', errors='replace').rstrip('\r')
+
+
+class LogEntry:
+    """一条日志记录：首行 + 续行（异常堆栈等）"""
+
+    def __init__(self, lines, timestamp=None, name='', level='', source='', offset=0):
+        self.lines = lines
+        self.timestamp = timestamp
+        self.name = name
+        self.level = level
+        self.source = source
+        self.offset = offset
+
+    @property
+    def text(self):
+        return '\n'.join(self.lines)
+
+
+def _matches(entry, levels, since, until, contains):
+    if levels and entry.level not in levels:
+        return False
+    if entry.timestamp is not None:
+        if since is not None and entry.timestamp < since:
+            return False
+        if until is not None and entry.timestamp > until:
+            return False
+    return not contains or contains in entry.text
+
+
+class LogReader:
+    """enterprise_rag.log 的分页读取与增量跟踪
+
+    page() 返回的游标为 (文件序号, 偏移)，表示下一页从 log_files()[文件序号] 的该偏移处继续向前读取；
+    跟踪位置为 (inode, 偏移)，文件被轮转或截断后从新文件开头读起。
+    """
+
+    def __init__(self, path, block_size=DEFAULT_BLOCK_SIZE):
+        self.path = path
+        self.block_size = block_size
+
+    def _iter_entries_reverse(self, cursor):
+        """从游标处向前产出完整记录（续行归入其上方的首行）"""
+        file_index, end = cursor or (0, None)
+        files = log_files(self.path)
+        for index in range(file_index, len(files)):
+            continuation = []
+            for offset, line in iter_lines_reverse(files[index], end if index == file_index else None,
+                                                   self.block_size):
+                record = parse_json_record(line)
+                if record is not None:
+                    # JSON 记录自成一行，之前积累的续行属于旧格式的残余内容，单独产出
+                    if continuation:
+                        continuation.reverse()
+                        yield LogEntry(continuation, source=files[index], offset=first_offset), \
+                            (index, first_offset)
+                        continuation = []
+                    yield LogEntry(*record, source=files[index], offset=offset), (index, offset)
+                    continue
+                header = parse_header(line)
+                if header is None:
+                    continuation.append(line)
+                    first_offset = offset
+                    continue
+                continuation.reverse()
+                yield LogEntry([line] + continuation, *header, source=files[index], offset=offset), (index, offset)
+                continuation = []
+            if continuation:
+                # 文件开头没有首行的残余内容（轮转时被截断的记录）
+                continuation.reverse()
+                yield LogEntry(continuation, source=files[index]), (index, 0)
+
+    def page(self, cursor=None, limit=200, levels=None, since=None, until=None, contains=None):
+        """向前读取一页，返回 (按时间顺序排列的记录, 下一页游标)；没有更早的记录时游标为 None
+
+        since 之前的记录不会再出现（日志按时间追加），读到后立即停止，不扫描更早的文件。
+        """
+        entries = []
+        next_cursor = None
+        for entry, position in self._iter_entries_reverse(cursor):
+            if since is not None and entry.timestamp is not None and entry.timestamp < since:
+                next_cursor = None
+                break
+            next_cursor = position
+            if not _matches(entry, levels, since, until, contains):
+                continue
+            entries.append(entry)
+            if len(entries) >= limit:
+                break
+        else:
+            next_cursor = None
+        entries.reverse()
+        return entries, next_cursor
+
+    def tail(self, limit=200, **filters):
+        """最新的 limit 条记录"""
+        return self.page(None, limit, **filters)[0]
+
+    def end_position(self):
+        """当前日志末尾的跟踪位置"""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None, 0
+        return stat.st_ino, stat.st_size
+
+    def read_new(self, position, max_bytes=1024 * 1024, levels=None, contains=None):
+        """读取跟踪位置之后新写入的完整行，返回 (记录, 新位置)"""
+        inode, offset = position or (None, 0)
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return [], (None, 0)
+        if stat.st_ino != inode or stat.st_size < offset:
+            logger.debug("日志文件已轮转或截断，从头读取: %s", self.path)
+            offset = 0
+        if stat.st_size == offset:
+            return [], (stat.st_ino, offset)
+
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            data = f.read(max_bytes)
+        # 最后一行可能还没写完，留到下次读取（单行超过 max_bytes 时整段返回）
+        consumed = data.rfind(b'\n') + 1
+        if consumed == 0 and len(data) == max_bytes:
+            consumed = len(data)
+        entries = []
+        line_offset = offset
+        for raw in data[:consumed].rstrip(b'\n').split(b'\n') if consumed else []:
+            line = raw.decode('utf-8', errors='replace').rstrip('\r')
+            record = parse_json_record(line)
+            header = parse_header(line)
+            if record is not None:
+                entries.append(LogEntry(*record, source=self.path, offset=line_offset))
+            elif header is None and entries:
+                entries[-1].lines.append(line)
+            elif line:
+                entries.append(LogEntry([line], *(header or (None, '', '')), source=self.path,
+                                        offset=line_offset))
+            line_offset += len(raw) + 1
+        entries = [entry for entry in entries if _matches(entry, levels, None, None, contains)]
+        return entries, (stat.st_ino, offset + consumed)
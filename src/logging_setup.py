@@ -0,0 +1,213 @@
+"""
+日志管线
+请求线程只把日志记录放入内存队列（满时丢弃并计数，不会阻塞），由 QueueListener 的后台线程写盘；
+文件为 JSON 行格式，按大小和时间轮转；查询 ID、耗时等通过 extra={'fields': {...}} 作为结构化字段输出，
+便于按查询聚合。DEBUG 日志按查询 ID 抽样，同一查询的调试日志要么全部保留要么全部丢弃
+"""
+
+import os
+import sys
+import copy
+import json
+import time
+import zlib
+import queue
+import atexit
+import logging
+import threading
+import contextvars
+from uuid import uuid4
+from datetime import datetime
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+DEFAULT_LOG_FILE = "enterprise_rag.log"
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+# 第三方库的调试日志量很大，根日志器为 DEBUG 时仍只保留其 INFO 以上
+NOISY_LOGGERS = ('botocore', 'boto3', 'urllib3', 's3transfer')
+
+_context = contextvars.ContextVar('log_context', default={})
+_lock = threading.Lock()
+_state = {'listener': None, 'handler': None, 'log_file': None, 'sample_rate': 0.0}
+
+
+def new_query_id():
+    return uuid4().hex[:12]
+
+
+def current_fields():
+    """当前上下文中的结构化字段（含 query_id）"""
+    return _context.get()
+
+
+@contextmanager
+def query_context(query_id=None, **fields):
+    """在 with 块内产生的日志自动带上 query_id 等字段（同步代码使用；生成器中请直接传 extra）"""
+    token = _context.set({**_context.get(), 'query_id': query_id or new_query_id(), **fields})
+    try:
+        yield _context.get()
+    finally:
+        _context.reset(token)
+
+
+def is_sampled(query_id):
+    """该查询的调试日志是否被抽中（按查询 ID 哈希，结果稳定）"""
+    rate = _state['sample_rate']
+    if rate <= 0 or not query_id:
+        return False
+    return zlib.crc32(query_id.encode('utf-8')) % 10000 < rate * 10000
+
+
+def debug_enabled(query_id=None):
+    """热路径上先判断再拼接调试日志，未抽中的查询不产生任何开销"""
+    return is_sampled(query_id or _context.get().get('query_id'))
+
+
+class ContextFilter(logging.Filter):
+    """在请求线程中把上下文字段合并到记录上，并按抽样结果过滤 DEBUG 记录"""
+
+    def __init__(self, level=logging.INFO):
+        super().__init__()
+        self.level = level
+
+    def filter(self, record):
+        fields = {**_context.get(), **getattr(record, 'fields', {})}
+        record.fields = fields
+        if record.levelno >= self.level:
+            return True
+        return is_sampled(fields.get('query_id'))
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """队列满时丢弃记录并计数，请求线程不等待写盘"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record):
+        # 在请求线程中格式化消息和异常，后台线程只负责序列化和写盘
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """每条记录一行 JSON：ts / level / logger / msg，结构化字段平铺在同一层"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for key, value in getattr(record, 'fields', {}).items():
+            entry.setdefault(key, value)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """控制台格式：原有的文本格式，结构化字段以 key=value 附在消息后"""
+
+    def __init__(self):
+        super().__init__(TEXT_FORMAT)
+
+    def format(self, record):
+        text = super().format(record)
+        fields = getattr(record, 'fields', None)
+        if fields:
+            first, _, rest = text.partition('\n')
+            text = first + ' ' + ' '.join(f"{k}={v}" for k, v in fields.items()) + (f"\n{rest}" if rest else '')
+        return text
+
+
+class SizeTimeRotatingFileHandler(RotatingFileHandler):
+    """超过 max_bytes 或距上次轮转超过 interval 秒时轮转，文件名沿用 .1 .2 ... 的编号"""
+
+    def __init__(self, filename, max_bytes, backup_count, interval=None, encoding='utf-8'):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding=encoding, delay=True)
+        self.interval = interval
+        self.rollover_at = time.time() + interval if interval else None
+
+    def shouldRollover(self, record):
+        if self.rollover_at is not None and time.time() >= self.rollover_at:
+            return True
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        if self.interval:
+            self.rollover_at = time.time() + self.interval
+
+
+def setup_logging(log_file=DEFAULT_LOG_FILE, level=logging.INFO, json_lines=True, max_bytes=50 * 1024 * 1024,
+                  backup_count=5, rotate_interval=24 * 3600, debug_sample_rate=None, console=True,
+                  queue_size=10000):
+    """配置根日志器：QueueHandler -> 后台线程 -> 轮转文件 + 控制台
+
+    重复调用（Streamlit 每次重跑）时直接返回；debug_sample_rate 为按查询抽样输出 DEBUG 日志的比例，
+    默认取环境变量 RAG_LOG_DEBUG_SAMPLE（如 0.01），未设置时不输出 DEBUG 日志。
+    """
+    if debug_sample_rate is None:
+        debug_sample_rate = float(os.environ.get('RAG_LOG_DEBUG_SAMPLE') or 0)
+    with _lock:
+        if _state['listener'] is not None:
+            return _state['handler']
+
+        file_handler = SizeTimeRotatingFileHandler(log_file, max_bytes, backup_count, rotate_interval)
+        file_handler.setFormatter(JsonFormatter() if json_lines else TextFormatter())
+        handlers = [file_handler]
+        if console:
+            console_handler = logging.StreamHandler(sys.stderr)
+            console_handler.setFormatter(TextFormatter())
+            console_handler.setLevel(level)
+            handlers.append(console_handler)
+
+        handler = NonBlockingQueueHandler(queue.Queue(maxsize=queue_size))
+        handler.addFilter(ContextFilter(level))
+        listener = QueueListener(handler.queue, *handlers, respect_handler_level=True)
+        listener.start()
+
+        root = logging.getLogger()
+        root.addHandler(handler)
+        root.setLevel(logging.DEBUG if debug_sample_rate > 0 else level)
+        for name in NOISY_LOGGERS:
+            logging.getLogger(name).setLevel(max(level, logging.INFO))
+
+        _state.update(listener=listener, handler=handler, log_file=log_file, sample_rate=debug_sample_rate)
+        atexit.register(shutdown_logging)
+        return handler
+
+
+def shutdown_logging():
+    """停止后台线程并写完队列中剩余的记录"""
+    with _lock:
+        listener, handler = _state['listener'], _state['handler']
+        if listener is None:
+            return
+        listener.stop()
+        logging.getLogger().removeHandler(handler)
+        for target in listener.handlers:
+            target.close()
+        _state.update(listener=None, handler=None, log_file=None, sample_rate=0.0)
+
+
+def logging_stats():
+    handler = _state['handler']
+    if handler is None:
+        return {'queued': 0, 'dropped': 0}
+    return {'queued': handler.queue.qsize(), 'dropped': handler.dropped}
@@ -0,0 +1,405 @@
+"""
+Markdown 结构化切分
+按标题层级逐行流式切分文档，每个片段受 token 预算限制并与前一片段保留少量重叠，
+携带标题路径元数据；预先计算的小节索引（section index）记录每个小节的哈希和切分结果，
+文档只改动一个小节时只重新切分该小节
+"""
+
+import os
+import re
+import json
+import shutil
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+HEADING_RE = re.compile(r'^(#{1,6})\s+(.*?)\s*#*\s*$')
+# 围栏代码块（``` 或 ~~~，最多缩进 3 个空格），块内以 # 开头的行不是标题
+FENCE_RE = re.compile(r'^ {0,3}(`{3,}|~{3,})(.*)$')
+# 中日文每个字约 1 个 token，英文单词 / 数字和标点各算 1 个
+TOKEN_RE = re.compile(r'[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]|[A-Za-z0-9]+|[^\sA-Za-z0-9]')
+
+DEFAULT_MAX_TOKENS = 300
+DEFAULT_OVERLAP_TOKENS = 50
+INDEX_VERSION = 1
+# 切分规则的版本，规则变化（切出的片段不同）时递增，使已保存的索引失效
+CHUNKER_VERSION = 2
+
+
+def estimate_tokens(text):
+    """粗略估计 token 数（不依赖具体模型的分词器）"""
+    return len(TOKEN_RE.findall(text))
+
+
+def _digest(text, length=16):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:length]
+
+
+class Section:
+    """一个标题及其正文（不含子标题）"""
+
+    def __init__(self, source, level, heading_path, heading_line, start_line):
+        self.source = source
+        self.level = level
+        self.heading_path = heading_path
+        self.heading_line = heading_line
+        self.start_line = start_line
+        self.lines = []
+        self.section_id = None
+
+    @property
+    def end_line(self):
+        return self.start_line + len(self.lines)
+
+    @property
+    def has_content(self):
+        return any(line.strip() for line in self.lines)
+
+    @property
+    def hash(self):
+        return _digest(self.heading_line + '\n' + '\n'.join(self.lines))
+
+
+def iter_sections(lines, source):
+    """逐行读取 Markdown，按标题产出 Section；只在内存中保留当前小节"""
+    stack = []  # [(级别, 标题)]
+    seen = {}
+    section = Section(source, 0, [], '', 1)
+    fence = None  # 所在代码块的围栏（字符, 长度）
+    for line_no, line in enumerate(lines, 1):
+        line = line.rstrip('\n').rstrip('\r')
+        fence_match = FENCE_RE.match(line)
+        if fence is not None:
+            # 同种字符、长度不小于开始围栏且后面没有其他内容时代码块结束
+            marker = fence_match.group(1) if fence_match else ''
+            if marker[:1] == fence[0] and len(marker) >= fence[1] and not fence_match.group(2).strip():
+                fence = None
+            section.lines.append(line)
+            continue
+        if fence_match and not (fence_match.group(1)[0] == '`' and '`' in fence_match.group(2)):
+            fence = (fence_match.group(1)[0], len(fence_match.group(1)))
+            section.lines.append(line)
+            continue
+        match = HEADING_RE.match(line)
+        if not match:
+            section.lines.append(line)
+            continue
+        yield _finish(section, seen)
+        level = len(match.group(1))
+        while stack and stack[-1][0] >= level:
+            stack.pop()
+        stack.append((level, match.group(2)))
+        section = Section(source, level, [title for _, title in stack], line, line_no + 1)
+    yield _finish(section, seen)
+
+
+def _finish(section, seen):
+    # 小节ID由文件名和标题路径决定，前面插入新小节不会改变后面小节的ID
+    key = ' > '.join(section.heading_path)
+    seen[key] = seen.get(key, 0) + 1
+    suffix = f"-{seen[key]}" if seen[key] > 1 else ''
+    section.section_id = f"{section.source}#{_digest(key, 10)}{suffix}"
+    return section
+
+
+def _blocks(lines):
+    """把正文拆成块：空行分隔的段落；列表 / 表格的每一行可以单独拆开"""
+    block = []
+    for line in lines:
+        if line.strip():
+            block.append(line)
+        elif block:
+            yield block
+            block = []
+    if block:
+        yield block
+
+
+def chunk_section(section, max_tokens=DEFAULT_MAX_TOKENS, overlap_tokens=DEFAULT_OVERLAP_TOKENS):
+    """把一个小节切成不超过 max_tokens 的片段，每个片段以小节标题开头"""
+    if not section.has_content:
+        return []
+    header = section.heading_line
+    header_tokens = estimate_tokens(header)
+    budget = max(1, max_tokens - header_tokens)
+
+    units = []  # [(行文本, token 数, 块首时为整块 token 数否则为 0)]
+    for block in _blocks(section.lines):
+        block_tokens = sum(estimate_tokens(line) for line in block)
+        for i, line in enumerate(block):
+            line_tokens = estimate_tokens(line)
+            if line_tokens > budget:
+                for piece in _split_long_line(line, budget):
+                    units.append((piece, estimate_tokens(piece), 0))
+            else:
+                units.append((line, line_tokens, block_tokens if i == 0 else 0))
+
+    chunks, current, current_tokens = [], [], 0
+    for text, tokens, block_tokens in units:
+        # 放得下的段落 / 列表尽量不拆开：整块放不进当前片段时在块首换片段
+        split_block = 0 < block_tokens <= budget and current_tokens + block_tokens > budget
+        if current and (current_tokens + tokens > budget or split_block):
+            chunks.append(current)
+            # 重叠：带上前一片段末尾不超过 overlap_tokens 的若干行
+            carry, carry_tokens = [], 0
+            for prev in reversed(current):
+                if carry_tokens + prev[1] > overlap_tokens or carry_tokens + prev[1] + max(tokens, block_tokens) > budget:
+                    break
+                carry.insert(0, prev)
+                carry_tokens += prev[1]
+            current, current_tokens = carry, carry_tokens
+        current.append((text, tokens, block_tokens))
+        current_tokens += tokens
+    if current:
+        chunks.append(current)
+
+    heading = ' > '.join(section.heading_path)
+    results = []
+    for index, lines in enumerate(chunks):
+        body = '\n'.join(text for text, _, _ in lines)
+        text = f"{header}\n{body}" if header else body
+        results.append({
+            'text': text,
+            'source': section.source,
+            'heading': heading,
+            'heading_path': list(section.heading_path),
+            'section_id': section.section_id,
+            'chunk_index': index,
+            'start_line': section.start_line,
+            'tokens': estimate_tokens(text),
+        })
+    return results
+
+
+def _split_long_line(line, max_tokens):
+    """按 token 数硬切超长的一行"""
+    pieces, start, tokens = [], 0, 0
+    for match in TOKEN_RE.finditer(line):
+        if tokens == max_tokens:
+            pieces.append(line[start:match.start()].strip())
+            start, tokens = match.start(), 0
+        tokens += 1
+    pieces.append(line[start:].strip())
+    return [piece for piece in pieces if piece]
+
+
+def chunk_lines(lines, source, max_tokens=DEFAULT_MAX_TOKENS, overlap_tokens=DEFAULT_OVERLAP_TOKENS):
+    """流式切分：逐个小节产出片段"""
+    for section in iter_sections(lines, source):
+        yield from chunk_section(section, max_tokens, overlap_tokens)
+
+
+def chunk_file(path, max_tokens=DEFAULT_MAX_TOKENS, overlap_tokens=DEFAULT_OVERLAP_TOKENS, source=None):
+    with open(path, 'r', encoding='utf-8') as f:
+        yield from chunk_lines(f, source or os.path.basename(path), max_tokens, overlap_tokens)
+
+
+def list_markdown_files(documents_path):
+    """目录下所有 .md 文档的相对路径（与 upload_engine.collect_documents 一样遍历子目录，以 / 分隔，已排序）"""
+    names = []
+    for root, _, files in os.walk(documents_path):
+        for file in files:
+            if file.endswith('.md'):
+                names.append(os.path.relpath(os.path.join(root, file), documents_path).replace(os.sep, '/'))
+    return sorted(names)
+
+
+class SectionIndex:
+    """小节索引：文件 -> 小节（ID、标题路径、行号、哈希、片段）
+
+    update() 时未变化的文件（大小和修改时间相同）直接复用，变化的文件逐个小节比较哈希，
+    只重新切分内容变化的小节。
+    """
+
+    def __init__(self, path=None, max_tokens=DEFAULT_MAX_TOKENS, overlap_tokens=DEFAULT_OVERLAP_TOKENS):
+        self.path = path
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+        self.files = {}
+        self.reused_sections = 0
+        self.chunked_sections = 0
+        if path and os.path.exists(path):
+            self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"小节索引无法读取，将重新切分: {e}")
+            return
+        # 切分参数或切分规则变化时旧结果不能复用
+        if (data.get('version') == INDEX_VERSION and data.get('chunker_version') == CHUNKER_VERSION
+                and data.get('max_tokens') == self.max_tokens and data.get('overlap_tokens') == self.overlap_tokens):
+            self.files = data.get('files', {})
+
+    def save(self):
+        if not self.path:
+            return
+        data = {
+            'version': INDEX_VERSION,
+            'chunker_version': CHUNKER_VERSION,
+            'max_tokens': self.max_tokens,
+            'overlap_tokens': self.overlap_tokens,
+            'files': self.files,
+        }
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.path)
+
+    def update(self, documents_path):
+        """同步目录（含子目录）下所有 .md 文档的切分结果，返回全部片段（按相对路径、行号排序）"""
+        self.reused_sections = self.chunked_sections = 0
+        names = list_markdown_files(documents_path)
+        for name in set(self.files) - set(names):
+            del self.files[name]
+
+        chunks = []
+        for name in names:
+            path = os.path.join(documents_path, name)
+            stat = os.stat(path)
+            entry = self.files.get(name)
+            if entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+                self.reused_sections += len(entry['sections'])
+            else:
+                entry = self._update_file(path, name, stat, entry)
+                self.files[name] = entry
+            for section in entry['sections']:
+                for chunk in section['chunks']:
+                    chunk = dict(chunk)
+                    chunk.update({'source': name, 'heading': ' > '.join(section['heading_path']),
+                                  'heading_path': section['heading_path'], 'section_id': section['id'],
+                                  'start_line': section['start_line']})
+                    chunks.append(chunk)
+        self.save()
+        logger.info(f"小节索引更新完成: 复用 {self.reused_sections} 个小节, 重新切分 {self.chunked_sections} 个小节, "
+                    f"共 {len(chunks)} 个片段")
+        return chunks
+
+    def _update_file(self, path, name, stat, old_entry):
+        old_sections = {s['id']: s for s in (old_entry or {}).get('sections', [])}
+        sections = []
+        with open(path, 'r', encoding='utf-8') as f:
+            for section in iter_sections(f, name):
+                if not section.has_content:
+                    continue
+                old = old_sections.get(section.section_id)
+                section_hash = section.hash
+                if old and old['hash'] == section_hash:
+                    chunks = old['chunks']
+                    self.reused_sections += 1
+                else:
+                    chunks = [{'text': c['text'], 'chunk_index': c['chunk_index'], 'tokens': c['tokens']}
+                              for c in chunk_section(section, self.max_tokens, self.overlap_tokens)]
+                    self.chunked_sections += 1
+                sections.append({
+                    'id': section.section_id,
+                    'heading_path': section.heading_path,
+                    'start_line': section.start_line,
+                    'end_line': section.end_line,
+                    'hash': section_hash,
+                    'chunks': chunks,
+                })
+        return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sections': sections}
+
+
+def chunk_filename(chunk):
+    """预切分文件名：由小节ID和片段序号决定，内容未变化的片段文件名保持不变"""
+    stem = os.path.splitext(chunk['source'])[0]
+    section_key = chunk['section_id'].split('#', 1)[1]
+    return f"{stem}__{section_key}_{chunk['chunk_index']:02d}.md"
+
+
+def export_chunks(chunks, output_dir):
+    """把片段写成独立文件和 Bedrock 知识库元数据文件（<文件名>.metadata.json）
+
+    内容相同的文件不重写（保留修改时间，增量上传会跳过），不再需要的片段文件被删除。
+    返回 (写入数, 删除数)。
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    expected = set()
+    written = 0
+    for chunk in chunks:
+        filename = chunk_filename(chunk)
+        metadata = json.dumps({'metadataAttributes': {
+            'source': chunk['source'],
+            'heading': chunk['heading'],
+            'section_id': chunk['section_id'],
+        }}, ensure_ascii=False, indent=1)
+        for name, content in ((filename, chunk['text']), (f"{filename}.metadata.json", metadata)):
+            expected.add(name)
+            if _write_if_changed(os.path.join(output_dir, name), content):
+                written += 1
+
+    removed = 0
+    for root, _, files in os.walk(output_dir):
+        for file in files:
+            name = os.path.relpath(os.path.join(root, file), output_dir).replace(os.sep, '/')
+            if '__' in file and file.endswith(('.md', '.md.metadata.json')) and name not in expected:
+                os.remove(os.path.join(root, file))
+                removed += 1
+    return written, removed
+
+
+def _write_if_changed(path, content):
+    data = content.encode('utf-8')
+    try:
+        with open(path, 'rb') as f:
+            if f.read() == data:
+                return False
+    except FileNotFoundError:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return True
+
+
+def prechunk_documents(documents_path, output_dir=None, max_tokens=DEFAULT_MAX_TOKENS,
+                       overlap_tokens=DEFAULT_OVERLAP_TOKENS):
+    """把文档目录预切分到 output_dir（默认 <文档目录>_chunks），返回 output_dir
+
+    Markdown 文档按小节切分，其他格式的文档原样复制，子目录中的文档在 output_dir 中保持相同的相对路径；
+    小节索引保存在 output_dir/.section_index.json。
+    """
+    documents_path = os.path.abspath(documents_path)
+    output_dir = os.path.abspath(output_dir or f"{documents_path.rstrip(os.sep)}_chunks")
+    if os.path.commonpath([documents_path, output_dir]) == documents_path:
+        raise ValueError(f"预切分输出目录不能位于文档目录内: {output_dir}")
+    os.makedirs(output_dir, exist_ok=True)
+    index = SectionIndex(os.path.join(output_dir, '.section_index.json'), max_tokens, overlap_tokens)
+    written, removed = export_chunks(index.update(documents_path), output_dir)
+
+    for root, dirs, files in os.walk(documents_path):
+        dirs.sort()
+        for name in sorted(files):
+            if name.endswith('.md') or name.startswith('.'):
+                continue
+            source = os.path.join(root, name)
+            target = os.path.join(output_dir, os.path.relpath(source, documents_path))
+            if not os.path.exists(target) or os.path.getmtime(target) < os.path.getmtime(source):
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                shutil.copy2(source, target)
+                written += 1
+    logger.info(f"预切分完成: {output_dir}，写入 {written} 个文件，删除 {removed} 个文件")
+    return output_dir
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Markdown 文档结构化切分')
+    parser.add_argument('documents', help='文档目录')
+    parser.add_argument('--output', help='预切分输出目录（默认 <文档目录>_chunks）')
+    parser.add_argument('--max-tokens', type=int, default=DEFAULT_MAX_TOKENS, help='每个片段的 token 上限')
+    parser.add_argument('--overlap-tokens', type=int, default=DEFAULT_OVERLAP_TOKENS, help='相邻片段重叠的 token 数')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    output_dir = prechunk_documents(args.documents, args.output, args.max_tokens, args.overlap_tokens)
+    print(f"✅ 预切分完成: {output_dir}")
+
+
+if __name__ == "__main__":
+    main()
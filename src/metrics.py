@@ -0,0 +1,283 @@
+"""
+查询分阶段计时与指标导出
+Trace 记录单次查询各阶段（客户端初始化、缓存查找、检索、快速路径、生成、首字、引用解析、渲染）的耗时，
+结束时汇入进程内的直方图；MetricsRegistry 可导出为 Prometheus 文本格式或 JSONL，
+也可通过 start_http_server() 供 Prometheus 抓取
+"""
+
+import os
+import json
+import time
+import bisect
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# 秒；覆盖本地检索的毫秒级到模型生成的数十秒
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 10.0, 30.0, 60.0)
+STAGE_METRIC = 'rag_stage_seconds'
+QUERY_METRIC = 'rag_query_seconds'
+QUERY_COUNTER = 'rag_queries_total'
+
+
+class Histogram:
+    """累积分桶直方图，分位数按桶内线性插值估算"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+
+    def quantile(self, q):
+        with self._lock:
+            counts, count = list(self.counts), self.count
+        if count == 0:
+            return None
+        rank = q * count
+        seen = 0
+        for index, bucket_count in enumerate(counts):
+            if bucket_count and seen + bucket_count >= rank:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                # 最后一个桶没有上界，返回最大的有限边界
+                if index == len(self.buckets):
+                    return self.buckets[-1]
+                return lower + (self.buckets[index] - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.buckets[-1]
+
+    def snapshot(self):
+        """一致的副本（count、sum 和各桶取自同一时刻），导出时不受并发 observe 影响"""
+        copy = Histogram(self.buckets)
+        with self._lock:
+            copy.counts, copy.count, copy.sum = list(self.counts), self.count, self.sum
+        return copy
+
+    def cumulative(self):
+        """[(上界, 累计次数)]，最后一项上界为 +Inf"""
+        with self._lock:
+            counts = list(self.counts)
+        total = 0
+        result = []
+        for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+            total += bucket_count
+            result.append((bound, total))
+        return result
+
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+
+def _format_labels(key, extra=()):
+    items = list(key) + list(extra)
+    if not items:
+        return ''
+    escaped = (k + '="' + v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+               for k, v in items)
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_bound(bound):
+    return '+Inf' if bound == float('inf') else repr(float(bound))
+
+
+class MetricsRegistry:
+    """进程内的直方图、计数器和仪表（当前值），按 (指标名, 标签) 区分序列"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._histograms = {}
+        self._counters = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name, **labels):
+        key = (name, _label_key(labels))
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(key, Histogram(self.buckets))
+        return histogram
+
+    def observe(self, name, value, **labels):
+        self.histogram(name, **labels).observe(value)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def counter(self, name, **labels):
+        return self._counters.get((name, _label_key(labels)))
+
+    def set_gauge(self, name, value, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._gauges[key] = value
+
+    def gauge(self, name, **labels):
+        return self._gauges.get((name, _label_key(labels)))
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+            self._gauges.clear()
+
+    def _snapshot(self):
+        """在锁内复制各序列，再逐个复制直方图，格式化在锁外进行"""
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+            gauges = sorted(self._gauges.items())
+        histograms = [(series, histogram.snapshot()) for series, histogram in histograms]
+        return histograms, counters, gauges
+
+    def summary(self, name=STAGE_METRIC, label='stage'):
+        """{标签值: {'count', 'mean', 'p50', 'p95', 'p99'}}，供界面和命令行显示"""
+        result = {}
+        histograms, _, _ = self._snapshot()
+        for (metric, key), histogram in histograms:
+            if metric != name or histogram.count == 0:
+                continue
+            value = dict(key).get(label, '')
+            result[value] = {
+                'count': histogram.count,
+                'mean': histogram.sum / histogram.count,
+                'p50': histogram.quantile(0.5),
+                'p95': histogram.quantile(0.95),
+                'p99': histogram.quantile(0.99),
+            }
+        return result
+
+    def to_prometheus(self):
+        """Prometheus 文本格式（0.0.4）"""
+        lines = []
+        histograms, counters, gauges = self._snapshot()
+        for name in sorted({metric for (metric, _), _ in histograms}):
+            lines.append(f"# TYPE {name} histogram")
+            for (metric, key), histogram in histograms:
+                if metric != name:
+                    continue
+                for bound, total in histogram.cumulative():
+                    lines.append(f"{name}_bucket{_format_labels(key, [('le', _format_bound(bound))])} {total}")
+                lines.append(f"{name}_sum{_format_labels(key)} {histogram.sum}")
+                lines.append(f"{name}_count{_format_labels(key)} {histogram.count}")
+        for kind, series in (('counter', counters), ('gauge', gauges)):
+            for name in sorted({metric for (metric, _), _ in series}):
+                lines.append(f"# TYPE {name} {kind}")
+                for (metric, key), value in series:
+                    if metric == name:
+                        lines.append(f"{name}{_format_labels(key)} {value}")
+        return '\n'.join(lines) + '\n'
+
+    def to_records(self):
+        """每个序列一条记录（含分位数估计），用于 JSONL 导出"""
+        timestamp = time.time()
+        records = []
+        histograms, counters, gauges = self._snapshot()
+        for (name, key), histogram in histograms:
+            records.append({
+                'ts': timestamp, 'metric': name, 'type': 'histogram', 'labels': dict(key),
+                'count': histogram.count, 'sum': histogram.sum,
+                'p50': histogram.quantile(0.5), 'p95': histogram.quantile(0.95), 'p99': histogram.quantile(0.99),
+                'buckets': [[_format_bound(bound), total] for bound, total in histogram.cumulative()],
+            })
+        for kind, series in (('counter', counters), ('gauge', gauges)):
+            for (name, key), value in series:
+                records.append({'ts': timestamp, 'metric': name, 'type': kind, 'labels': dict(key),
+                                'value': value})
+        return records
+
+    def export(self, path):
+        """按扩展名导出：.jsonl 追加一次快照，其他扩展名整体写入 Prometheus 文本"""
+        if path.endswith('.jsonl'):
+            with open(path, 'a', encoding='utf-8') as f:
+                for record in self.to_records():
+                    f.write(json.dumps(record, ensure_ascii=False) + '\n')
+            return
+        tmp_path = f"{path}.tmp.{os.getpid()}"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp_path, path)
+
+
+REGISTRY = MetricsRegistry()
+
+
+class Trace:
+    """单次查询的分阶段计时，finish() 时写入直方图
+
+    同一阶段多次计时会累加；阶段之间可以重叠（如首字时间包含在生成时间内）。
+    """
+
+    def __init__(self, registry=None, clock=time.perf_counter):
+        self.registry = registry if registry is not None else REGISTRY
+        self.clock = clock
+        self.started_at = clock()
+        self.spans = {}
+        self.finished = False
+
+    @contextmanager
+    def span(self, stage):
+        start = self.clock()
+        try:
+            yield
+        finally:
+            self.record(stage, self.clock() - start)
+
+    def record(self, stage, seconds):
+        if seconds is not None:
+            self.spans[stage] = self.spans.get(stage, 0.0) + seconds
+
+    def finish(self, path=None, status='ok'):
+        """记录各阶段和总耗时，返回 {阶段: 秒}；重复调用只记录一次"""
+        total = self.clock() - self.started_at
+        if not self.finished:
+            self.finished = True
+            for stage, seconds in self.spans.items():
+                self.registry.observe(STAGE_METRIC, seconds, stage=stage)
+            self.registry.observe(QUERY_METRIC, total, path=path)
+            self.registry.inc(QUERY_COUNTER, path=path, status=status)
+        return {**{stage: round(seconds, 4) for stage, seconds in self.spans.items()}, 'total': round(total, 4)}
+
+
+def observe_stage(stage, seconds, registry=None):
+    """记录不属于某个 Trace 的阶段耗时（如界面渲染、客户端初始化）"""
+    (registry if registry is not None else REGISTRY).observe(STAGE_METRIC, seconds, stage=stage)
+
+
+def start_http_server(port, host='0.0.0.0', registry=None):
+    """在后台线程提供 /metrics，返回服务器对象（调用 shutdown() 停止）"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    registry = registry if registry is not None else REGISTRY
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.to_prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug(format, *args)
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics-http").start()
+    logger.info("指标服务已启动: http://%s:%s/metrics", host, server.server_port)
+    return server
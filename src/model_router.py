@@ -0,0 +1,147 @@
+"""
+模型分级路由
+按问题复杂度和检索到的上下文规模选择模型档位（Micro / Lite / Pro），查表式的简单问题交给更便宜、更快的模型；
+回答置信度低（拒答、空回答、没有引用）时升级到更高档位重新生成。每次模型调用的耗时和估算费用
+按档位写入 metrics（rag_model_seconds / rag_model_cost_usd_total）并输出一条结构化日志
+"""
+
+import re
+import logging
+
+from metrics import REGISTRY
+from retrieval import reference_name
+from logging_setup import debug_enabled
+
+logger = logging.getLogger(__name__)
+
+MODEL_SECONDS = 'rag_model_seconds'
+MODEL_COST = 'rag_model_cost_usd_total'
+MODEL_CALLS = 'rag_model_calls_total'
+
+# 需要推理、比较或综合多处内容的提问方式
+COMPLEX_MARKERS = ('为什么', '为何', '比较', '区别', '差异', '对比', '分析', '评估', '建议', '如果', '影响', '原因',
+                   '之间', '优缺点', '总结', '哪个更', 'なぜ', '比較', '違い', '分析', '場合', '理由', 'まとめ',
+                   'why', 'compare', 'difference', 'explain')
+# 多个子问题
+CLAUSE_RE = re.compile(r'[？?；;]|以及|并且|同时|および|また')
+# 模型没能根据资料作答时的常见说法（含 Bedrock 知识库的默认拒答）
+REFUSAL_MARKERS = ('抱歉', '无法回答', '无法找到', '没有找到', '未找到', '没有相关', '申し訳', '見つかりません',
+                   'わかりません', '分かりません', 'Sorry', 'unable to assist', 'could not find', "don't know")
+CJK_RE = re.compile(r'[\u3040-\u30ff\u3400-\u9fff\uf900-\ufaff]')
+WORD_RE = re.compile(r'[\s\W_]+')
+
+
+class ModelTier:
+    """一个模型档位；价格为每 1000 token 的美元单价"""
+
+    def __init__(self, name, model_arn, input_price, output_price):
+        self.name = name
+        self.model_arn = model_arn
+        self.input_price = input_price
+        self.output_price = output_price
+
+    def cost(self, input_tokens, output_tokens):
+        return (input_tokens * self.input_price + output_tokens * self.output_price) / 1000.0
+
+    def __repr__(self):
+        return f"ModelTier({self.name!r})"
+
+
+# 从低到高排列；us-east-1 按需价格
+NOVA_TIERS = (
+    ModelTier('micro', "arn:aws:bedrock:us-east-1::foundation-model/amazon.nova-micro-v1:0", 0.000035, 0.00014),
+    ModelTier('lite', "arn:aws:bedrock:us-east-1::foundation-model/amazon.nova-lite-v1:0", 0.00006, 0.00024),
+    ModelTier('pro', "arn:aws:bedrock:us-east-1::foundation-model/amazon.nova-pro-v1:0", 0.0008, 0.0032),
+)
+
+
+def estimate_tokens(text):
+    """粗略估算 token 数：中日文每字约 1 个，其他文字约 4 个字符 1 个"""
+    if not text:
+        return 0
+    cjk = len(CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def context_text(references):
+    return '\n'.join(ref['content']['text'] for ref in references or [])
+
+
+def complexity_score(question, references=None):
+    """0 ~ 1：问题长度、推理类措辞、子问题数量和检索上下文规模的加权和"""
+    lowered = question.lower()
+    length = len(WORD_RE.sub('', question))
+    markers = sum(1 for marker in COMPLEX_MARKERS if marker in lowered)
+    # 句末的问号不算额外的子问题
+    clauses = len(CLAUSE_RE.findall(question.rstrip('？?')))
+    score = 0.35 * min(1.0, length / 60.0) + 0.3 * min(1.0, markers / 2.0) + 0.15 * min(1.0, clauses / 2.0)
+    if references:
+        # 上下文越长、来源越分散，越需要更强的模型综合
+        sources = {reference_name(ref) for ref in references}
+        size = min(1.0, len(context_text(references)) / 6000.0)
+        spread = min(1.0, (len(sources) - 1) / 3.0)
+        score += 0.2 * (size + spread) / 2
+    return min(1.0, score)
+
+
+def low_confidence(answer, cited=True):
+    """空回答、拒答或没有任何引用"""
+    if not answer or not answer.strip() or not cited:
+        return True
+    return any(marker in answer for marker in REFUSAL_MARKERS)
+
+
+class ModelRouter:
+    """按复杂度选择档位，低置信度回答逐级升级
+
+    thresholds 为各档位之间的分界（比档位数少一个）：分数低于第 i 个分界时选第 i 档，否则选最高档。
+    record() 记录一次模型调用的耗时和估算费用（Bedrock 检索生成接口不返回 token 用量，按字符数估算）。
+    """
+
+    def __init__(self, tiers=NOVA_TIERS, thresholds=(0.25, 0.5), registry=None):
+        if len(thresholds) != len(tiers) - 1:
+            raise ValueError(f"{len(tiers)} 个档位需要 {len(tiers) - 1} 个分界，收到 {len(thresholds)} 个")
+        self.tiers = tuple(tiers)
+        self.thresholds = tuple(thresholds)
+        self.registry = registry if registry is not None else REGISTRY
+
+    def choose(self, question, references=None):
+        score = complexity_score(question, references)
+        for tier, threshold in zip(self.tiers, self.thresholds):
+            if score < threshold:
+                break
+        else:
+            tier = self.tiers[-1]
+        if debug_enabled():
+            logger.debug("选择模型档位", extra={'fields': {'tier': tier.name, 'complexity': round(score, 3)}})
+        return tier
+
+    def escalate(self, tier):
+        """高一级的档位，已是最高档时返回 None"""
+        index = self.tiers.index(tier)
+        return self.tiers[index + 1] if index + 1 < len(self.tiers) else None
+
+    def record(self, tier, seconds, prompt, answer, fields=None, escalated=False):
+        """记录一次调用，返回估算费用（美元）"""
+        input_tokens, output_tokens = estimate_tokens(prompt), estimate_tokens(answer)
+        cost = tier.cost(input_tokens, output_tokens)
+        self.registry.observe(MODEL_SECONDS, seconds, tier=tier.name)
+        self.registry.inc(MODEL_CALLS, tier=tier.name, escalated='true' if escalated else 'false')
+        self.registry.inc(MODEL_COST, cost, tier=tier.name)
+        logger.info("模型调用", extra={'fields': {
+            **(fields or {}), 'tier': tier.name, 'seconds': round(seconds, 4), 'input_tokens': input_tokens,
+            'output_tokens': output_tokens, 'cost_usd': round(cost, 6), 'escalated': escalated}})
+        return cost
+
+    def stats(self):
+        """{档位: {'calls', 'p50', 'p95', 'cost_usd'}}"""
+        summary = self.registry.summary(MODEL_SECONDS, label='tier')
+        return {
+            tier.name: {
+                'calls': summary[tier.name]['count'],
+                'p50': summary[tier.name]['p50'],
+                'p95': summary[tier.name]['p95'],
+                'cost_usd': self.registry.counter(MODEL_COST, tier=tier.name) or 0.0,
+            }
+            for tier in self.tiers if tier.name in summary
+        }
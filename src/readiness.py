@@ -0,0 +1,136 @@
+"""
+知识库就绪等待
+轮询知识库、数据源和摄取任务状态（指数退避 + 抖动 + 截止时间），替代固定的 sleep
+"""
+
+import time
+import random
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class PhaseTimer:
+    """记录部署各阶段耗时"""
+
+    def __init__(self, clock=time.monotonic):
+        self._clock = clock
+        self.timings = []  # [(阶段名称, 秒)]
+
+    @contextmanager
+    def phase(self, name):
+        start = self._clock()
+        try:
+            yield
+        finally:
+            elapsed = self._clock() - start
+            self.timings.append((name, elapsed))
+            logger.info(f"阶段完成: {name}, 耗时 {elapsed:.2f} 秒")
+
+    @property
+    def total(self):
+        return sum(elapsed for _, elapsed in self.timings)
+
+    def summary(self):
+        parts = [f"{name} {elapsed:.2f}s" for name, elapsed in self.timings]
+        return f"总耗时 {self.total:.2f} 秒 (" + ", ".join(parts) + ")"
+
+
+def wait_until(check, description, timeout=900.0, initial_delay=1.0, max_delay=30.0,
+               backoff=2.0, jitter=0.2, sleep=time.sleep, clock=time.monotonic):
+    """反复调用 check() 直到返回真值，返回该值
+
+    两次轮询之间的间隔从 initial_delay 开始按 backoff 倍数增长，上限 max_delay，
+    并加入 ±jitter 比例的随机抖动；超过 timeout 秒仍未就绪则抛出 TimeoutError。
+    check() 可以直接抛出异常表示进入失败状态。
+    """
+    deadline = clock() + timeout
+    delay = initial_delay
+    attempts = 0
+    while True:
+        attempts += 1
+        result = check()
+        if result:
+            logger.info(f"{description} 已就绪 (轮询 {attempts} 次)")
+            return result
+
+        remaining = deadline - clock()
+        if remaining <= 0:
+            raise TimeoutError(f"等待 {description} 超时 ({timeout:.0f} 秒)")
+        wait = delay * random.uniform(1 - jitter, 1 + jitter)
+        sleep(min(wait, remaining))
+        delay = min(delay * backoff, max_delay)
+
+
+class KnowledgeBaseWaiter:
+    """通过 bedrock-agent 控制面轮询知识库就绪状态"""
+
+    KB_READY = {'ACTIVE'}
+    KB_FAILED = {'FAILED', 'DELETE_UNSUCCESSFUL', 'DELETING'}
+    DS_READY = {'AVAILABLE'}
+    DS_FAILED = {'DELETE_UNSUCCESSFUL', 'DELETING'}
+    JOB_READY = {'COMPLETE'}
+    JOB_FAILED = {'FAILED', 'STOPPED', 'STOPPING'}
+
+    def __init__(self, agent_client, kb_id, ds_id, **poll_options):
+        self.agent_client = agent_client
+        self.kb_id = kb_id
+        self.ds_id = ds_id
+        self.poll_options = poll_options
+
+    def wait_for_knowledge_base(self):
+        """等待知识库和数据源进入可用状态"""
+        def kb_ready():
+            kb = self.agent_client.get_knowledge_base(knowledgeBaseId=self.kb_id)['knowledgeBase']
+            status = kb['status']
+            if status in self.KB_FAILED:
+                raise RuntimeError(f"知识库状态异常: {status} {kb.get('failureReasons', '')}")
+            return status in self.KB_READY
+
+        def ds_ready():
+            ds = self.agent_client.get_data_source(
+                knowledgeBaseId=self.kb_id, dataSourceId=self.ds_id
+            )['dataSource']
+            status = ds['status']
+            if status in self.DS_FAILED:
+                raise RuntimeError(f"数据源状态异常: {status} {ds.get('failureReasons', '')}")
+            return status in self.DS_READY
+
+        wait_until(kb_ready, f"知识库 {self.kb_id}", **self.poll_options)
+        wait_until(ds_ready, f"数据源 {self.ds_id}", **self.poll_options)
+
+    def latest_ingestion_job_id(self):
+        response = self.agent_client.list_ingestion_jobs(
+            knowledgeBaseId=self.kb_id,
+            dataSourceId=self.ds_id,
+            sortBy={'attribute': 'STARTED_AT', 'order': 'DESCENDING'},
+            maxResults=1
+        )
+        jobs = response.get('ingestionJobSummaries', [])
+        return jobs[0]['ingestionJobId'] if jobs else None
+
+    def wait_for_ingestion(self, job_id=None):
+        """等待摄取任务完成（默认取最近一次任务），返回任务详情"""
+        job_id = job_id or self.latest_ingestion_job_id()
+        if not job_id:
+            raise RuntimeError(f"数据源 {self.ds_id} 没有摄取任务")
+
+        def job_complete():
+            job = self.agent_client.get_ingestion_job(
+                knowledgeBaseId=self.kb_id, dataSourceId=self.ds_id, ingestionJobId=job_id
+            )['ingestionJob']
+            status = job['status']
+            if status in self.JOB_FAILED:
+                raise RuntimeError(f"摄取任务 {job_id} 失败: {status} {job.get('failureReasons', '')}")
+            return job if status in self.JOB_READY else None
+
+        job = wait_until(job_complete, f"摄取任务 {job_id}", **self.poll_options)
+        stats = job.get('statistics', {})
+        if stats:
+            logger.info(f"摄取统计: 扫描 {stats.get('numberOfDocumentsScanned', 0)}, "
+                        f"新增 {stats.get('numberOfNewDocumentsIndexed', 0)}, "
+                        f"更新 {stats.get('numberOfModifiedDocumentsIndexed', 0)}, "
+                        f"删除 {stats.get('numberOfDocumentsDeleted', 0)}, "
+                        f"失败 {stats.get('numberOfDocumentsFailed', 0)}")
+        return job
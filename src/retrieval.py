@@ -0,0 +1,152 @@
+"""
+检索后端
+统一的 retrieve(question, top_k) 接口，结果格式与 Bedrock retrieve API 的 retrievalResults 相同；
+本地检索支持纯向量（LocalRetriever）和向量 + BM25 混合（HybridRetriever）两种方式，
+检索结果通过 retrieve_and_generate 的 EXTERNAL_SOURCES 模式交给模型生成回答
+"""
+
+import time
+import logging
+
+from local_index import HashingEmbedder, build_index
+from index_store import load_or_build
+from bm25 import BM25Index, reciprocal_rank_fusion
+from throttling import guarded_call
+from logging_setup import debug_enabled
+
+logger = logging.getLogger(__name__)
+
+
+def reference_name(ref):
+    """引用的文件名（S3 / 自定义数据源 / 网页）"""
+    location = ref.get('location', {})
+    uri = (location.get('s3Location', {}).get('uri')
+           or location.get('customDocumentLocation', {}).get('id')
+           or location.get('webLocation', {}).get('url', ''))
+    return uri.split('/')[-1] if uri else ''
+
+
+def external_sources_configuration(model_arn, results, identifier="retrieved-context"):
+    """把检索结果拼成一个文档，构造 EXTERNAL_SOURCES 配置（该模式只接受一个来源）"""
+    sections = []
+    for ref in results:
+        heading = ref.get('metadata', {}).get('heading', '')
+        title = f"{reference_name(ref)} {heading}".strip()
+        sections.append(f"[{title}]\n{ref['content']['text']}")
+    return {
+        'type': 'EXTERNAL_SOURCES',
+        'externalSourcesConfiguration': {
+            'modelArn': model_arn,
+            'sources': [{
+                'sourceType': 'BYTE_CONTENT',
+                'byteContent': {
+                    'identifier': identifier,
+                    'contentType': 'text/plain',
+                    'data': '\n\n'.join(sections).encode('utf-8')
+                }
+            }]
+        }
+    }
+
+
+class KnowledgeBaseRetriever:
+    """Bedrock Knowledge Base 远程检索（guard 为可选的 throttling.RequestGuard）"""
+
+    def __init__(self, client, kb_id, top_k=5, guard=None):
+        self.client = client
+        self.kb_id = kb_id
+        self.top_k = top_k
+        self.guard = guard
+
+    def retrieve(self, question, top_k=None):
+        response = guarded_call(
+            self.guard, self.client.retrieve,
+            knowledgeBaseId=self.kb_id,
+            retrievalQuery={'text': question},
+            retrievalConfiguration={
+                'vectorSearchConfiguration': {'numberOfResults': top_k or self.top_k}
+            }
+        )
+        return response.get('retrievalResults', [])
+
+
+class LocalRetriever:
+    """本地向量索引检索，不访问网络"""
+
+    def __init__(self, index, top_k=5, min_score=0.0):
+        self.index = index
+        self.top_k = top_k
+        self.min_score = min_score
+
+    @staticmethod
+    def to_result(chunk, score):
+        return {
+            'content': {'text': chunk['text']},
+            'location': {'type': 'CUSTOM', 'customDocumentLocation': {'id': chunk['source']}},
+            'metadata': {'heading': chunk.get('heading', '')},
+            'score': score,
+        }
+
+    def retrieve(self, question, top_k=None):
+        return self.retrieve_batch([question], top_k)[0]
+
+    def retrieve_batch(self, questions, top_k=None):
+        start = time.perf_counter()
+        hits = self.index.search_batch(questions, top_k or self.top_k)
+        if debug_enabled():
+            logger.debug("本地检索完成", extra={'fields': {
+                'questions': len(questions), 'retrieval_ms': round((time.perf_counter() - start) * 1000, 2)}})
+        return [[self.to_result(chunk, score) for chunk, score in row if score >= self.min_score]
+                for row in hits]
+
+
+class HybridRetriever:
+    """向量检索 + BM25，RRF 融合后返回与 LocalRetriever 相同格式的结果"""
+
+    def __init__(self, index, bm25=None, top_k=5, candidates=20, rrf_k=60, weights=(1.0, 1.0)):
+        self.index = index
+        self.bm25 = bm25 or BM25Index.from_chunks(index.chunks)
+        self.top_k = top_k
+        self.candidates = candidates
+        self.rrf_k = rrf_k
+        self.weights = list(weights)
+
+    def retrieve(self, question, top_k=None):
+        return self.retrieve_batch([question], top_k)[0]
+
+    def retrieve_batch(self, questions, top_k=None):
+        top_k = top_k or self.top_k
+        start = time.perf_counter()
+        vector_hits = self.index.search_vectors(self.index.embedder.embed(list(questions)), self.candidates)
+        results = []
+        for question, vector_row in zip(questions, vector_hits):
+            keyword_row = self.bm25.search(question, self.candidates)
+            fused = reciprocal_rank_fusion([[i for i, _ in vector_row], [i for i, _ in keyword_row]],
+                                           k=self.rrf_k, weights=self.weights)
+            vector_scores, keyword_scores = dict(vector_row), dict(keyword_row)
+            row = []
+            for doc_id, score in fused[:top_k]:
+                result = LocalRetriever.to_result(self.index.chunks[doc_id], score)
+                result['metadata']['vector_score'] = vector_scores.get(doc_id)
+                result['metadata']['bm25_score'] = keyword_scores.get(doc_id)
+                row.append(result)
+            results.append(row)
+        if debug_enabled():
+            logger.debug("混合检索完成", extra={'fields': {
+                'questions': len(questions), 'retrieval_ms': round((time.perf_counter() - start) * 1000, 2)}})
+        return results
+
+
+def build_local_retriever(documents_path, embedder=None, top_k=5, index_path=None, hybrid=False):
+    """从文档目录构建本地检索器
+
+    指定 index_path 时使用持久化的内存映射索引（文档未变化时直接打开，不重新向量化）；
+    hybrid=True 时返回向量 + BM25 的混合检索器。
+    """
+    if index_path is None:
+        index = build_index(documents_path, embedder)
+    else:
+        index = load_or_build(documents_path, index_path, embedder or HashingEmbedder())
+    if hybrid:
+        return HybridRetriever(index, top_k=top_k)
+    return LocalRetriever(index, top_k=top_k)
@@ -0,0 +1,149 @@
+"""
+检索结果缓存
+按规范化问题和知识库摄取版本缓存 retrieve 的结果，与回答缓存分开：换一种问法或带着追问上下文时
+回答需要重新生成，但检索到的片段往往与几秒前相同，命中时省去一次检索往返，
+检索结果经 EXTERNAL_SOURCES 模式交给模型生成（见 kb_query.KnowledgeBaseQuery）。
+片段只保留生成和引用需要的字段，压缩后存放，按条目数和字节数做 LRU 淘汰
+"""
+
+import json
+import time
+import zlib
+import logging
+import threading
+from collections import OrderedDict
+
+from answer_cache import normalize_question, IngestionVersion, VersionWatcher
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+CACHE_COUNTER = 'rag_retrieval_cache_total'
+
+
+def pack_references(references):
+    """检索结果 → 压缩字节；只保留正文、位置、分数和标题"""
+    rows = [[ref['content']['text'], ref.get('location', {}), ref.get('score'),
+             ref.get('metadata', {}).get('heading', '')] for ref in references]
+    return zlib.compress(json.dumps(rows, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+
+
+def unpack_references(data):
+    """pack_references 的逆操作，每次返回新的字典，调用方可以修改"""
+    references = []
+    for text, location, score, heading in json.loads(zlib.decompress(data).decode('utf-8')):
+        ref = {'content': {'text': text}, 'location': location}
+        if score is not None:
+            ref['score'] = score
+        if heading:
+            ref['metadata'] = {'heading': heading}
+        references.append(ref)
+    return references
+
+
+class RetrievalCache:
+    """检索结果的 LRU 缓存
+
+    max_entries / max_bytes 同时限制条目数和压缩后的总字节数；ttl 秒后过期；
+    version_provider 为可选的知识库版本函数（如 IngestionVersion），版本变化时清空缓存。
+    """
+
+    def __init__(self, max_entries=2000, max_bytes=32 * 1024 * 1024, ttl=600.0, version_provider=None,
+                 version_check_interval=60.0, registry=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.registry = registry if registry is not None else REGISTRY
+        self._versions = VersionWatcher(version_provider, version_check_interval) if version_provider else None
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _check_version(self):
+        if self._versions is None:
+            return
+        version, previous = self._versions.check()
+        if previous is not None and previous != version:
+            logger.info("知识库版本变化 (%s -> %s)，清空检索缓存", previous, version)
+            self.clear()
+
+    @staticmethod
+    def _key(question, top_k):
+        return normalize_question(question), top_k
+
+    def get(self, question, top_k=None):
+        """命中时返回检索结果列表，否则返回 None"""
+        self._check_version()
+        key = self._key(question, top_k)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] > self.ttl:
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        self.registry.inc(CACHE_COUNTER, result='miss' if entry is None else 'hit')
+        return unpack_references(entry[1]) if entry is not None else None
+
+    def put(self, question, references, top_k=None):
+        data = pack_references(references)
+        if len(data) > self.max_bytes:
+            return
+        key = self._key(question, top_k)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic(), data)
+            self._bytes += len(data)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        _, data = self._entries.pop(key)
+        self._bytes -= len(data)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+            }
+
+
+class CachingRetriever:
+    """为任意检索后端（KnowledgeBaseRetriever、LocalRetriever 等）加上 RetrievalCache，接口不变"""
+
+    def __init__(self, retriever, cache):
+        self.retriever = retriever
+        self.cache = cache
+
+    def retrieve(self, question, top_k=None):
+        references = self.cache.get(question, top_k)
+        if references is None:
+            references = self.retriever.retrieve(question, top_k)
+            # 没有检索到内容时不缓存，下次仍走知识库检索
+            if references:
+                self.cache.put(question, references, top_k)
+        return references
+
+
+def build_retrieval_cache(kb_id, agent_client=None, **options):
+    """按知识库创建检索缓存，摄取版本变化时清空"""
+    if agent_client is None:
+        from aws_clients import get_client
+        agent_client = get_client('bedrock-agent')
+    return RetrievalCache(version_provider=IngestionVersion(agent_client, kb_id), **options)
@@ -0,0 +1,124 @@
+"""
+会话管理
+把用户对话映射到稳定的 Bedrock sessionId，使追问可以复用服务端保存的对话上下文；
+空闲超时自动淘汰，并限制同时保留的会话数
+"""
+
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Bedrock Agent 默认的 idleSessionTTLInSeconds，超过后服务端会丢弃对话上下文
+DEFAULT_IDLE_TIMEOUT = 600
+
+
+def new_session_id():
+    """一次性会话ID（不需要保留上下文的单次查询）"""
+    return f"session-{uuid.uuid4().hex}"
+
+
+class SessionManager:
+    """对话ID -> sessionId 映射（线程安全）
+
+    idle_timeout 秒内没有使用的会话在下次访问时被淘汰；超过 max_sessions 时淘汰最久未使用的会话。
+    invoke_agent 可以使用客户端生成的 sessionId（session_id）；retrieve_and_generate
+    的 sessionId 由服务端分配，先用 lookup 查询，收到响应后再 bind。
+    """
+
+    def __init__(self, idle_timeout=DEFAULT_IDLE_TIMEOUT, max_sessions=1000, clock=time.monotonic):
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self._clock = clock
+        self._sessions = OrderedDict()  # conversation_id -> (session_id, last_used)
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+        self.expired = 0
+        self.evicted = 0
+
+    @staticmethod
+    def new_conversation():
+        """生成新的对话ID"""
+        return uuid.uuid4().hex
+
+    def _get(self, conversation_id, now):
+        entry = self._sessions.get(conversation_id)
+        if entry is None:
+            return None
+        if now - entry[1] > self.idle_timeout:
+            del self._sessions[conversation_id]
+            self.expired += 1
+            return None
+        return entry[0]
+
+    def _put(self, conversation_id, session_id, now):
+        self._sessions[conversation_id] = (session_id, now)
+        self._sessions.move_to_end(conversation_id)
+        while len(self._sessions) > self.max_sessions:
+            evicted, _ = self._sessions.popitem(last=False)
+            self.evicted += 1
+            logger.info("会话数达到上限 %d，淘汰对话 %s", self.max_sessions, evicted)
+
+    def session_id(self, conversation_id):
+        """返回对话的 sessionId，不存在或已过期时新建"""
+        now = self._clock()
+        with self._lock:
+            session_id = self._get(conversation_id, now)
+            if session_id is None:
+                session_id = new_session_id()
+                self.created += 1
+            else:
+                self.reused += 1
+            self._put(conversation_id, session_id, now)
+            return session_id
+
+    def lookup(self, conversation_id):
+        """返回对话已有的 sessionId（未过期），没有时返回 None"""
+        now = self._clock()
+        with self._lock:
+            session_id = self._get(conversation_id, now)
+            if session_id is not None:
+                self.reused += 1
+                self._put(conversation_id, session_id, now)
+            return session_id
+
+    def bind(self, conversation_id, session_id):
+        """记录服务端分配的 sessionId"""
+        now = self._clock()
+        with self._lock:
+            if conversation_id not in self._sessions:
+                self.created += 1
+            self._put(conversation_id, session_id, now)
+
+    def reset(self, conversation_id):
+        """结束对话，下次查询使用新的会话"""
+        with self._lock:
+            self._sessions.pop(conversation_id, None)
+
+    def evict_idle(self):
+        """主动清理所有空闲超时的会话，返回清理数量"""
+        now = self._clock()
+        with self._lock:
+            stale = [cid for cid, (_, last_used) in self._sessions.items()
+                     if now - last_used > self.idle_timeout]
+            for cid in stale:
+                del self._sessions[cid]
+            self.expired += len(stale)
+            return len(stale)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+    def stats(self):
+        return {
+            'active': len(self),
+            'created': self.created,
+            'reused': self.reused,
+            'expired': self.expired,
+            'evicted': self.evicted,
+        }
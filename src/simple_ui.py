@@ -1,15 +1,28 @@
 #!/usr/bin/env python3
 """
 企业文档检索 RAG 系统 - 简化界面
-直接使用 Knowledge Base API
+直接使用 Knowledge Base API；开启快速查找时，查表式问题直接引用检索到的文档条目作答
 """
 
 import streamlit as st
-import boto3
 import time
 import logging
 from datetime import datetime
 
+from session_manager import SessionManager
+from aws_clients import get_client
+from retrieval import KnowledgeBaseRetriever
+from retrieval_cache import CachingRetriever, build_retrieval_cache
+from fast_path import FastPathAnswerer
+from metrics import REGISTRY, Trace, observe_stage
+from single_flight import SingleFlight
+from answer_cache import normalize_question
+from throttling import CircuitOpenError, get_guard
+from kb_query import is_unavailable, has_references
+from model_router import ModelRouter, low_confidence
+
+logger = logging.getLogger(__name__)
+
 # 配置页面
 st.set_page_config(
     page_title="企业文档检索系统",
@@ -74,40 +87,179 @@ def initialize_session():
     if 'chat_history' not in st.session_state:
         st.session_state.chat_history = []
     
-    if 'bedrock_client' not in st.session_state:
-        st.session_state.bedrock_client = boto3.client('bedrock-agent-runtime')
+    if 'conversation_id' not in st.session_state:
+        st.session_state.conversation_id = SessionManager.new_conversation()
+    
+    if 'fast_path_hits' not in st.session_state:
+        st.session_state.fast_path_hits = 0
 
-def query_knowledge_base(question):
-    """查询知识库"""
+@st.cache_resource
+def get_bedrock_client():
+    """进程内共享的 Bedrock 客户端及连接池，新浏览器会话不再重新建立连接"""
+    return get_client('bedrock-agent-runtime')
+
+@st.cache_resource
+def get_session_manager():
+    """进程内所有用户共享的会话管理器（统一限制会话总数）"""
+    return SessionManager()
+
+@st.cache_resource
+def get_single_flight():
+    """进程内共享的请求合并：多个用户同时问相同问题时只调用一次模型"""
+    return SingleFlight()
+
+@st.cache_resource
+def get_model_router():
+    return ModelRouter()
+
+@st.cache_resource
+def get_fast_path():
+    return FastPathAnswerer()
+
+@st.cache_resource
+def get_retriever():
+    """进程内共享的知识库检索，检索结果缓存到知识库重新同步为止"""
+    retriever = KnowledgeBaseRetriever(get_bedrock_client(), KNOWLEDGE_BASE_ID, guard=get_guard('retrieve'))
+    return CachingRetriever(retriever, build_retrieval_cache(KNOWLEDGE_BASE_ID))
+
+def _fast_path_answer(question, trace):
+    """快速路径：先只调用 retrieve，结构化条目足以作答时直接返回，否则返回 None"""
     try:
-        response = st.session_state.bedrock_client.retrieve_and_generate(
-            input={'text': question},
-            retrieveAndGenerateConfiguration={
-                'type': 'KNOWLEDGE_BASE',
-                'knowledgeBaseConfiguration': {
-                    'knowledgeBaseId': KNOWLEDGE_BASE_ID,
-                    'modelArn': MODEL_ARN
-                }
+        with trace.span('retrieval'):
+            references = get_retriever().retrieve(question)
+    except Exception as e:
+        logger.warning("快速路径检索失败，改用生成: %s", e)
+        return None
+    with trace.span('fast_path'):
+        return get_fast_path().answer(question, references)
+
+def _retrieve_and_generate(question, session_id=None, model_arn=MODEL_ARN):
+    request = {
+        'input': {'text': question},
+        'retrieveAndGenerateConfiguration': {
+            'type': 'KNOWLEDGE_BASE',
+            'knowledgeBaseConfiguration': {
+                'knowledgeBaseId': KNOWLEDGE_BASE_ID,
+                'modelArn': model_arn
             }
-        )
+        }
+    }
+    if session_id:
+        request['sessionId'] = session_id
+    # 限速和熔断在进程内所有会话间共享
+    return get_guard('retrieve_and_generate').call(get_bedrock_client().retrieve_and_generate, **request)
+
+def _generate(question, session_id, tier):
+    """调用模型，返回 (响应, 最终档位)；指定档位时记录调用，回答置信度低则用更高档位重新生成
+
+    升级的调用不使用原会话（否则服务端的对话记忆中会有两次相同的问题和低档位的拒答），
+    而是开启新会话，由调用方在采用回答后绑定到对话。升级后的调用失败则保留较低档位的回答。
+    """
+    if tier is None:
+        return _retrieve_and_generate(question, session_id), None
+    router = get_model_router()
+    previous = None
+    while True:
+        call_start = time.perf_counter()
+        try:
+            response = _retrieve_and_generate(question, session_id, tier.model_arn)
+        except Exception as e:
+            if previous is None:
+                raise
+            logger.warning("升级到 %s 失败，保留较低档位的回答: %s", tier.name, e)
+            return previous
+        router.record(tier, time.perf_counter() - call_start, question, response['output']['text'])
+        higher = router.escalate(tier)
+        if higher is None or not low_confidence(response['output']['text'], has_references(response)):
+            return response, tier
+        logger.info("回答置信度低，升级模型档位: %s -> %s", tier.name, higher.name)
+        previous = (response, tier)
+        session_id = None
+        tier = higher
+
+
+def query_knowledge_base(question):
+    """查询知识库（同一对话复用 sessionId，追问时服务端会结合之前的上下文检索）
+
+    返回 (回答, 引用, 路径, 模型档位)，路径为 'fast'（未调用模型）或 'generate'，
+    未开启按复杂度选择模型时档位为 None
+    """
+    trace = Trace()
+    if st.session_state.get('fast_path_enabled'):
+        fast = _fast_path_answer(question, trace)
+        if fast is not None:
+            trace.finish(path='fast')
+            return fast['answer'], fast['citations'], 'fast', None
+    
+    tier = get_model_router().choose(question) if st.session_state.get('model_routing_enabled') else None
+    
+    sessions = get_session_manager()
+    conversation_id = st.session_state.conversation_id
+    try:
+        session_id = sessions.lookup(conversation_id)
+        shared = False
+        if session_id is None:
+            # 对话的第一个问题不依赖上下文，与其他用户正在进行的相同问题合并为一次调用；
+            # 跟随者不绑定领头请求的服务端会话，之后的追问开启自己的会话
+            key = (tier.name if tier is not None else None, normalize_question(question))
+            with trace.span('generation'):
+                (response, tier), shared = get_single_flight().do(key, lambda: _generate(question, None, tier))
+        else:
+            try:
+                with trace.span('generation'):
+                    response, tier = _generate(question, session_id, tier)
+            except Exception as e:
+                if is_unavailable(e):
+                    raise
+                # 服务端会话可能已过期，开启新会话重试一次
+                sessions.reset(conversation_id)
+                with trace.span('generation'):
+                    response, tier = _generate(question, None, tier)
+        if response.get('sessionId') and not shared:
+            sessions.bind(conversation_id, response['sessionId'])
         
         answer = response['output']['text']
         citations = []
         
         # 提取引用来源
-        for citation in response.get('citations', []):
-            for ref in citation.get('retrievedReferences', []):
-                source = ref.get('location', {}).get('s3Location', {}).get('uri', '')
-                if source:
-                    # 提取文件名
-                    filename = source.split('/')[-1]
-                    citations.append(filename)
+        with trace.span('citations'):
+            for citation in response.get('citations', []):
+                for ref in citation.get('retrievedReferences', []):
+                    source = ref.get('location', {}).get('s3Location', {}).get('uri', '')
+                    if source:
+                        # 提取文件名
+                        filename = source.split('/')[-1]
+                        citations.append(filename)
         
-        return answer, citations
+        trace.finish(path='generate')
+        return answer, citations, 'generate', tier
         
     except Exception as e:
-        st.error(f"查询失败: {str(e)}")
-        return None, []
+        trace.finish(path='generate', status='error')
+        if isinstance(e, CircuitOpenError):
+            st.warning(f"⏳ 服务繁忙，请 {e.retry_after:.0f} 秒后重试")
+        else:
+            st.error(f"查询失败: {str(e)}")
+        return None, [], None, None
+
+def show_stage_timings():
+    """进程内所有会话的分阶段耗时（P50 / P95），可下载 Prometheus 格式"""
+    summary = REGISTRY.summary()
+    if not summary:
+        return
+    with st.expander("⏱️ 阶段耗时"):
+        st.dataframe([
+            {'阶段': stage, '次数': row['count'], 'P50 (秒)': round(row['p50'], 3), 'P95 (秒)': round(row['p95'], 3)}
+            for stage, row in summary.items()
+        ], hide_index=True, use_container_width=True)
+        models = get_model_router().stats()
+        if models:
+            st.dataframe([
+                {'模型档位': name, '调用次数': row['calls'], 'P50 (秒)': round(row['p50'], 3),
+                 '估算费用 (USD)': round(row['cost_usd'], 4)}
+                for name, row in models.items()
+            ], hide_index=True, use_container_width=True)
+        st.download_button("下载指标 (Prometheus)", REGISTRY.to_prometheus(), file_name="metrics.prom")
 
 def main():
     # 初始化
@@ -150,11 +302,18 @@ def main():
         # 系统管理
         st.subheader("⚙️ 系统管理")
         
+        st.toggle("⚡ 快速查找", value=False, key="fast_path_enabled",
+                  help="标准、额度、权限等查表式问题直接引用文档条目作答，不调用模型")
+        st.toggle("🎚️ 按复杂度选择模型", value=False, key="model_routing_enabled",
+                  help="简单问题使用 Nova Micro / Lite，复杂问题或回答置信度低时使用 Nova Pro")
+        
         if st.button("🔄 刷新页面", use_container_width=True):
             st.rerun()
             
         if st.button("🗑️ 清空对话", use_container_width=True):
             st.session_state.chat_history = []
+            get_session_manager().reset(st.session_state.conversation_id)
+            st.session_state.conversation_id = SessionManager.new_conversation()
             st.rerun()
             
         # 文档类型说明
@@ -215,10 +374,11 @@ def main():
                 
                 # 查询知识库
                 start_time = time.time()
-                answer, citations = query_knowledge_base(query)
+                answer, citations, path, tier = query_knowledge_base(query)
                 end_time = time.time()
                 
                 if answer:
+                    render_start = time.perf_counter()
                     # 显示结果
                     st.markdown(f'<div class="chat-message assistant-message"><strong>🤖 助手：</strong> {answer}</div>', unsafe_allow_html=True)
                     
@@ -227,11 +387,18 @@ def main():
                         citations_text = "📚 **信息来源**: " + ", ".join(set(citations))
                         st.markdown(f'<div class="citation">{citations_text}</div>', unsafe_allow_html=True)
                     
+                    observe_stage('render', time.perf_counter() - render_start)
                     # 添加到历史记录
                     st.session_state.chat_history.append((query, answer, citations))
                     
                     # 显示查询时间
-                    st.caption(f"⏱️ 查询耗时: {end_time - start_time:.2f} 秒")
+                    if path == 'fast':
+                        st.session_state.fast_path_hits += 1
+                        st.caption(f"⚡ 快速路径（未调用模型） · ⏱️ 查询耗时: {end_time - start_time:.2f} 秒")
+                    elif tier is not None:
+                        st.caption(f"⚙️ 模型档位: {tier.name} · ⏱️ 查询耗时: {end_time - start_time:.2f} 秒")
+                    else:
+                        st.caption(f"⏱️ 查询耗时: {end_time - start_time:.2f} 秒")
     
     with col2:
         # 实时统计
@@ -243,8 +410,13 @@ def main():
             
             st.metric("总查询次数", total_queries)
             st.metric("平均回答长度", f"{avg_response_length:.0f} 字符")
+            st.metric("快速路径作答", st.session_state.fast_path_hits)
+            flights = get_single_flight().stats()
+            if flights['saved_calls']:
+                st.metric("合并的重复请求", flights['saved_calls'], help=f"合并比例 {flights['coalescing_ratio']:.0%}")
         else:
             st.write("暂无查询记录")
+        show_stage_timings()
             
         st.divider()
         
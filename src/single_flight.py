@@ -0,0 +1,170 @@
+"""
+相同问题的请求合并（single-flight）
+同一进程内，相同（规范化后）的问题已有请求在执行时，后到的请求不再调用模型，
+而是等待领头请求的结果；流式请求由后台线程消费一次上游流，所有订阅者各自从头重放。
+只合并正在执行的请求，完成后即移除，不替代问答缓存
+"""
+
+import copy
+import logging
+import threading
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+COALESCE_COUNTER = 'rag_singleflight_total'
+
+
+class _Call:
+    """一次进行中的同步调用"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+        self.followers = 0
+
+
+class Broadcast:
+    """一路文本流的多订阅者广播：publish() 追加片段，subscribe() 从第一段开始重放并等待后续片段"""
+
+    def __init__(self):
+        self._chunks = []
+        self._cond = threading.Condition()
+        self._done = False
+        self.result = None
+        self.error = None
+        self.followers = 0
+
+    def publish(self, chunk):
+        with self._cond:
+            self._chunks.append(chunk)
+            self._cond.notify_all()
+
+    def finish(self, result=None, error=None):
+        with self._cond:
+            self.result, self.error = result, error
+            self._done = True
+            self._cond.notify_all()
+
+    def subscribe(self):
+        index = 0
+        while True:
+            with self._cond:
+                while index >= len(self._chunks) and not self._done:
+                    self._cond.wait()
+                pending = self._chunks[index:]
+                finished = self._done
+            for chunk in pending:
+                yield chunk
+            index += len(pending)
+            if finished and index >= len(self._chunks):
+                break
+        if self.error is not None:
+            raise self.error
+
+
+class SingleFlight:
+    """按键合并进行中的请求，领头请求的结果（深拷贝）分发给所有跟随者
+
+    do() 用于同步调用，stream() 用于流式调用；合并次数记录到 metrics 的
+    rag_singleflight_total{kind, role} 计数器，stats() 返回合并比例和节省的模型调用次数。
+    """
+
+    def __init__(self, registry=None):
+        self.registry = registry if registry is not None else REGISTRY
+        self._calls = {}
+        self._streams = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.followers = 0
+
+    def _count(self, kind, leader):
+        with self._lock:
+            if leader:
+                self.leaders += 1
+            else:
+                self.followers += 1
+        self.registry.inc(COALESCE_COUNTER, kind=kind, role='leader' if leader else 'follower')
+
+    def do(self, key, fn):
+        """执行 fn() 或等待相同键的进行中调用，返回 (结果, 是否来自其他请求)"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.followers += 1
+        self._count('query', leader)
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            # 调用方可能修改结果（如写入 response_time），每个跟随者拿到独立的副本
+            return copy.deepcopy(call.value), True
+
+        try:
+            call.value = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+            if call.followers:
+                logger.info("合并相同问题的请求: %d 个", call.followers, extra={'fields': {'followers': call.followers}})
+        return copy.deepcopy(call.value) if call.followers else call.value, False
+
+    def stream(self, key, start):
+        """订阅相同键的进行中流，没有时调用 start() 开始新的流，返回 (Broadcast, 是否为领头请求)
+
+        start() 返回 (文本片段迭代器, 结束后获取完整结果的函数)，在后台线程中消费，
+        领头请求的调用方中途停止读取也不影响跟随者。
+        """
+        with self._lock:
+            broadcast = self._streams.get(key)
+            leader = broadcast is None
+            if leader:
+                broadcast = self._streams[key] = Broadcast()
+            else:
+                broadcast.followers += 1
+        self._count('stream', leader)
+        if leader:
+            threading.Thread(target=self._pump, args=(key, broadcast, start), daemon=True,
+                             name="single-flight-stream").start()
+        return broadcast, leader
+
+    def _pump(self, key, broadcast, start):
+        result, error = None, None
+        try:
+            chunks, get_result = start()
+            for chunk in chunks:
+                broadcast.publish(chunk)
+            result = get_result()
+        except Exception as e:
+            error = e
+        finally:
+            with self._lock:
+                self._streams.pop(key, None)
+            broadcast.finish(result, error)
+            if broadcast.followers:
+                logger.info("合并相同问题的流式请求: %d 个", broadcast.followers,
+                            extra={'fields': {'followers': broadcast.followers}})
+
+    def stats(self):
+        """{'leaders', 'followers', 'in_flight', 'coalescing_ratio', 'saved_calls'}"""
+        with self._lock:
+            leaders, followers = self.leaders, self.followers
+            in_flight = len(self._calls) + len(self._streams)
+        total = leaders + followers
+        return {
+            'leaders': leaders,
+            'followers': followers,
+            'in_flight': in_flight,
+            'coalescing_ratio': followers / total if total else 0.0,
+            'saved_calls': followers,
+        }
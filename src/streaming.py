@@ -0,0 +1,61 @@
+"""
+流式输出工具
+增量 UTF-8 解码 invoke_agent 的 completion 事件流，并记录首段耗时等指标
+"""
+
+import time
+import codecs
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def iter_completion_text(completion):
+    """逐段产出 invoke_agent completion 中的文本
+
+    使用增量解码器，被拆分到两个 chunk 中的中文 / 日文字符会在收到
+    剩余字节后再输出，不会出现乱码或 UnicodeDecodeError。
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    for event in completion:
+        chunk = event.get('chunk')
+        if chunk and 'bytes' in chunk:
+            text = decoder.decode(chunk['bytes'])
+            if text:
+                yield text
+    tail = decoder.decode(b'', final=True)
+    if tail:
+        yield tail
+
+
+class StreamMetrics:
+    """流式响应指标：首段耗时、总耗时、段数、字符数"""
+
+    def __init__(self, clock=time.perf_counter):
+        self._clock = clock
+        self.started_at = clock()
+        self.first_chunk_at = None
+        self.finished_at = None
+        self.chunks = 0
+        self.chars = 0
+
+    def track(self, chunks):
+        """包装文本迭代器，在产出每一段时更新指标"""
+        for text in chunks:
+            if self.first_chunk_at is None:
+                self.first_chunk_at = self._clock()
+            self.chunks += 1
+            self.chars += len(text)
+            yield text
+        self.finished_at = self._clock()
+
+    @property
+    def time_to_first_chunk(self):
+        if self.first_chunk_at is None:
+            return None
+        return self.first_chunk_at - self.started_at
+
+    @property
+    def total_time(self):
+        end = self.finished_at if self.finished_at is not None else self._clock()
+        return end - self.started_at
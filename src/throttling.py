@@ -0,0 +1,301 @@
+"""
+Bedrock 调用的自适应限速与熔断
+AdaptiveRateLimiter 是 AIMD 令牌桶：收到限流前不限速，第一次被限流时以当前发送速率的一半起步，
+之后每次成功缓慢加速、每次限流减半；CircuitBreaker 在连续失败后断开，断开期间直接失败
+（调用方可降级），超时后放行一个探测请求。RequestGuard 把两者和限流重试组合在一起，
+get_guard() 返回进程内按 API 共享的实例（各 API 的配额独立，如生成被限流时检索仍可用），
+状态写入 metrics 的仪表和计数器
+"""
+
+import time
+import random
+import logging
+import threading
+from collections import deque
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# Bedrock 限流时返回的错误码
+THROTTLING_ERRORS = ('ThrottlingException', 'TooManyRequestsException', 'ServiceQuotaExceededException')
+# 服务端暂时不可用，计入熔断（参数错误、权限不足等客户端错误不计入）
+SERVER_ERRORS = ('ServiceUnavailableException', 'InternalServerException', 'ModelNotReadyException',
+                 'ModelTimeoutException', 'DependencyFailedException', 'BadGatewayException',
+                 'ReadTimeoutError', 'ConnectTimeoutError', 'EndpointConnectionError')
+
+CLOSED, HALF_OPEN, OPEN = 'closed', 'half_open', 'open'
+BREAKER_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+def error_code(error):
+    """botocore ClientError 的错误码，其他异常取类名"""
+    response = getattr(error, 'response', None)
+    if isinstance(response, dict):
+        code = response.get('Error', {}).get('Code')
+        if code:
+            return code
+    return type(error).__name__
+
+
+def is_throttling_error(error):
+    """异常或错误消息（{'error': str(e)}）是否表示被限流"""
+    if isinstance(error, str):
+        return any(code in error for code in THROTTLING_ERRORS)
+    return error_code(error) in THROTTLING_ERRORS
+
+
+def is_server_error(error):
+    return error_code(error) in SERVER_ERRORS
+
+
+class RateLimitTimeout(Exception):
+    """等待令牌超过了调用方允许的时间"""
+
+
+class CircuitOpenError(Exception):
+    """熔断器断开，retry_after 秒后才会放行探测请求"""
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"{name} 调用暂停（连续失败后熔断），{retry_after:.0f} 秒后重试")
+        self.retry_after = retry_after
+
+
+class AdaptiveRateLimiter:
+    """AIMD 令牌桶
+
+    未被限流时不限速（rate 为 None）；on_throttle() 把速率设为 min(当前速率, 最近 1 秒实际发送速率) × decrease，
+    同一 cooldown 内的多次限流只减一次（并发请求往往同时被拒）；on_success() 每次加 increase / rate，
+    即满负荷时每秒约增加 increase 次/秒；未指定初始速率时，达到 max_rate 后恢复不限速。
+    """
+
+    def __init__(self, rate=None, min_rate=0.5, max_rate=50.0, increase=1.0, decrease=0.5, cooldown=1.0,
+                 clock=time.monotonic, sleep=time.sleep):
+        # 指定初始速率时（如批量查询的 --qps）max_rate 是上限，不会恢复为不限速
+        self.unbounded = rate is None
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.clock = clock
+        self.sleep = sleep
+        self.rate = rate
+        self._tokens = 1.0
+        self._updated = clock()
+        self._sent = deque()
+        self._last_decrease = None
+        self._lock = threading.Lock()
+        self.throttles = 0
+
+    def _refill(self, now):
+        if self.rate is not None:
+            self._tokens = min(max(1.0, self.rate), self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _prune(self, now):
+        while self._sent and now - self._sent[0] > 1.0:
+            self._sent.popleft()
+
+    def acquire(self, timeout=None):
+        """取得一个令牌；需要等待超过 timeout 秒时抛出 RateLimitTimeout"""
+        deadline = None if timeout is None else self.clock() + timeout
+        while True:
+            with self._lock:
+                now = self.clock()
+                self._refill(now)
+                if self.rate is None or self._tokens >= 1:
+                    if self.rate is not None:
+                        self._tokens -= 1
+                    self._sent.append(now)
+                    self._prune(now)
+                    return
+                wait_time = (1 - self._tokens) / self.rate
+            if deadline is not None and now + wait_time > deadline:
+                raise RateLimitTimeout(f"等待限速令牌超过 {timeout} 秒（当前 {self.rate:.2f} 次/秒）")
+            self.sleep(wait_time)
+
+    def on_success(self):
+        with self._lock:
+            if self.rate is None:
+                return
+            self.rate = min(self.max_rate, self.rate + self.increase / self.rate)
+            if self.rate >= self.max_rate and self.unbounded:
+                logger.info("限速器恢复为不限速")
+                self.rate = None
+
+    def on_throttle(self):
+        with self._lock:
+            self.throttles += 1
+            now = self.clock()
+            if self._last_decrease is not None and now - self._last_decrease < self.cooldown:
+                return
+            self._last_decrease = now
+            self._refill(now)
+            self._prune(now)
+            sent_rate = float(len(self._sent)) or self.min_rate
+            current = sent_rate if self.rate is None else min(self.rate, sent_rate)
+            self.rate = max(self.min_rate, current * self.decrease)
+            self._tokens = min(self._tokens, 1.0)
+            logger.warning("收到限流，速率降为 %.2f 次/秒", self.rate)
+
+    def state(self):
+        with self._lock:
+            return {'rate': self.rate, 'tokens': self._tokens, 'throttles': self.throttles}
+
+
+class CircuitBreaker:
+    """连续 failure_threshold 次失败后断开 reset_timeout 秒，之后半开放行一个探测请求"""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._probe_started = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """是否放行；断开时返回 False"""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                if self.clock() - self.opened_at < self.reset_timeout:
+                    return False
+                self.state = HALF_OPEN
+                self._probe_started = None
+            # 半开：只放行一个探测请求（探测请求没有结果地中断时，超时后再放行一个）
+            now = self.clock()
+            if self._probe_started is not None and now - self._probe_started < self.reset_timeout:
+                return False
+            self._probe_started = now
+            return True
+
+    def retry_after(self):
+        """距离下一次放行的秒数；半开且探测请求未结束时为探测超时的剩余时间"""
+        with self._lock:
+            now = self.clock()
+            if self.state == OPEN:
+                return max(0.0, self.reset_timeout - (now - self.opened_at))
+            if self.state == HALF_OPEN and self._probe_started is not None:
+                return max(0.0, self.reset_timeout - (now - self._probe_started))
+            return 0.0
+
+    def record_success(self):
+        with self._lock:
+            if self.state != CLOSED:
+                logger.info("熔断器恢复")
+            self.state = CLOSED
+            self.failures = 0
+            self._probe_started = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    logger.warning("连续失败 %d 次，熔断 %.0f 秒", self.failures, self.reset_timeout)
+                self.state = OPEN
+                self.opened_at = self.clock()
+                self._probe_started = None
+
+
+class RequestGuard:
+    """限速 + 熔断 + 限流重试
+
+    call() 在取得令牌后调用，被限流时降速并退避重试，服务端暂时错误同样退避重试，重试用尽后计入熔断；
+    熔断断开时立即抛出 CircuitOpenError，不访问服务。客户端的 botocore 重试应关闭
+    （见 aws_clients.SERVICE_CONFIG），否则限流信号被 botocore 的重试吞掉。
+    """
+
+    def __init__(self, name, limiter=None, breaker=None, max_attempts=4, backoff_base=0.25, backoff_max=5.0,
+                 acquire_timeout=30.0, registry=None, sleep=time.sleep):
+        self.name = name
+        self.limiter = limiter or AdaptiveRateLimiter()
+        self.breaker = breaker or CircuitBreaker()
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.acquire_timeout = acquire_timeout
+        self.registry = registry if registry is not None else REGISTRY
+        self.sleep = sleep
+
+    def _publish(self):
+        rate = self.limiter.rate
+        self.registry.set_gauge('rag_limiter_rate', rate if rate is not None else 0.0, api=self.name)
+        self.registry.set_gauge('rag_breaker_state', BREAKER_STATE_VALUES[self.breaker.state], api=self.name)
+
+    def check(self):
+        """熔断断开时抛出 CircuitOpenError"""
+        if not self.breaker.allow():
+            self.registry.inc('rag_breaker_rejected_total', api=self.name)
+            raise CircuitOpenError(self.name, self.breaker.retry_after())
+
+    def call(self, fn, *args, **kwargs):
+        self.check()
+        try:
+            for attempt in range(1, self.max_attempts + 1):
+                try:
+                    self.limiter.acquire(self.acquire_timeout)
+                except RateLimitTimeout:
+                    self.breaker.record_failure()
+                    raise
+                try:
+                    result = fn(*args, **kwargs)
+                except Exception as e:
+                    throttled = is_throttling_error(e)
+                    if throttled or is_server_error(e):
+                        if throttled:
+                            self.record_throttle()
+                        if attempt < self.max_attempts:
+                            delay = min(self.backoff_max, self.backoff_base * (2 ** (attempt - 1)))
+                            self.sleep(random.uniform(delay / 2, delay))
+                            continue
+                        self.breaker.record_failure()
+                    else:
+                        # 客户端错误说明服务可达，结束半开探测
+                        self.breaker.record_success()
+                    raise
+                self.limiter.on_success()
+                self.breaker.record_success()
+                return result
+        finally:
+            self._publish()
+
+    def record_throttle(self):
+        """调用之外（如流式响应中途）观察到的限流"""
+        self.limiter.on_throttle()
+        self.registry.inc('rag_throttled_total', api=self.name)
+        self._publish()
+
+    def state(self):
+        limiter = self.limiter.state()
+        return {
+            'rate': limiter['rate'],
+            'throttles': limiter['throttles'],
+            'breaker': self.breaker.state,
+            'retry_after': self.breaker.retry_after(),
+        }
+
+
+def guarded_call(guard, fn, *args, **kwargs):
+    """有 guard 时经由 guard.call() 调用，否则直接调用"""
+    if guard is None:
+        return fn(*args, **kwargs)
+    return guard.call(fn, *args, **kwargs)
+
+
+_lock = threading.Lock()
+_guards = {}
+
+
+def get_guard(api):
+    """进程内按 API（如 'retrieve_and_generate'）共享的 RequestGuard，所有会话共用同一速率和熔断状态"""
+    with _lock:
+        guard = _guards.get(api)
+        if guard is None:
+            guard = _guards[api] = RequestGuard(api)
+        return guard
@@ -0,0 +1,207 @@
+"""
+企业文档并发上传引擎
+基于有界线程池 + S3 分段上传，供 EnterpriseRAG 各版本共用
+"""
+
+import os
+import time
+import random
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from boto3.exceptions import S3UploadFailedError
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+
+# 支持上传的文档类型
+# .metadata.json 为 Bedrock 知识库的文档元数据文件（预切分时生成）
+DOCUMENT_EXTENSIONS = ('.md', '.txt', '.pdf', '.docx', '.metadata.json')
+
+MB = 1024 * 1024
+
+# 重试无意义的S3错误码（权限、存储桶不存在等）
+NON_RETRYABLE_ERRORS = {
+    'AccessDenied',
+    'AllAccessDisabled',
+    'InvalidAccessKeyId',
+    'InvalidBucketName',
+    'NoSuchBucket',
+    'SignatureDoesNotMatch',
+}
+
+
+def default_transfer_config():
+    """分段上传配置：小文档走单次PUT，大文件按16MB分段并发上传"""
+    return TransferConfig(
+        multipart_threshold=16 * MB,
+        multipart_chunksize=16 * MB,
+        max_concurrency=4,
+        use_threads=True
+    )
+
+
+def collect_documents(documents_path, prefix):
+    """遍历文档目录，返回 (本地路径, S3 Key) 列表
+
+    子目录中的文件按文件名上传到同一前缀下，不同子目录中的同名文件会互相覆盖，因此直接报错。
+    """
+    items = []
+    seen = {}
+    for root, dirs, files in os.walk(documents_path):
+        dirs.sort()
+        for file in sorted(files):
+            if file.endswith(DOCUMENT_EXTENSIONS):
+                file_path = os.path.join(root, file)
+                s3_key = f"{prefix}{file}"
+                if s3_key in seen:
+                    raise ValueError(f"文件名冲突，两个文件对应同一个 S3 Key {s3_key}: {seen[s3_key]}, {file_path}")
+                seen[s3_key] = file_path
+                items.append((file_path, s3_key))
+    return items
+
+
+class UploadReport:
+    """上传结果统计"""
+
+    def __init__(self, total_files=0, total_bytes=0):
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.uploaded_files = 0
+        self.uploaded_bytes = 0
+        self.retries = 0
+        self.failed = {}  # s3_key -> 错误信息
+        self.etags = {}  # s3_key -> ETag（仅在 fetch_etags=True 时记录）
+        self.started_at = time.monotonic()
+        self.finished_at = None
+
+    @property
+    def elapsed(self):
+        end = self.finished_at if self.finished_at is not None else time.monotonic()
+        return max(end - self.started_at, 1e-9)
+
+    @property
+    def files_per_second(self):
+        return self.uploaded_files / self.elapsed
+
+    @property
+    def bytes_per_second(self):
+        return self.uploaded_bytes / self.elapsed
+
+    def summary(self):
+        return (
+            f"上传 {self.uploaded_files}/{self.total_files} 个文件, "
+            f"{self.uploaded_bytes / MB:.2f} MB, 耗时 {self.elapsed:.2f} 秒, "
+            f"{self.files_per_second:.1f} 文件/秒, {self.bytes_per_second / MB:.2f} MB/秒, "
+            f"重试 {self.retries} 次, 失败 {len(self.failed)} 个"
+        )
+
+
+class ParallelUploader:
+    """并发上传器
+
+    s3_client 只需实现 upload_file(Filename, Bucket, Key, Config=...)，
+    因此可以直接使用 botocore Stubber 或进程内的假 S3 客户端进行测试；
+    fetch_etags=True 时还需要 head_object。
+    """
+
+    def __init__(self, s3_client, max_workers=8, transfer_config=None,
+                 max_attempts=4, backoff_base=0.5, backoff_max=8.0,
+                 progress_interval=5.0, progress_callback=None, fetch_etags=False,
+                 sleep=time.sleep):
+        self.s3_client = s3_client
+        self.max_workers = max_workers
+        self.transfer_config = transfer_config or default_transfer_config()
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.progress_interval = progress_interval
+        self.progress_callback = progress_callback
+        self.fetch_etags = fetch_etags
+        self._sleep = sleep
+        self._lock = threading.Lock()
+
+    def upload_directory(self, documents_path, bucket_name, prefix=""):
+        """上传目录下所有支持的文档"""
+        return self.upload_files(collect_documents(documents_path, prefix), bucket_name)
+
+    def upload_files(self, items, bucket_name):
+        """并发上传 (本地路径, S3 Key) 列表，返回 UploadReport"""
+        sizes = {file_path: os.path.getsize(file_path) for file_path, _ in items}
+        report = UploadReport(total_files=len(items), total_bytes=sum(sizes.values()))
+        logger.info("准备上传 %d 个文件 (%.2f MB), 并发数 %d",
+                    report.total_files, report.total_bytes / MB, self.max_workers)
+
+        last_progress = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.max_workers,
+                                thread_name_prefix="s3-upload") as executor:
+            futures = {
+                executor.submit(self._upload_one, file_path, bucket_name, s3_key, report): (file_path, s3_key)
+                for file_path, s3_key in items
+            }
+            for future in as_completed(futures):
+                file_path, s3_key = futures[future]
+                error = future.exception()
+                with self._lock:
+                    if error is None:
+                        report.uploaded_files += 1
+                        report.uploaded_bytes += sizes[file_path]
+                    else:
+                        report.failed[s3_key] = str(error)
+                        logger.error("上传失败: %s -> s3://%s/%s: %s", file_path, bucket_name, s3_key, error)
+
+                now = time.monotonic()
+                if now - last_progress >= self.progress_interval:
+                    last_progress = now
+                    self._report_progress(report)
+
+        report.finished_at = time.monotonic()
+        self._report_progress(report)
+        logger.info(report.summary())
+        return report
+
+    def _report_progress(self, report):
+        done = report.uploaded_files + len(report.failed)
+        percent = done / report.total_files * 100 if report.total_files else 100.0
+        logger.info("上传进度: %d/%d (%.1f%%), %.1f 文件/秒, %.2f MB/秒",
+                    done, report.total_files, percent,
+                    report.files_per_second, report.bytes_per_second / MB)
+        if self.progress_callback:
+            self.progress_callback(report)
+
+    def _upload_one(self, file_path, bucket_name, s3_key, report):
+        """上传单个文件，可重试错误按指数退避 + 抖动重试"""
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                self.s3_client.upload_file(file_path, bucket_name, s3_key,
+                                           Config=self.transfer_config)
+                logger.debug("上传文件: %s -> s3://%s/%s", file_path, bucket_name, s3_key)
+                if self.fetch_etags:
+                    etag = self.s3_client.head_object(Bucket=bucket_name, Key=s3_key)['ETag']
+                    with self._lock:
+                        report.etags[s3_key] = etag
+                return
+            except Exception as e:
+                if attempt >= self.max_attempts or not self._is_retryable(e):
+                    raise
+                delay = min(self.backoff_max, self.backoff_base * (2 ** (attempt - 1)))
+                delay = random.uniform(delay / 2, delay)
+                with self._lock:
+                    report.retries += 1
+                logger.warning("上传重试 (%d/%d): %s, %.2f 秒后重试, 错误: %s",
+                               attempt, self.max_attempts - 1, s3_key, delay, e)
+                self._sleep(delay)
+
+    @staticmethod
+    def _is_retryable(error):
+        if isinstance(error, (FileNotFoundError, PermissionError, IsADirectoryError)):
+            return False
+        # boto3 会把 ClientError 包装成 S3UploadFailedError，原始错误保存在 __context__ 中
+        if isinstance(error, S3UploadFailedError) and isinstance(error.__context__, ClientError):
+            error = error.__context__
+        if isinstance(error, ClientError):
+            code = error.response.get('Error', {}).get('Code', '')
+            return code not in NON_RETRYABLE_ERRORS
+        return True
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# 与 demo.py 等脚本相同，以模块名直接导入 src 下的共享模块
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
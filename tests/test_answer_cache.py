@@ -0,0 +1,64 @@
+import numpy as np
+
+from answer_cache import AnswerCache, SQLiteCacheBackend
+
+VECTORS = {
+    "年假有多少天": [1.0, 0.0, 0.0],
+    "年假一共有几天": [0.95, 0.31, 0.0],
+    "年假有几天": [0.99, 0.14, 0.0],
+}
+
+
+def embed(text):
+    return np.asarray(VECTORS.get(text, [0.0, 0.0, 1.0]), dtype=np.float32)
+
+
+def make_cache(backend=None):
+    version = {'value': 'v1'}
+    cache = AnswerCache(backend=backend, embedder=embed, similarity_threshold=0.9,
+                        version_provider=lambda: version['value'], version_check_interval=0)
+    return cache, version
+
+
+def result(answer):
+    return {'answer': answer, 'citations': [{'source': 'company_policy.md'}]}
+
+
+def test_semantic_lookup_skips_stale_best_match():
+    cache, version = make_cache()
+    cache.put("年假有多少天？", result("旧版本: 5 天"))
+    version['value'] = 'v2'
+    cache.put("年假一共有几天？", result("新版本: 10 天"))
+
+    # 旧版本条目的相似度更高，但应返回达到阈值的有效条目
+    hit = cache.get("年假有几天？")
+    assert hit is not None and hit['answer'] == "新版本: 10 天"
+    assert cache.semantic_hits == 1
+
+
+def test_semantic_lookup_respects_threshold():
+    cache, _ = make_cache()
+    cache.put("年假有多少天？", result("5 天"))
+    assert cache.get("如何设置VPN？") is None
+
+
+def test_mutating_a_hit_does_not_change_the_cache():
+    cache, _ = make_cache()
+    original = result("5 天")
+    cache.put("年假有多少天？", original)
+    original['citations'].append({'source': 'put 之后修改'})
+
+    hit = cache.get("年假有多少天？")
+    hit['citations'].append({'source': 'get 之后修改'})
+    hit['citations'][0]['source'] = 'changed'
+
+    again = cache.get("年假有多少天？")
+    assert again['citations'] == [{'source': 'company_policy.md'}]
+
+
+def test_sqlite_backend_semantic_lookup(tmp_path):
+    cache, version = make_cache(SQLiteCacheBackend(str(tmp_path / "answers.db")))
+    cache.put("年假有多少天？", result("旧版本"))
+    version['value'] = 'v2'
+    cache.put("年假一共有几天？", result("新版本"))
+    assert cache.get("年假有几天？")['answer'] == "新版本"
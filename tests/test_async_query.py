@@ -0,0 +1,122 @@
+import time
+import asyncio
+import threading
+
+import pytest
+
+from async_query import AsyncQueryEngine, run_sync
+from fake_aws import FakeBedrockAgentRuntime, LatencyModel
+from kb_query import KnowledgeBaseQuery
+
+MODEL_ARN = "arn:aws:bedrock:us-east-1::foundation-model/amazon.nova-pro-v1:0"
+
+
+@pytest.fixture
+def engine():
+    engine = AsyncQueryEngine(max_concurrency=4, timeout=5.0)
+    yield engine
+    engine.shutdown()
+
+
+class Concurrency:
+    """记录同时执行的调用数峰值"""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.active = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, value):
+        with self._lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        time.sleep(self.seconds)
+        with self._lock:
+            self.active -= 1
+        return value
+
+
+async def gather(engine, func, count, **kwargs):
+    return await asyncio.gather(*(engine.run(func, i, **kwargs) for i in range(count)))
+
+
+def test_run_returns_results_in_order(engine):
+    assert run_sync(gather(engine, lambda i: i * 2, 10)) == [i * 2 for i in range(10)]
+
+
+def test_concurrency_is_bounded(engine):
+    work = Concurrency(0.05)
+    run_sync(gather(engine, work, 12))
+    assert work.peak == 4
+
+
+def test_timeout(engine):
+    with pytest.raises(asyncio.TimeoutError):
+        run_sync(engine.run(time.sleep, 1.0, timeout=0.05))
+
+
+def test_default_timeout():
+    engine = AsyncQueryEngine(max_concurrency=1, timeout=0.05)
+    try:
+        with pytest.raises(asyncio.TimeoutError):
+            run_sync(engine.run(time.sleep, 1.0))
+    finally:
+        engine.shutdown()
+
+
+def test_cancellation_releases_slot(engine):
+    async def scenario():
+        slow = asyncio.ensure_future(engine.run(time.sleep, 0.2))
+        await asyncio.sleep(0.01)
+        slow.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await slow
+        return await asyncio.gather(*(engine.run(lambda i: i, i) for i in range(4)))
+
+    assert run_sync(scenario()) == [0, 1, 2, 3]
+
+
+def test_stream(engine):
+    async def collect():
+        return [item async for item in engine.stream(lambda: iter("abc"))]
+
+    assert run_sync(collect()) == ["a", "b", "c"]
+
+
+def test_stream_idle_timeout(engine):
+    def slow():
+        yield "a"
+        time.sleep(1.0)
+        yield "b"
+
+    async def collect(items):
+        async for item in engine.stream(slow, timeout=0.1):
+            items.append(item)
+
+    items = []
+    with pytest.raises(asyncio.TimeoutError):
+        run_sync(collect(items))
+    assert items == ["a"]
+
+
+def test_run_sync_inside_running_loop():
+    async def outer():
+        return run_sync(asyncio.sleep(0, result="ok"))
+
+    assert asyncio.run(outer()) == "ok"
+
+
+def test_concurrent_queries_against_stub_runtime(engine):
+    client = FakeBedrockAgentRuntime(latency=LatencyModel("constant", 0.1))
+    query = KnowledgeBaseQuery(client, "KB", MODEL_ARN)
+
+    async def ask():
+        return await asyncio.gather(*(engine.run(query.query, f"问题 {i}") for i in range(8)))
+
+    start = time.perf_counter()
+    results = run_sync(ask())
+    elapsed = time.perf_counter() - start
+    assert all('error' not in result for result in results) and client.calls == 8
+    # 8 个请求、并发 4：约两轮注入延迟，而不是串行的八轮
+    assert elapsed < 0.5
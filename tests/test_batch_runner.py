@@ -0,0 +1,49 @@
+import json
+
+from batch_runner import BatchRunner, load_checkpoint
+
+ANSWER = {'answer': "回答", 'citations': [], 'response_time': 0.0}
+DEGRADED = {'answer': "片段", 'citations': [], 'response_time': 0.0, 'path': 'degraded', 'degraded': True}
+
+
+def write_questions(path, questions):
+    path.write_text('\n'.join(json.dumps({'id': str(i), 'question': q}, ensure_ascii=False)
+                              for i, q in enumerate(questions)), encoding='utf-8')
+    return str(path)
+
+
+def read_records(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+
+def test_degraded_result_is_retried(tmp_path):
+    results = iter([DEGRADED, ANSWER])
+    runner = BatchRunner(lambda question: dict(next(results)), max_workers=1, backoff_base=0.001)
+    output = str(tmp_path / "out.jsonl")
+    summary = runner.run(write_questions(tmp_path / "in.jsonl", ["问题"]), output)
+    assert summary['succeeded'] == 1 and summary['retries'] == 1
+    assert read_records(output)[0]['attempts'] == 2
+
+
+def test_degraded_result_is_not_checkpointed(tmp_path):
+    runner = BatchRunner(lambda question: dict(DEGRADED), max_workers=1, max_attempts=2, backoff_base=0.001)
+    output = str(tmp_path / "out.jsonl")
+    summary = runner.run(write_questions(tmp_path / "in.jsonl", ["问题"]), output)
+    assert summary['failed'] == 1 and summary['succeeded'] == 0
+    assert load_checkpoint(output) == set()
+
+    # 续跑时重新查询降级的问题，已成功的问题跳过
+    rerun = BatchRunner(lambda question: dict(ANSWER), max_workers=1)
+    summary = rerun.run(write_questions(tmp_path / "in.jsonl", ["问题"]), output)
+    assert summary['succeeded'] == 1 and summary['skipped'] == 0
+    assert load_checkpoint(output) == {"0"}
+
+
+def test_zero_retry_after_falls_back_to_backoff(tmp_path, monkeypatch):
+    sleeps = []
+    monkeypatch.setattr('batch_runner.time.sleep', sleeps.append)
+    results = iter([{'error': "熔断", 'retry_after': 0.0}, ANSWER])
+    runner = BatchRunner(lambda question: dict(next(results)), max_workers=1, backoff_base=1.0)
+    runner.run(write_questions(tmp_path / "in.jsonl", ["问题"]), str(tmp_path / "out.jsonl"))
+    assert len(sleeps) == 1 and 0.5 <= sleeps[0] <= 1.0
@@ -0,0 +1,152 @@
+import os
+
+import pytest
+
+from document_sync import DocumentSync
+from fake_aws import FakeS3
+from upload_engine import ParallelUploader, collect_documents
+
+BUCKET = "test-bucket"
+PREFIX = "documents/"
+
+
+def write(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+
+
+def make_sync(s3, tmp_path):
+    uploader = ParallelUploader(s3, max_workers=2, fetch_etags=True, sleep=lambda _: None)
+    return DocumentSync(s3, uploader=uploader, manifest_path=str(tmp_path / "manifest.json"))
+
+
+def keys(s3):
+    return sorted(key for _, key in s3.objects)
+
+
+@pytest.fixture
+def documents(tmp_path):
+    path = tmp_path / "documents"
+    write(str(path / "a.md"), "# A\n")
+    write(str(path / "b.md"), "# B\n")
+    return str(path)
+
+
+def test_unchanged_files_are_skipped(tmp_path, documents):
+    s3 = FakeS3()
+    sync = make_sync(s3, tmp_path)
+    first = sync.sync(documents, BUCKET, PREFIX)
+    assert sorted(first.uploaded) == ["a.md", "b.md"]
+
+    second = sync.sync(documents, BUCKET, PREFIX)
+    assert second.uploaded == [] and sorted(second.skipped) == ["a.md", "b.md"]
+    assert not second.changed
+
+
+def test_touched_file_with_same_content_is_not_uploaded(tmp_path, documents):
+    s3 = FakeS3()
+    sync = make_sync(s3, tmp_path)
+    sync.sync(documents, BUCKET, PREFIX)
+    path = os.path.join(documents, "a.md")
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 10 ** 9))
+
+    result = sync.sync(documents, BUCKET, PREFIX)
+    assert result.uploaded == [] and "a.md" in result.skipped
+
+
+def test_changed_and_remotely_missing_files_are_uploaded(tmp_path, documents):
+    s3 = FakeS3()
+    sync = make_sync(s3, tmp_path)
+    sync.sync(documents, BUCKET, PREFIX)
+    write(os.path.join(documents, "a.md"), "# A\n更新\n")
+    del s3.objects[(BUCKET, PREFIX + "b.md")]
+
+    result = sync.sync(documents, BUCKET, PREFIX)
+    assert sorted(result.uploaded) == ["a.md", "b.md"]
+    assert s3.objects[(BUCKET, PREFIX + "a.md")][0] == "# A\n更新\n".encode('utf-8')
+
+
+def test_removed_file_is_deleted(tmp_path, documents):
+    s3 = FakeS3()
+    sync = make_sync(s3, tmp_path)
+    sync.sync(documents, BUCKET, PREFIX)
+    os.remove(os.path.join(documents, "b.md"))
+
+    result = sync.sync(documents, BUCKET, PREFIX)
+    assert result.deleted == ["b.md"]
+    assert keys(s3) == [PREFIX + "a.md"]
+
+
+class FailingDeleteS3(FakeS3):
+    """DeleteObjects 对指定 Key 返回错误"""
+
+    def __init__(self):
+        super().__init__()
+        self.fail_keys = set()
+
+    def delete_objects(self, Bucket, Delete):
+        failing = [obj for obj in Delete['Objects'] if obj['Key'] in self.fail_keys]
+        remaining = [obj for obj in Delete['Objects'] if obj['Key'] not in self.fail_keys]
+        response = super().delete_objects(Bucket, {'Objects': remaining})
+        response['Errors'] = [{'Key': obj['Key'], 'Code': 'AccessDenied', 'Message': 'Access Denied'}
+                              for obj in failing]
+        return response
+
+
+def test_failed_delete_is_retried_on_next_sync(tmp_path, documents):
+    s3 = FailingDeleteS3()
+    sync = make_sync(s3, tmp_path)
+    sync.sync(documents, BUCKET, PREFIX)
+    os.remove(os.path.join(documents, "b.md"))
+
+    s3.fail_keys.add(PREFIX + "b.md")
+    result = sync.sync(documents, BUCKET, PREFIX)
+    assert result.deleted == []
+    assert keys(s3) == [PREFIX + "a.md", PREFIX + "b.md"]
+
+    s3.fail_keys.clear()
+    result = sync.sync(documents, BUCKET, PREFIX)
+    assert result.deleted == ["b.md"]
+    assert keys(s3) == [PREFIX + "a.md"]
+
+
+def test_moving_file_between_subdirectories_keeps_object(tmp_path):
+    documents = str(tmp_path / "documents")
+    write(os.path.join(documents, "a", "x.md"), "# X\n")
+    s3 = FakeS3()
+    sync = make_sync(s3, tmp_path)
+    sync.sync(documents, BUCKET, PREFIX)
+    os.makedirs(os.path.join(documents, "b"))
+    os.replace(os.path.join(documents, "a", "x.md"), os.path.join(documents, "b", "x.md"))
+
+    result = sync.sync(documents, BUCKET, PREFIX)
+    assert result.deleted == [os.path.join("a", "x.md")]
+    assert keys(s3) == [PREFIX + "x.md"]
+    # 清单只保留新路径，再次同步时不再删除或上传
+    again = sync.sync(documents, BUCKET, PREFIX)
+    assert not again.changed and keys(s3) == [PREFIX + "x.md"]
+
+
+def test_full_sync_uploads_everything_and_still_deletes_stale(tmp_path, documents):
+    s3 = FakeS3()
+    sync = make_sync(s3, tmp_path)
+    sync.sync(documents, BUCKET, PREFIX)
+    os.remove(os.path.join(documents, "b.md"))
+
+    result = sync.sync(documents, BUCKET, PREFIX, full_sync=True)
+    assert result.uploaded == ["a.md"] and result.deleted == ["b.md"]
+    assert keys(s3) == [PREFIX + "a.md"]
+
+
+def test_basename_collision_fails(tmp_path):
+    documents = str(tmp_path / "documents")
+    write(os.path.join(documents, "a", "x.md"), "# A\n")
+    write(os.path.join(documents, "b", "x.md"), "# B\n")
+    with pytest.raises(ValueError, match="x.md"):
+        collect_documents(documents, PREFIX)
+
+    s3 = FakeS3()
+    with pytest.raises(ValueError):
+        make_sync(s3, tmp_path).sync(documents, BUCKET, PREFIX)
+    assert s3.objects == {}
@@ -0,0 +1,77 @@
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+import md_chunker
+from index_store import load_or_build
+from local_index import HashingEmbedder
+
+DOCUMENTS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'documents')
+
+
+class CountingEmbedder(HashingEmbedder):
+    def __init__(self):
+        super().__init__()
+        self.embedded = 0
+
+    def embed(self, texts):
+        self.embedded += len(texts)
+        return super().embed(texts)
+
+
+@pytest.fixture
+def documents(tmp_path):
+    path = str(tmp_path / "documents")
+    shutil.copytree(DOCUMENTS, path)
+    return path
+
+
+def test_unchanged_index_is_reused(tmp_path, documents):
+    index_path = str(tmp_path / "index.bin")
+    embedder = CountingEmbedder()
+    first = load_or_build(documents, index_path, embedder)
+    embedded = embedder.embedded
+    second = load_or_build(documents, index_path, embedder)
+    assert embedder.embedded == embedded and len(second) == len(first)
+    assert isinstance(second.vectors, np.memmap)
+
+
+def test_chunking_parameters_invalidate_index(tmp_path, documents):
+    index_path = str(tmp_path / "index.bin")
+    embedder = CountingEmbedder()
+    default = len(load_or_build(documents, index_path, embedder))
+    embedded = embedder.embedded
+    smaller = len(load_or_build(documents, index_path, embedder, max_tokens=100, overlap_tokens=20))
+    assert embedder.embedded > embedded and smaller > default
+    assert len(load_or_build(documents, index_path, embedder)) == default
+
+
+def test_chunker_version_invalidates_index(tmp_path, documents, monkeypatch):
+    index_path = str(tmp_path / "index.bin")
+    embedder = CountingEmbedder()
+    load_or_build(documents, index_path, embedder)
+    embedded = embedder.embedded
+    monkeypatch.setattr('index_store.CHUNKER_VERSION', md_chunker.CHUNKER_VERSION + 1)
+    load_or_build(documents, index_path, embedder)
+    assert embedder.embedded == 2 * embedded
+
+
+def test_embedding_model_invalidates_index(tmp_path, documents):
+    index_path = str(tmp_path / "index.bin")
+    load_or_build(documents, index_path, HashingEmbedder(512))
+    index = load_or_build(documents, index_path, HashingEmbedder(256))
+    assert index.vectors.shape[1] == 256
+
+
+def test_subdirectory_documents_are_indexed(tmp_path, documents):
+    index_path = str(tmp_path / "index.bin")
+    embedder = CountingEmbedder()
+    before = len(load_or_build(documents, index_path, embedder))
+    os.makedirs(os.path.join(documents, "hr"))
+    with open(os.path.join(documents, "hr", "leave.md"), 'w', encoding='utf-8') as f:
+        f.write("# 请假\n年假 10 天\n")
+    index = load_or_build(documents, index_path, embedder)
+    assert len(index) == before + 1
+    assert "hr/leave.md" in {chunk['source'] for chunk in index.chunks}
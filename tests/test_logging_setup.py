@@ -0,0 +1,48 @@
+import logging
+
+import pytest
+
+import logging_setup
+from logging_setup import debug_enabled, query_context, setup_logging, shutdown_logging
+
+
+@pytest.fixture
+def sampled_logging(tmp_path):
+    root = logging.getLogger()
+    level = root.level
+
+    def setup(rate):
+        setup_logging(log_file=str(tmp_path / "rag.log"), debug_sample_rate=rate, console=False)
+        return tmp_path / "rag.log"
+
+    yield setup
+    shutdown_logging()
+    root.setLevel(level)
+
+
+def test_debug_disabled_without_sampling(sampled_logging):
+    sampled_logging(0.0)
+    with query_context():
+        assert not debug_enabled()
+
+
+def test_debug_sampled_per_query(sampled_logging):
+    path = sampled_logging(1.0)
+    assert not debug_enabled()
+    with query_context(query_id="q1"):
+        assert debug_enabled()
+        if debug_enabled():
+            logging.getLogger("test").debug("调试 %s", "消息", extra={'fields': {'n': 1}})
+    shutdown_logging()
+    text = path.read_text(encoding='utf-8')
+    assert '"msg": "调试 消息"' in text and '"query_id": "q1"' in text and '"n": 1' in text
+
+
+def test_sampling_is_stable_per_query():
+    logging_setup._state['sample_rate'] = 0.5
+    try:
+        sampled = [logging_setup.is_sampled(f"q{i}") for i in range(200)]
+        assert sampled == [logging_setup.is_sampled(f"q{i}") for i in range(200)]
+        assert 0 < sum(sampled) < 200
+    finally:
+        logging_setup._state['sample_rate'] = 0.0
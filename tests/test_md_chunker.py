@@ -0,0 +1,123 @@
+import os
+import json
+
+import pytest
+
+from md_chunker import CHUNKER_VERSION, SectionIndex, chunk_lines, iter_sections, prechunk_documents
+
+DOCUMENT = """# 运维手册
+
+## 备份
+
+执行以下脚本：
+
+```bash
+# 每天凌晨备份
+pg_dump app > backup.sql
+```
+
+## 恢复
+
+~~~~
+# 不是标题
+```
+## 仍在代码块内
+~~~~
+
+恢复完成后检查日志。
+"""
+
+
+def sections(text):
+    return [section for section in iter_sections(text.splitlines(True), "ops.md") if section.has_content]
+
+
+def test_headings_split_sections():
+    headings = [section.heading_path for section in sections(DOCUMENT)]
+    assert headings == [["运维手册", "备份"], ["运维手册", "恢复"]]
+
+
+def test_hash_lines_inside_fences_are_not_headings():
+    backup, restore = sections(DOCUMENT)
+    assert "# 每天凌晨备份" in backup.lines
+    # 较短的 ``` 或其他字符不能结束 ~~~~ 代码块
+    assert "## 仍在代码块内" in restore.lines and "恢复完成后检查日志。" in restore.lines
+
+
+def test_unclosed_fence_runs_to_end_of_file():
+    text = "# A\n\n```\n# 代码\n\n# B\n"
+    assert [section.heading_path for section in sections(text)] == [["A"]]
+
+
+def test_inline_backticks_are_not_a_fence():
+    text = "# A\n\n```inline``` 示例\n\n# B\n\n正文\n"
+    assert [section.heading_path for section in sections(text)] == [["A"], ["B"]]
+
+
+def test_chunks_keep_section_heading():
+    chunks = list(chunk_lines(DOCUMENT.splitlines(True), "ops.md"))
+    assert all(chunk['text'].startswith("## ") for chunk in chunks)
+    assert any("pg_dump" in chunk['text'] and chunk['heading'].endswith("备份") for chunk in chunks)
+
+
+def test_section_index_reuses_unchanged_sections(tmp_path):
+    documents = tmp_path / "documents"
+    documents.mkdir()
+    path = documents / "ops.md"
+    path.write_text(DOCUMENT, encoding='utf-8')
+    index_path = str(tmp_path / "sections.json")
+
+    first = SectionIndex(index_path).update(str(documents))
+    path.write_text(DOCUMENT.replace("恢复完成后检查日志。", "恢复完成后检查日志和监控。"), encoding='utf-8')
+    index = SectionIndex(index_path)
+    second = index.update(str(documents))
+    assert index.reused_sections == 1 and index.chunked_sections == 1
+    assert len(second) == len(first)
+
+
+def test_section_index_discarded_when_chunker_changes(tmp_path):
+    documents = tmp_path / "documents"
+    documents.mkdir()
+    (documents / "ops.md").write_text(DOCUMENT, encoding='utf-8')
+    index_path = tmp_path / "sections.json"
+    SectionIndex(str(index_path)).update(str(documents))
+
+    data = json.loads(index_path.read_text(encoding='utf-8'))
+    assert data['chunker_version'] == CHUNKER_VERSION
+    data['chunker_version'] = CHUNKER_VERSION - 1
+    index_path.write_text(json.dumps(data), encoding='utf-8')
+    index = SectionIndex(str(index_path))
+    index.update(str(documents))
+    assert index.reused_sections == 0 and index.chunked_sections == 2
+
+
+def output_files(path):
+    return sorted(os.path.relpath(os.path.join(root, f), path).replace(os.sep, '/')
+                  for root, _, files in os.walk(path) for f in files if not f.startswith('.'))
+
+
+def test_prechunk_mirrors_subdirectories(tmp_path):
+    documents = tmp_path / "documents"
+    (documents / "hr").mkdir(parents=True)
+    (documents / "top.md").write_text("# 总则\n内容\n", encoding='utf-8')
+    (documents / "hr" / "leave.md").write_text("# 请假\n年假 10 天\n", encoding='utf-8')
+    (documents / "hr" / "form.pdf").write_bytes(b"%PDF")
+    output = tmp_path / "chunks"
+
+    prechunk_documents(str(documents), str(output))
+    files = output_files(str(output))
+    assert "hr/form.pdf" in files
+    assert any(name.startswith("hr/leave__") and name.endswith(".md") for name in files)
+    assert any(name.startswith("top__") for name in files)
+
+    # 删除子目录中的文档后，对应的片段文件也被删除
+    (documents / "hr" / "leave.md").unlink()
+    prechunk_documents(str(documents), str(output))
+    assert not any(name.startswith("hr/leave__") for name in output_files(str(output)))
+
+
+def test_prechunk_output_inside_documents_is_rejected(tmp_path):
+    documents = tmp_path / "documents"
+    documents.mkdir()
+    with pytest.raises(ValueError):
+        prechunk_documents(str(documents), str(documents / "chunks"))
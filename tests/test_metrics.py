@@ -0,0 +1,50 @@
+import sys
+import threading
+
+from metrics import MetricsRegistry
+
+
+def test_exports_are_consistent_while_observing():
+    registry = MetricsRegistry()
+    stop = threading.Event()
+
+    def observe(worker):
+        i = 0
+        while not stop.is_set():
+            registry.observe('rag_stage_seconds', 0.01 * (i % 50), stage=f"s{worker}")
+            registry.inc('rag_queries_total', path=f"p{i % 20}")
+            i += 1
+
+    threads = [threading.Thread(target=observe, args=(n,)) for n in range(4)]
+    # 频繁切换线程，让导出和 observe 交错
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    for thread in threads:
+        thread.start()
+    try:
+        for _ in range(200):
+            for record in registry.to_records():
+                if record['type'] == 'histogram':
+                    assert record['buckets'][-1][1] == record['count']
+            registry.to_prometheus()
+            registry.summary()
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+        sys.setswitchinterval(interval)
+
+
+def test_prometheus_text():
+    registry = MetricsRegistry(buckets=(0.1, 1.0))
+    registry.observe('rag_stage_seconds', 0.05, stage='retrieval')
+    registry.observe('rag_stage_seconds', 0.5, stage='retrieval')
+    registry.inc('rag_queries_total', path='generate')
+    registry.set_gauge('rag_breaker_state', 2)
+    text = registry.to_prometheus()
+    assert 'rag_stage_seconds_bucket{stage="retrieval",le="0.1"} 1' in text
+    assert 'rag_stage_seconds_bucket{stage="retrieval",le="+Inf"} 2' in text
+    assert 'rag_stage_seconds_count{stage="retrieval"} 2' in text
+    assert 'rag_queries_total{path="generate"} 1' in text
+    assert 'rag_breaker_state 2' in text
+    assert registry.summary()['retrieval']['count'] == 2
@@ -0,0 +1,25 @@
+from model_router import complexity_score
+
+
+def s3_ref(uri, text="内容"):
+    return {'content': {'text': text}, 'location': {'type': 'S3', 's3Location': {'uri': uri}}}
+
+
+def custom_ref(source, text="内容"):
+    return {'content': {'text': text}, 'location': {'type': 'CUSTOM', 'customDocumentLocation': {'id': source}}}
+
+
+def test_source_spread_counts_local_and_hybrid_references():
+    question = "出差报销标准是多少？"
+    single = [custom_ref("finance_policy.md")] * 4
+    spread = [custom_ref(name) for name in ("finance_policy.md", "company_policy.md",
+                                            "it_support.md", "travel.md")]
+    assert complexity_score(question, spread) > complexity_score(question, single)
+
+
+def test_source_spread_matches_between_s3_and_custom_locations():
+    question = "出差报销标准是多少？"
+    names = ("finance_policy.md", "company_policy.md", "it_support.md")
+    s3 = [s3_ref(f"s3://bucket/documents/{name}") for name in names]
+    custom = [custom_ref(name) for name in names]
+    assert complexity_score(question, s3) == complexity_score(question, custom)
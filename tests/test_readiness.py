@@ -0,0 +1,130 @@
+import pytest
+
+from document_sync import has_completed_ingestion
+from fake_aws import FakeBedrockAgent
+from readiness import KnowledgeBaseWaiter, PhaseTimer, wait_until
+
+
+class FakeClock:
+    """sleep() 推进时间，测试不真正等待"""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def poll_options(clock, **options):
+    return dict(options, jitter=0.0, sleep=clock.sleep, clock=clock)
+
+
+def test_wait_until_returns_first_truthy_value():
+    clock = FakeClock()
+    results = iter([None, False, "ready"])
+    assert wait_until(lambda: next(results), "资源", **poll_options(clock)) == "ready"
+    assert clock.sleeps == [1.0, 2.0]
+
+
+def test_wait_until_backoff_is_capped():
+    clock = FakeClock()
+    results = iter([None] * 6 + [True])
+    wait_until(lambda: next(results), "资源", **poll_options(clock, initial_delay=1.0, max_delay=5.0))
+    assert clock.sleeps == [1.0, 2.0, 4.0, 5.0, 5.0, 5.0]
+
+
+def test_wait_until_deadline():
+    clock = FakeClock()
+    with pytest.raises(TimeoutError, match="资源"):
+        wait_until(lambda: None, "资源", **poll_options(clock, timeout=10.0))
+    # 最后一次等待截断到截止时间，不会超出
+    assert clock.now == pytest.approx(10.0)
+    assert clock.sleeps == [1.0, 2.0, 4.0, 3.0]
+
+
+def test_wait_until_jitter_stays_in_range():
+    clock = FakeClock()
+    results = iter([None] * 20 + [True])
+    wait_until(lambda: next(results), "资源", jitter=0.2, initial_delay=1.0, max_delay=1.0,
+               sleep=clock.sleep, clock=clock)
+    assert all(0.8 <= seconds <= 1.2 for seconds in clock.sleeps)
+
+
+def test_wait_until_propagates_failure():
+    def failed():
+        raise RuntimeError("失败")
+
+    with pytest.raises(RuntimeError, match="失败"):
+        wait_until(failed, "资源", **poll_options(FakeClock()))
+
+
+def make_waiter(agent, clock, **options):
+    return KnowledgeBaseWaiter(agent, "KB", "DS", **poll_options(clock, **options))
+
+
+def test_waits_for_knowledge_base_and_data_source():
+    agent = FakeBedrockAgent(kb_statuses=('CREATING', 'CREATING', 'ACTIVE'), ds_statuses=('CREATING', 'AVAILABLE'))
+    make_waiter(agent, FakeClock()).wait_for_knowledge_base()
+    assert agent.calls == {'GetKnowledgeBase': 3, 'GetDataSource': 2}
+
+
+@pytest.mark.parametrize('statuses', [('CREATING', 'FAILED'), ('DELETING',)])
+def test_knowledge_base_fail_states(statuses):
+    agent = FakeBedrockAgent(kb_statuses=statuses)
+    with pytest.raises(RuntimeError, match=statuses[-1]):
+        make_waiter(agent, FakeClock()).wait_for_knowledge_base()
+
+
+def test_data_source_fail_state():
+    agent = FakeBedrockAgent(ds_statuses=('DELETE_UNSUCCESSFUL',))
+    with pytest.raises(RuntimeError, match='DELETE_UNSUCCESSFUL'):
+        make_waiter(agent, FakeClock()).wait_for_knowledge_base()
+
+
+def test_waits_for_latest_ingestion_job():
+    agent = FakeBedrockAgent(job_statuses=('STARTING', 'IN_PROGRESS', 'COMPLETE'),
+                             statistics={'numberOfDocumentsScanned': 3})
+    job = make_waiter(agent, FakeClock()).wait_for_ingestion()
+    assert job['status'] == 'COMPLETE' and job['statistics']['numberOfDocumentsScanned'] == 3
+    assert agent.calls['GetIngestionJob'] == 3
+
+
+@pytest.mark.parametrize('status', ['FAILED', 'STOPPED'])
+def test_ingestion_fail_states(status):
+    agent = FakeBedrockAgent(job_statuses=('IN_PROGRESS', status))
+    with pytest.raises(RuntimeError, match=status):
+        make_waiter(agent, FakeClock()).wait_for_ingestion()
+
+
+def test_ingestion_without_job():
+    with pytest.raises(RuntimeError):
+        make_waiter(FakeBedrockAgent(job_statuses=()), FakeClock()).wait_for_ingestion()
+
+
+def test_ingestion_deadline():
+    clock = FakeClock()
+    agent = FakeBedrockAgent(job_statuses=('IN_PROGRESS',))
+    with pytest.raises(TimeoutError):
+        make_waiter(agent, clock, timeout=60.0).wait_for_ingestion()
+    assert clock.now == pytest.approx(60.0)
+
+
+def test_has_completed_ingestion():
+    assert has_completed_ingestion(FakeBedrockAgent(), "KB", "DS")
+    assert not has_completed_ingestion(FakeBedrockAgent(job_statuses=('IN_PROGRESS',)), "KB", "DS")
+    assert not has_completed_ingestion(FakeBedrockAgent(job_statuses=()), "KB", "DS")
+
+
+def test_phase_timer():
+    clock = FakeClock()
+    timer = PhaseTimer(clock=clock)
+    with timer.phase("上传"):
+        clock.sleep(2.0)
+    with timer.phase("摄取"):
+        clock.sleep(3.0)
+    assert timer.timings == [("上传", 2.0), ("摄取", 3.0)] and timer.total == 5.0
@@ -0,0 +1,42 @@
+import threading
+
+from fake_aws import FakeBedrockAgentRuntime, LatencyModel
+from kb_query import KnowledgeBaseQuery
+from model_router import ModelRouter
+from single_flight import SingleFlight
+
+KB_ID = "KB"
+MODEL_ARN = "arn:aws:bedrock:us-east-1::foundation-model/amazon.nova-pro-v1:0"
+QUESTION = "差旅费报销标准是多少？"
+
+
+def run_together(queries):
+    results = [None] * len(queries)
+
+    def run(i):
+        results[i] = queries[i].query(QUESTION)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(len(queries))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_same_configuration_is_coalesced():
+    client = FakeBedrockAgentRuntime(latency=LatencyModel("constant", 0.2))
+    flights = SingleFlight()
+    results = run_together([KnowledgeBaseQuery(client, KB_ID, MODEL_ARN, single_flight=flights) for _ in range(2)])
+    assert client.calls == 1
+    assert sorted(bool(result.get('coalesced')) for result in results) == [False, True]
+
+
+def test_different_configuration_is_not_coalesced():
+    client = FakeBedrockAgentRuntime(latency=LatencyModel("constant", 0.2))
+    flights = SingleFlight()
+    plain = KnowledgeBaseQuery(client, KB_ID, MODEL_ARN, single_flight=flights)
+    routed = KnowledgeBaseQuery(client, KB_ID, MODEL_ARN, single_flight=flights, router=ModelRouter())
+    results = run_together([plain, routed])
+    assert not any(result.get('coalesced') for result in results)
+    assert 'model_tier' not in results[0] and results[1].get('model_tier')
@@ -0,0 +1,112 @@
+import pytest
+from botocore.exceptions import ClientError
+
+from metrics import MetricsRegistry
+from throttling import CLOSED, HALF_OPEN, OPEN, AdaptiveRateLimiter, CircuitBreaker, CircuitOpenError, RequestGuard
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def client_error(code):
+    return ClientError({'Error': {'Code': code, 'Message': code}}, 'RetrieveAndGenerate')
+
+
+def test_breaker_opens_after_threshold():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=10.0, clock=clock)
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.state == CLOSED and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == OPEN and not breaker.allow()
+    clock.now = 4.0
+    assert breaker.retry_after() == pytest.approx(6.0)
+
+
+def test_success_resets_failure_count():
+    breaker = CircuitBreaker(failure_threshold=2, clock=FakeClock())
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+
+
+def test_half_open_allows_one_probe():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10.0, clock=clock)
+    breaker.record_failure()
+    clock.now = 10.0
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow()
+    # 探测请求未结束时，retry_after 为探测超时的剩余时间而不是 0
+    clock.now = 13.0
+    assert breaker.retry_after() == pytest.approx(7.0)
+    # 探测请求没有结果地中断，超时后再放行一个
+    clock.now = 20.0
+    assert breaker.allow()
+
+
+def test_half_open_probe_result():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10.0, clock=clock)
+    breaker.record_failure()
+    clock.now = 10.0
+    breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == OPEN and breaker.retry_after() == pytest.approx(10.0)
+
+    clock.now = 20.0
+    breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CLOSED and breaker.retry_after() == 0.0
+
+
+def test_guard_retries_throttling_then_opens():
+    calls = []
+
+    def throttled():
+        calls.append(1)
+        raise client_error('ThrottlingException')
+
+    # 限流后的速率下限足够高，测试不必等待令牌
+    guard = RequestGuard('test', limiter=AdaptiveRateLimiter(min_rate=1000.0),
+                         breaker=CircuitBreaker(failure_threshold=1), max_attempts=3,
+                         registry=MetricsRegistry(), sleep=lambda _: None)
+    with pytest.raises(ClientError):
+        guard.call(throttled)
+    assert len(calls) == 3
+    with pytest.raises(CircuitOpenError):
+        guard.call(throttled)
+    assert len(calls) == 3
+
+
+def test_guard_without_retries_calls_once():
+    calls = []
+
+    def unavailable():
+        calls.append(1)
+        raise client_error('ServiceUnavailableException')
+
+    guard = RequestGuard('test', max_attempts=1, registry=MetricsRegistry(), sleep=lambda _: None)
+    with pytest.raises(ClientError):
+        guard.call(unavailable)
+    assert len(calls) == 1
+
+
+def test_client_errors_do_not_open_breaker():
+    def invalid():
+        raise client_error('ValidationException')
+
+    guard = RequestGuard('test', breaker=CircuitBreaker(failure_threshold=1), registry=MetricsRegistry(),
+                         sleep=lambda _: None)
+    for _ in range(3):
+        with pytest.raises(ClientError):
+            guard.call(invalid)
+    assert guard.breaker.state == CLOSED
@@ -0,0 +1,100 @@
+import os
+
+from boto3.exceptions import S3UploadFailedError
+from botocore.exceptions import ClientError
+
+from fake_aws import FakeS3
+from upload_engine import ParallelUploader
+
+BUCKET = "test-bucket"
+
+
+class FlakyS3(FakeS3):
+    """前 failures 次上传抛出 code 错误"""
+
+    def __init__(self, code, failures, wrap=False):
+        super().__init__()
+        self.code = code
+        self.failures = failures
+        self.wrap = wrap
+        self.attempts = 0
+
+    def upload_file(self, Filename, Bucket, Key, ExtraArgs=None, Callback=None, Config=None):
+        self.attempts += 1
+        if self.attempts <= self.failures:
+            error = ClientError({'Error': {'Code': self.code, 'Message': self.code}}, 'PutObject')
+            if not self.wrap:
+                raise error
+            # boto3 的 S3Transfer 把 ClientError 包装成 S3UploadFailedError
+            try:
+                raise error
+            except ClientError:
+                raise S3UploadFailedError(f"Failed to upload {Filename}: {error}")
+        super().upload_file(Filename, Bucket, Key, ExtraArgs, Callback, Config)
+
+
+def make_files(tmp_path, count):
+    items = []
+    for i in range(count):
+        path = tmp_path / f"doc_{i}.md"
+        path.write_text(f"# 文档 {i}\n", encoding='utf-8')
+        items.append((str(path), f"documents/doc_{i}.md"))
+    return items
+
+
+def make_uploader(s3, sleeps=None, **options):
+    return ParallelUploader(s3, sleep=sleeps.append if sleeps is not None else lambda _: None, **options)
+
+
+def test_uploads_all_files_concurrently(tmp_path):
+    s3 = FakeS3()
+    items = make_files(tmp_path, 20)
+    report = make_uploader(s3, max_workers=4, fetch_etags=True).upload_files(items, BUCKET)
+    assert report.uploaded_files == 20 and not report.failed
+    assert report.uploaded_bytes == sum(os.path.getsize(path) for path, _ in items)
+    assert set(report.etags) == {key for _, key in items}
+    assert report.etags["documents/doc_0.md"] == s3.objects[(BUCKET, "documents/doc_0.md")][1]
+
+
+def test_retryable_error_is_retried_with_backoff(tmp_path):
+    s3 = FlakyS3('SlowDown', failures=2)
+    sleeps = []
+    report = make_uploader(s3, sleeps, backoff_base=1.0, backoff_max=8.0).upload_files(make_files(tmp_path, 1),
+                                                                                      BUCKET)
+    assert report.uploaded_files == 1 and report.retries == 2
+    # 抖动范围为 [delay / 2, delay]，delay 按 1、2 秒指数增长
+    assert 0.5 <= sleeps[0] <= 1.0 and 1.0 <= sleeps[1] <= 2.0
+
+
+def test_wrapped_client_error_is_classified(tmp_path):
+    s3 = FlakyS3('InternalError', failures=1, wrap=True)
+    report = make_uploader(s3).upload_files(make_files(tmp_path, 1), BUCKET)
+    assert report.uploaded_files == 1 and report.retries == 1
+
+
+def test_retries_are_bounded(tmp_path):
+    s3 = FlakyS3('SlowDown', failures=10)
+    report = make_uploader(s3, max_attempts=3).upload_files(make_files(tmp_path, 1), BUCKET)
+    assert s3.attempts == 3 and report.retries == 2
+    assert list(report.failed) == ["documents/doc_0.md"]
+
+
+def test_non_retryable_error_fails_immediately(tmp_path):
+    for wrap in (False, True):
+        s3 = FlakyS3('AccessDenied', failures=10, wrap=wrap)
+        report = make_uploader(s3).upload_files(make_files(tmp_path, 1), BUCKET)
+        assert s3.attempts == 1 and report.retries == 0
+        assert "documents/doc_0.md" in report.failed
+
+
+def test_file_removed_during_upload_fails_without_retry(tmp_path):
+    class VanishingS3(FakeS3):
+        attempts = 0
+
+        def upload_file(self, Filename, *args, **kwargs):
+            self.attempts += 1
+            raise FileNotFoundError(Filename)
+
+    s3 = VanishingS3()
+    report = make_uploader(s3).upload_files(make_files(tmp_path, 1), BUCKET)
+    assert s3.attempts == 1 and list(report.failed) == ["documents/doc_0.md"]
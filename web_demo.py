@@ -5,51 +5,70 @@
 """
 
 import streamlit as st
-import boto3
 import time
+import sys
+import os
 from datetime import datetime
 
+# 添加 src 目录以使用共享模块
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src'))
+from answer_cache import build_answer_cache
+from retrieval_cache import build_retrieval_cache
+from kb_query import KnowledgeBaseQuery
+from aws_clients import get_client
+from throttling import get_guard
+from metrics import REGISTRY, observe_stage
+from single_flight import SingleFlight
+from model_router import ModelRouter
+
 class EnterpriseRAGDemo:
-    def __init__(self):
-        self.client = boto3.client('bedrock-agent-runtime')
+    def __init__(self, cache_factory=build_answer_cache, client=None,
+                 retriever=None, fast_path=None, single_flight=None, guard=None, retrieve_guard=None,
+                 router=None, retrieval_cache_factory=None):
+        self.client = client or get_client('bedrock-agent-runtime')
         self.kb_id = "HCDVL6Q0KZ"
         self.model_arn = "arn:aws:bedrock:us-east-1::foundation-model/amazon.nova-pro-v1:0"
+        self.cache = cache_factory(self.kb_id, self.model_arn) if cache_factory else None
+        self.retrieval_cache = retrieval_cache_factory(self.kb_id) if retrieval_cache_factory else None
+        self.kb_query = KnowledgeBaseQuery(self.client, self.kb_id, self.model_arn, cache=self.cache,
+                                           retriever=retriever, fast_path=fast_path,
+                                           single_flight=single_flight,
+                                           guard=guard or get_guard('retrieve_and_generate'),
+                                           retrieve_guard=retrieve_guard or get_guard('retrieve'),
+                                           router=router, retrieval_cache=self.retrieval_cache)
         
     def query(self, question):
-        """查询知识库"""
-        try:
-            start_time = time.time()
-            response = self.client.retrieve_and_generate(
-                input={'text': question},
-                retrieveAndGenerateConfiguration={
-                    'type': 'KNOWLEDGE_BASE',
-                    'knowledgeBaseConfiguration': {
-                        'knowledgeBaseId': self.kb_id,
-                        'modelArn': self.model_arn
-                    }
-                }
-            )
-            end_time = time.time()
-            
-            answer = response['output']['text']
-            citations = []
-            
-            # 提取引用来源
-            for citation in response.get('citations', []):
-                for ref in citation.get('retrievedReferences', []):
-                    source = ref.get('location', {}).get('s3Location', {}).get('uri', '')
-                    if source:
-                        filename = source.split('/')[-1]
-                        citations.append(filename)
-            
-            return {
-                'answer': answer,
-                'citations': list(set(citations)),
-                'response_time': end_time - start_time
-            }
-            
-        except Exception as e:
-            return {'error': str(e)}
+        """查询知识库（命中问答缓存时直接返回）"""
+        return self.kb_query.query(question)
+    
+    def stream_query(self, question):
+        """流式查询知识库，迭代得到回答片段，结束后从 result 获取完整结果"""
+        return self.kb_query.stream_query(question)
+
+@st.cache_resource
+def get_bedrock_client():
+    """进程内共享的 Bedrock 客户端及连接池，新浏览器会话不再重新建立连接"""
+    return get_client('bedrock-agent-runtime')
+
+@st.cache_resource
+def get_answer_cache(kb_id, model_arn):
+    """进程内共享的问答缓存，所有浏览器会话共用"""
+    return build_answer_cache(kb_id, model_arn)
+
+@st.cache_resource
+def get_retrieval_cache(kb_id):
+    """进程内共享的检索结果缓存（设置环境变量 RAG_RETRIEVAL_CACHE=1 时启用）"""
+    return build_retrieval_cache(kb_id)
+
+@st.cache_resource
+def get_single_flight():
+    """进程内共享的请求合并：多个浏览器会话同时问相同问题时只调用一次模型"""
+    return SingleFlight()
+
+@st.cache_resource
+def get_model_router():
+    """按问题复杂度选择模型档位（设置环境变量 RAG_MODEL_ROUTING=1 时启用），否则固定使用 Nova Pro"""
+    return ModelRouter() if os.environ.get('RAG_MODEL_ROUTING') == '1' else None
 
 def main():
     # 页面配置
@@ -61,7 +80,10 @@ def main():
     
     # 初始化RAG系统
     if 'rag_demo' not in st.session_state:
-        st.session_state.rag_demo = EnterpriseRAGDemo()
+        retrieval_cache_factory = get_retrieval_cache if os.environ.get('RAG_RETRIEVAL_CACHE') == '1' else None
+        st.session_state.rag_demo = EnterpriseRAGDemo(cache_factory=get_answer_cache, client=get_bedrock_client(),
+                                                     single_flight=get_single_flight(), router=get_model_router(),
+                                                     retrieval_cache_factory=retrieval_cache_factory)
     
     # 页面标题
     st.title("🏢 企业文档检索 RAG 系统")
@@ -71,7 +93,7 @@ def main():
     with st.sidebar:
         st.header("📋 系统信息")
         st.info(f"**知识库 ID:** {st.session_state.rag_demo.kb_id}")
-        st.info("**使用模型:** Amazon Nova Pro")
+        st.info("**使用模型:** " + ("Amazon Nova Micro / Lite / Pro（按问题复杂度）" if get_model_router() else "Amazon Nova Pro"))
         
         st.header("💡 示例问题")
         example_questions = [
@@ -107,10 +129,7 @@ def main():
         # 查询按钮
         if st.button("🔍 查询", type="primary"):
             if question.strip():
-                with st.spinner("正在查询，请稍候..."):
-                    result = st.session_state.rag_demo.query(question)
-                    st.session_state.last_result = result
-                    st.session_state.last_question = question
+                st.session_state.pending_question = question
             else:
                 st.warning("请输入问题后再查询")
     
@@ -127,6 +146,46 @@ def main():
         if st.session_state.query_count > 0:
             avg_time = st.session_state.total_time / st.session_state.query_count
             st.metric("平均响应时间", f"{avg_time:.2f}秒")
+        
+        cache = st.session_state.rag_demo.cache
+        if cache is not None:
+            st.metric("缓存命中率", f"{cache.hit_rate:.0%}")
+        retrieval_cache = st.session_state.rag_demo.retrieval_cache
+        if retrieval_cache is not None:
+            st.metric("检索缓存命中率", f"{retrieval_cache.stats()['hit_rate']:.0%}")
+        flights = get_single_flight().stats()
+        if flights['saved_calls']:
+            st.metric("合并的重复请求", flights['saved_calls'], help=f"合并比例 {flights['coalescing_ratio']:.0%}")
+        
+        summary = REGISTRY.summary()
+        if summary:
+            with st.expander("⏱️ 阶段耗时（所有会话）"):
+                st.dataframe([
+                    {'阶段': stage, '次数': row['count'], 'P50 (秒)': round(row['p50'], 3),
+                     'P95 (秒)': round(row['p95'], 3)}
+                    for stage, row in summary.items()
+                ], hide_index=True, use_container_width=True)
+                st.download_button("下载指标 (Prometheus)", REGISTRY.to_prometheus(), file_name="metrics.prom")
+    
+    # 流式显示新的查询结果
+    pending_question = st.session_state.pop('pending_question', None)
+    if pending_question:
+        st.markdown("---")
+        st.header("🤖 查询结果")
+        st.subheader(f"🔍 问题: {pending_question}")
+        st.markdown("**📝 回答:**")
+        stream = st.session_state.rag_demo.stream_query(pending_question)
+        st.write_stream(stream)
+        
+        result = stream.result
+        if 'error' not in result:
+            # 更新统计数据
+            st.session_state.query_count += 1
+            st.session_state.total_time += result['response_time']
+        st.session_state.last_result = result
+        st.session_state.last_question = pending_question
+        st.session_state.render_pending = True
+        st.rerun()
     
     # 显示查询结果
     if 'last_result' in st.session_state and 'last_question' in st.session_state:
@@ -139,16 +198,18 @@ def main():
         # 显示问题
         st.subheader(f"🔍 问题: {question}")
         
-        if 'error' in result:
+        if 'error' in result and result.get('retry_after') is not None:
+            st.warning(f"⏳ 服务繁忙，请 {result['retry_after']:.0f} 秒后重试")
+        elif 'error' in result:
             st.error(f"❌ 查询失败: {result['error']}")
         else:
-            # 更新统计数据
-            st.session_state.query_count += 1
-            st.session_state.total_time += result['response_time']
-            
             # 显示答案
-            st.success("✅ 查询成功")
+            if result.get('degraded'):
+                st.warning("⚠️ 模型暂时不可用，以下为检索到的原文片段")
+            else:
+                st.success("✅ 查询成功")
             
+            render_start = time.perf_counter()
             # 答案区域
             with st.container():
                 st.markdown("**📝 回答:**")
@@ -160,8 +221,23 @@ def main():
                 for citation in result['citations']:
                     st.markdown(f"- {citation}")
             
+            # 只记录查询后的首次渲染，之后的重跑不计入
+            if st.session_state.pop('render_pending', False):
+                observe_stage('render', time.perf_counter() - render_start)
+            
             # 响应时间
             st.markdown(f"**⏱️ 响应时间:** {result['response_time']:.2f} 秒")
+            if result.get('time_to_first_chunk') is not None:
+                st.markdown(f"**⚡ 首字时间:** {result['time_to_first_chunk']:.2f} 秒")
+            if result.get('cached'):
+                st.caption("⚡ 来自缓存")
+            if result.get('coalesced'):
+                st.caption("🔗 与其他用户同时提出的相同问题合并查询")
+            if result.get('model_tier'):
+                st.caption(f"⚙️ 模型档位: {result['model_tier']}" + (f"（升级 {result['escalations']} 次）" if result['escalations'] else ""))
+            if result.get('timings'):
+                st.caption("阶段耗时: " + " · ".join(
+                    f"{stage} {seconds:.2f}秒" for stage, seconds in result['timings'].items()))
     
     # 页脚
     st.markdown("---")
@@ -5,51 +5,70 @@ Streamlitベースのウェブインターフェース
 """
 
 import streamlit as st
-import boto3
 import time
+import sys
+import os
 from datetime import datetime
 
+# 共有モジュールを使用するため src ディレクトリを追加
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src'))
+from answer_cache import build_answer_cache
+from retrieval_cache import build_retrieval_cache
+from kb_query import KnowledgeBaseQuery
+from aws_clients import get_client
+from throttling import get_guard
+from metrics import REGISTRY, observe_stage
+from single_flight import SingleFlight
+from model_router import ModelRouter
+
 class EnterpriseRAGDemo:
-    def __init__(self):
-        self.client = boto3.client('bedrock-agent-runtime')
+    def __init__(self, cache_factory=build_answer_cache, client=None,
+                 retriever=None, fast_path=None, single_flight=None, guard=None, retrieve_guard=None,
+                 router=None, retrieval_cache_factory=None):
+        self.client = client or get_client('bedrock-agent-runtime')
         self.kb_id = "HCDVL6Q0KZ"
         self.model_arn = "arn:aws:bedrock:us-east-1::foundation-model/amazon.nova-pro-v1:0"
+        self.cache = cache_factory(self.kb_id, self.model_arn) if cache_factory else None
+        self.retrieval_cache = retrieval_cache_factory(self.kb_id) if retrieval_cache_factory else None
+        self.kb_query = KnowledgeBaseQuery(self.client, self.kb_id, self.model_arn, cache=self.cache,
+                                           retriever=retriever, fast_path=fast_path,
+                                           single_flight=single_flight,
+                                           guard=guard or get_guard('retrieve_and_generate'),
+                                           retrieve_guard=retrieve_guard or get_guard('retrieve'),
+                                           router=router, retrieval_cache=self.retrieval_cache)
         
     def query(self, question):
-        """ナレッジベースにクエリ"""
-        try:
-            start_time = time.time()
-            response = self.client.retrieve_and_generate(
-                input={'text': question},
-                retrieveAndGenerateConfiguration={
-                    'type': 'KNOWLEDGE_BASE',
-                    'knowledgeBaseConfiguration': {
-                        'knowledgeBaseId': self.kb_id,
-                        'modelArn': self.model_arn
-                    }
-                }
-            )
-            end_time = time.time()
-            
-            answer = response['output']['text']
-            citations = []
-            
-            # 引用ソースの抽出
-            for citation in response.get('citations', []):
-                for ref in citation.get('retrievedReferences', []):
-                    source = ref.get('location', {}).get('s3Location', {}).get('uri', '')
-                    if source:
-                        filename = source.split('/')[-1]
-                        citations.append(filename)
-            
-            return {
-                'answer': answer,
-                'citations': list(set(citations)),
-                'response_time': end_time - start_time
-            }
-            
-        except Exception as e:
-            return {'error': str(e)}
+        """ナレッジベースにクエリ（回答キャッシュにヒットした場合は即座に返す）"""
+        return self.kb_query.query(question)
+    
+    def stream_query(self, question):
+        """ナレッジベースにストリーミングクエリ（回答の断片を順に返し、終了後 result で完全な結果を取得）"""
+        return self.kb_query.stream_query(question)
+
+@st.cache_resource
+def get_bedrock_client():
+    """プロセス内で共有する Bedrock クライアントと接続プール（新しいブラウザセッションで再接続しない）"""
+    return get_client('bedrock-agent-runtime')
+
+@st.cache_resource
+def get_answer_cache(kb_id, model_arn):
+    """プロセス内で共有する回答キャッシュ（全ブラウザセッション共通）"""
+    return build_answer_cache(kb_id, model_arn)
+
+@st.cache_resource
+def get_retrieval_cache(kb_id):
+    """プロセス内で共有する検索結果キャッシュ（環境変数 RAG_RETRIEVAL_CACHE=1 で有効）"""
+    return build_retrieval_cache(kb_id)
+
+@st.cache_resource
+def get_single_flight():
+    """プロセス内で共有するリクエスト統合（複数のブラウザセッションが同じ質問をした場合、モデル呼び出しは1回のみ）"""
+    return SingleFlight()
+
+@st.cache_resource
+def get_model_router():
+    """質問の複雑さに応じてモデルを選択（環境変数 RAG_MODEL_ROUTING=1 で有効）、無効時は Nova Pro 固定"""
+    return ModelRouter() if os.environ.get('RAG_MODEL_ROUTING') == '1' else None
 
 def main():
     # ページ設定
@@ -61,7 +80,10 @@ def main():
     
     # RAGシステムの初期化
     if 'rag_demo' not in st.session_state:
-        st.session_state.rag_demo = EnterpriseRAGDemo()
+        retrieval_cache_factory = get_retrieval_cache if os.environ.get('RAG_RETRIEVAL_CACHE') == '1' else None
+        st.session_state.rag_demo = EnterpriseRAGDemo(cache_factory=get_answer_cache, client=get_bedrock_client(),
+                                                     single_flight=get_single_flight(), router=get_model_router(),
+                                                     retrieval_cache_factory=retrieval_cache_factory)
     
     # ページタイトル
     st.title("🏢 企業文書検索RAGシステム")
@@ -71,7 +93,7 @@ def main():
     with st.sidebar:
         st.header("📋 システム情報")
         st.info(f"**ナレッジベースID:** {st.session_state.rag_demo.kb_id}")
-        st.info("**使用モデル:** Amazon Nova Pro")
+        st.info("**使用モデル:** " + ("Amazon Nova Micro / Lite / Pro（質問の複雑さで選択）" if get_model_router() else "Amazon Nova Pro"))
         
         st.header("💡 サンプル質問")
         example_questions = [
@@ -107,10 +129,7 @@ def main():
         # 検索ボタン
         if st.button("🔍 検索", type="primary"):
             if question.strip():
-                with st.spinner("検索中です。しばらくお待ちください..."):
-                    result = st.session_state.rag_demo.query(question)
-                    st.session_state.last_result = result
-                    st.session_state.last_question = question
+                st.session_state.pending_question = question
             else:
                 st.warning("質問を入力してから検索してください")
     
@@ -127,6 +146,46 @@ def main():
         if st.session_state.query_count > 0:
             avg_time = st.session_state.total_time / st.session_state.query_count
             st.metric("平均応答時間", f"{avg_time:.2f}秒")
+        
+        cache = st.session_state.rag_demo.cache
+        if cache is not None:
+            st.metric("キャッシュヒット率", f"{cache.hit_rate:.0%}")
+        retrieval_cache = st.session_state.rag_demo.retrieval_cache
+        if retrieval_cache is not None:
+            st.metric("検索キャッシュヒット率", f"{retrieval_cache.stats()['hit_rate']:.0%}")
+        flights = get_single_flight().stats()
+        if flights['saved_calls']:
+            st.metric("統合された重複リクエスト", flights['saved_calls'], help=f"統合率 {flights['coalescing_ratio']:.0%}")
+        
+        summary = REGISTRY.summary()
+        if summary:
+            with st.expander("⏱️ ステージ別所要時間（全セッション）"):
+                st.dataframe([
+                    {'ステージ': stage, '回数': row['count'], 'P50 (秒)': round(row['p50'], 3),
+                     'P95 (秒)': round(row['p95'], 3)}
+                    for stage, row in summary.items()
+                ], hide_index=True, use_container_width=True)
+                st.download_button("メトリクスをダウンロード (Prometheus)", REGISTRY.to_prometheus(), file_name="metrics.prom")
+    
+    # 新しい検索結果をストリーミング表示
+    pending_question = st.session_state.pop('pending_question', None)
+    if pending_question:
+        st.markdown("---")
+        st.header("🤖 検索結果")
+        st.subheader(f"🔍 質問: {pending_question}")
+        st.markdown("**📝 回答:**")
+        stream = st.session_state.rag_demo.stream_query(pending_question)
+        st.write_stream(stream)
+        
+        result = stream.result
+        if 'error' not in result:
+            # 統計データの更新
+            st.session_state.query_count += 1
+            st.session_state.total_time += result['response_time']
+        st.session_state.last_result = result
+        st.session_state.last_question = pending_question
+        st.session_state.render_pending = True
+        st.rerun()
     
     # クエリ結果の表示
     if 'last_result' in st.session_state and 'last_question' in st.session_state:
@@ -139,16 +198,18 @@ def main():
         # 質問の表示
         st.subheader(f"🔍 質問: {question}")
         
-        if 'error' in result:
+        if 'error' in result and result.get('retry_after') is not None:
+            st.warning(f"⏳ サービスが混み合っています。{result['retry_after']:.0f} 秒後に再試行してください")
+        elif 'error' in result:
             st.error(f"❌ クエリ失敗: {result['error']}")
         else:
-            # 統計データの更新
-            st.session_state.query_count += 1
-            st.session_state.total_time += result['response_time']
-            
             # 回答の表示
-            st.success("✅ 検索成功")
+            if result.get('degraded'):
+                st.warning("⚠️ モデルが一時的に利用できないため、検索された文書の抜粋を表示しています")
+            else:
+                st.success("✅ 検索成功")
             
+            render_start = time.perf_counter()
             # 回答エリア
             with st.container():
                 st.markdown("**📝 回答:**")
@@ -160,8 +221,23 @@ def main():
                 for citation in result['citations']:
                     st.markdown(f"- {citation}")
             
+            # クエリ直後の初回描画のみ記録し、以降の再実行は含めない
+            if st.session_state.pop('render_pending', False):
+                observe_stage('render', time.perf_counter() - render_start)
+            
             # 応答時間
             st.markdown(f"**⏱️ 応答時間:** {result['response_time']:.2f} 秒")
+            if result.get('time_to_first_chunk') is not None:
+                st.markdown(f"**⚡ 最初の応答まで:** {result['time_to_first_chunk']:.2f} 秒")
+            if result.get('cached'):
+                st.caption("⚡ キャッシュから応答")
+            if result.get('coalesced'):
+                st.caption("🔗 他のユーザーの同じ質問とまとめて検索")
+            if result.get('model_tier'):
+                st.caption(f"⚙️ モデル: {result['model_tier']}" + (f"（{result['escalations']} 回昇格）" if result['escalations'] else ""))
+            if result.get('timings'):
+                st.caption("ステージ別所要時間: " + " · ".join(
+                    f"{stage} {seconds:.2f}秒" for stage, seconds in result['timings'].items()))
     
     # フッター
     st.markdown("---")